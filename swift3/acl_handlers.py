@@ -20,6 +20,7 @@ from swift3.response import MissingSecurityHeader, \
     MalformedACLError, UnexpectedContent
 from swift3.etree import fromstring, XMLSyntaxError, DocumentInvalid
 from swift3.utils import LOGGER, MULTIUPLOAD_SUFFIX, sysmeta_header
+from swift3 import tracing
 
 
 """
@@ -137,17 +138,18 @@ class BaseAclHandler(object):
         if not permission:
             raise Exception('No permission to be checked exists')
 
-        if resource == 'object':
-            resp = self.req.get_acl_response(app, 'HEAD',
-                                             container, obj,
-                                             headers)
-            acl = resp.object_acl
-        elif resource == 'container':
-            resp = self.req.get_acl_response(app, 'HEAD',
-                                             container, '')
-            acl = resp.bucket_acl
-
-        acl.check_permission(self.user_id, permission)
+        with tracing.span('acl', resource=resource, permission=permission):
+            if resource == 'object':
+                resp = self.req.get_acl_response(app, 'HEAD',
+                                                 container, obj,
+                                                 headers)
+                acl = resp.object_acl
+            elif resource == 'container':
+                resp = self.req.get_acl_response(app, 'HEAD',
+                                                 container, '')
+                acl = resp.bucket_acl
+
+            acl.check_permission(self.user_id, permission)
 
         if sw_method == 'HEAD':
             return resp
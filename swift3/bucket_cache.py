@@ -0,0 +1,115 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Caches of what the controllers know about the buckets.  The controllers fill
+them, and the request drops what a change to a bucket makes stale, so they
+live here rather than in either of them.
+"""
+
+from hashlib import sha256
+from uuid import uuid4
+
+from swift.common.utils import cache_from_env
+
+from swift3.cache import LRUCache
+from swift3.cfg import CONF
+
+# Results of the bucket owner checks of GET Service, keyed by (account,
+# bucket), as dicts from user ids to whether the bucket is listed for them.
+BUCKET_OWNER_CACHE = LRUCache(maxsize=CONF.bucket_owner_cache_size,
+                              maxtime=CONF.bucket_owner_cache_time)
+
+# Swift listings of the buckets with the local listing_cache_backend, keyed by
+# the listing query and the version of the bucket in LISTING_VERSIONS.  A new
+# version is made when the bucket is changed, so that its cached and
+# prefetched listings are never served again.
+LISTING_CACHE = LRUCache(maxsize=CONF.listing_cache_size,
+                         maxtime=CONF.listing_cache_time)
+LISTING_VERSIONS = LRUCache(maxsize=CONF.listing_cache_size)
+
+
+def _cache_get(env, local_cache, key):
+    if CONF.listing_cache_backend == 'memcache':
+        memcache_client = cache_from_env(env, True)
+        if memcache_client is None:
+            return None
+        return memcache_client.get(key)
+    return local_cache.get(key)
+
+
+def _cache_set(env, local_cache, key, value, ttl):
+    if CONF.listing_cache_backend == 'memcache':
+        memcache_client = cache_from_env(env, True)
+        if memcache_client is not None:
+            memcache_client.set(key, value, time=ttl)
+    else:
+        local_cache.set(key, value)
+
+
+def _cache_delete(env, local_cache, key):
+    if CONF.listing_cache_backend == 'memcache':
+        memcache_client = cache_from_env(env, True)
+        if memcache_client is not None:
+            memcache_client.delete(key)
+    else:
+        local_cache.pop(key)
+
+
+def _listing_version_key(account, container):
+    return 'swift3/listing_version/%s/%s' % (account, container)
+
+
+def listing_version(env, account, container):
+    """
+    Returns the current version of the bucket listings, making one if the
+    bucket has none.
+    """
+    version_key = _listing_version_key(account, container)
+    version = _cache_get(env, LISTING_VERSIONS, version_key)
+    if version is None:
+        version = uuid4().hex
+        _cache_set(env, LISTING_VERSIONS, version_key, version, 0)
+    return str(version)
+
+
+def listing_cache_key(env, account, container, query):
+    """
+    Returns the key of the listing for the query in the current version of
+    the bucket.
+    """
+    key = repr((account, container, listing_version(env, account, container),
+                sorted(query.items())))
+    return 'swift3/listing/%s' % sha256(key).hexdigest()
+
+
+def get_listing(env, key):
+    """
+    Returns the cached body of the listing, or None.
+    """
+    return _cache_get(env, LISTING_CACHE, key)
+
+
+def set_listing(env, key, body):
+    _cache_set(env, LISTING_CACHE, key, body, CONF.listing_cache_time)
+
+
+def forget_listings(env, account, container):
+    """
+    Drop the cached and prefetched listings of the bucket, by dropping its
+    version.
+    """
+    if CONF.listing_cache_time > 0 or CONF.listing_prefetch_time > 0:
+        _cache_delete(env, LISTING_VERSIONS,
+                      _listing_version_key(account, container))
@@ -0,0 +1,247 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import time
+
+from eventlet.event import Event
+
+
+class LRUCache(object):
+    """
+    A size bounded mapping which evicts the least recently used entry.
+
+    Entries older than ``maxtime`` seconds are handled as missing.  Setting
+    ``maxsize`` to 0 disables the cache.  The ``hits``, ``misses`` and
+    ``evictions`` counters are kept so that callers can report how well the
+    cache works.
+
+    Note that no method yields to the eventlet hub, so an instance can be
+    shared between green threads without locking.
+    """
+    def __init__(self, maxsize=1000, maxtime=None):
+        self.maxsize = maxsize
+        self.maxtime = maxtime
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            return None
+
+        cached_at, value = entry
+        if self.maxtime is not None and cached_at + self.maxtime < time.time():
+            return None
+
+        # move the entry to the most recently used end
+        self._entries[key] = entry
+        return entry
+
+    def get(self, key, default=None):
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return value
+
+        self._entries.pop(key, None)
+        while len(self._entries) >= self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._entries[key] = (time.time(), value)
+        return value
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """
+        Returns a dict of the cache counters.
+        """
+        return {'size': len(self._entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class RequestCoalescer(object):
+    """
+    Collapses concurrent calls which share a key into a single call.
+
+    The first caller for a key runs the function, and callers arriving while
+    it is still in flight wait for it and share its result.  A failed call is
+    not shared unless ``share_failures`` is set: each waiting caller then
+    makes the call on its own.  Otherwise they all get the exception raised
+    by the first caller, e.g. so that a service which is down is not called
+    once per waiting caller.
+    """
+    def __init__(self, share_failures=False):
+        self.share_failures = share_failures
+        self._in_flight = {}
+        self.coalesced = 0
+
+    def run(self, key, func, *args, **kwargs):
+        event = self._in_flight.get(key)
+        if event is not None:
+            succeeded, result = event.wait()
+            if succeeded:
+                self.coalesced += 1
+                return result
+            if self.share_failures and result is not None:
+                # the exception raised by the first caller
+                self.coalesced += 1
+                raise result
+            return func(*args, **kwargs)
+
+        event = self._in_flight[key] = Event()
+        succeeded, result = False, None
+        try:
+            result = func(*args, **kwargs)
+            succeeded = True
+            return result
+        except Exception as e:
+            result = e
+            raise
+        finally:
+            del self._in_flight[key]
+            event.send((succeeded, result))
+
+
+class FailureBackoff(object):
+    """
+    Tracks failures per key and backs off the keys which keep failing.
+
+    Once a key has failed ``threshold`` times in a row, it is blocked for
+    ``backoff`` seconds, and each further failure doubles that delay up to
+    ``max_backoff`` seconds.  A key is forgotten after a success, or once it
+    has not failed for ``max_backoff`` seconds.  Setting ``threshold`` to 0
+    disables the backoff.
+    """
+    def __init__(self, threshold=0, backoff=1, max_backoff=300,
+                 maxsize=10000):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # key -> (number of failures, blocked until)
+        self._failures = LRUCache(maxsize=maxsize, maxtime=max_backoff)
+
+    def blocked(self, key):
+        """
+        Returns the number of seconds for which the key is still blocked, or
+        0 if it is not blocked.
+        """
+        if self.threshold <= 0:
+            return 0
+        entry = self._failures._lookup(key)
+        if entry is None:
+            return 0
+        return max(0, entry[1][1] - time.time())
+
+    def failure(self, key):
+        if self.threshold <= 0:
+            return
+        entry = self._failures._lookup(key)
+        failures = entry[1][0] + 1 if entry else 1
+        blocked_until = 0
+        if failures >= self.threshold:
+            delay = self.backoff * 2 ** min(failures - self.threshold, 32)
+            blocked_until = time.time() + min(delay, self.max_backoff)
+        self._failures.set(key, (failures, blocked_until))
+
+    def success(self, key):
+        self._failures.pop(key)
+
+    def __len__(self):
+        return len(self._failures)
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing service for a while.
+
+    The breaker opens after ``threshold`` consecutive failures, and
+    :meth:`allow` then returns False so that callers fail fast instead of
+    waiting on the service.  Every ``reset_timeout`` seconds a single trial
+    call is let through while the breaker is half open: a success closes the
+    breaker, and a failure opens it again.  Setting ``threshold`` to 0
+    disables the breaker.
+
+    ``on_change`` is called with the old and the new state on every
+    transition, and the ``transitions`` counters are kept per new state.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=0, reset_timeout=30, on_change=None):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.state = self.CLOSED
+        self.failures = 0
+        self.transitions = {self.OPEN: 0, self.HALF_OPEN: 0, self.CLOSED: 0}
+        self._retry_at = 0
+
+    def _change(self, state):
+        old_state, self.state = self.state, state
+        self.transitions[state] += 1
+        if self.on_change:
+            self.on_change(old_state, state)
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        now = time.time()
+        if now < self._retry_at:
+            return False
+        # let one trial call through per reset_timeout, even if an earlier
+        # one never reported back
+        self._retry_at = now + self.reset_timeout
+        if self.state == self.OPEN:
+            self._change(self.HALF_OPEN)
+        return True
+
+    def success(self):
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._change(self.CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and
+                0 < self.threshold <= self.failures):
+            self._retry_at = time.time() + self.reset_timeout
+            self._change(self.OPEN)
@@ -69,4 +69,27 @@ CONF = Config({
     'force_swift_request_proxy_log': False,
     'allow_multipart_uploads': True,
     'min_segment_size': 5242880,
+    'signing_key_cache_size': 1000,
+    'payload_hash_offload_size': 0,
+    'auth_cache_time': 0,
+    'auth_cache_size': 10000,
+    'container_info_cache_time': 0,
+    'container_info_cache_size': 10000,
+    'check_bucket_owner_concurrency': 10,
+    'bucket_owner_cache_time': 0,
+    'bucket_owner_cache_size': 10000,
+    'listing_prefetch_time': 0,
+    'listing_prefetch_size': 100,
+    'listing_prefetch_concurrency': 10,
+    'listing_cache_time': 0,
+    'listing_cache_backend': 'local',
+    'listing_cache_size': 1000,
+    'profile_sample_rate': 0.0,
+    'profile_access_keys': '',
+    'profile_dir': '/tmp/swift3-profile',
+    'profile_dump_interval': 300,
+    'profile_dump_count': 24,
+    'trace_sample_rate': 0.0,
+    'trace_exporter': 'file',
+    'trace_file': '/tmp/swift3-trace.log',
 })
@@ -13,22 +13,39 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from base64 import b64decode, b64encode
 import sys
 
+from eventlet import GreenPool
+
 from swift.common.http import HTTP_OK
 from swift.common.utils import json, public
 
 from swift3.controllers.base import Controller
-from swift3.etree import Element, SubElement, tostring, fromstring, \
-    XMLSyntaxError, DocumentInvalid
+from swift3.etree import Element, SubElement, fromstring, tostring_iter, \
+    text_element, XMLSyntaxError, DocumentInvalid
 from swift3.response import HTTPOk, S3NotImplemented, InvalidArgument, \
     MalformedXML, InvalidLocationConstraint, NoSuchBucket, \
     BucketNotEmpty, InternalError, ServiceUnavailable, NoSuchKey
 from swift3.cfg import CONF
-from swift3.utils import LOGGER, MULTIUPLOAD_SUFFIX
+from swift3.cache import LRUCache, RequestCoalescer
+from swift3.bucket_cache import listing_cache_key, listing_version, \
+    get_listing, set_listing
+from swift3.utils import LOGGER, MULTIUPLOAD_SUFFIX, utf8encode
 
 MAX_PUT_BUCKET_BODY_SIZE = 10240
 
+# Next pages of the truncated bucket listings, keyed by (access key, account,
+# bucket, listing version, prefix, delimiter, marker, limit), as the green
+# threads fetching them and returning the body of the Swift listing.
+LISTING_PREFETCH_CACHE = LRUCache(maxsize=CONF.listing_prefetch_size,
+                                  maxtime=CONF.listing_prefetch_time)
+# The green threads fetching the next pages; no prefetch is started while all
+# of them are busy.
+LISTING_PREFETCH_POOL = GreenPool(CONF.listing_prefetch_concurrency)
+
+LISTING_COALESCER = RequestCoalescer()
+
 
 class BucketController(Controller):
     """
@@ -91,8 +108,14 @@ class BucketController(Controller):
     @public
     def GET(self, req):
         """
-        Handle GET Bucket (List Objects) request
+        Handle GET Bucket (List Objects) request, version 1 or, with
+        list-type=2, version 2
         """
+        list_type = req.params.get('list-type', '1')
+        if list_type not in ('1', '2'):
+            raise InvalidArgument('list-type', list_type,
+                                  'Invalid List Type specified in Request')
+        listing_v2 = list_type == '2'
 
         max_keys = req.get_validated_param('max-keys', CONF.max_bucket_listing)
         # TODO: Separate max_bucket_listing and default_bucket_listing
@@ -108,34 +131,76 @@ class BucketController(Controller):
             'format': 'json',
             'limit': max_keys + 1,
         }
-        if 'marker' in req.params:
+        if listing_v2:
+            # a continuation token is the base64 of the last key or common
+            # prefix of the previous page, i.e. of its Swift marker
+            if 'continuation-token' in req.params:
+                token = req.params['continuation-token']
+                try:
+                    marker = b64decode(token)
+                except (TypeError, ValueError):
+                    err_msg = 'The continuation token provided is incorrect'
+                    raise InvalidArgument('continuation-token', token,
+                                          err_msg)
+                query.update({'marker': marker})
+            elif 'start-after' in req.params:
+                query.update({'marker': req.params['start-after']})
+        elif 'marker' in req.params:
             query.update({'marker': req.params['marker']})
         if 'prefix' in req.params:
             query.update({'prefix': req.params['prefix']})
         if 'delimiter' in req.params:
             query.update({'delimiter': req.params['delimiter']})
 
-        resp = req.get_response(self.app, query=query)
+        # only the authenticated requests of s3_acl are prefetched, as the
+        # subrequests of the others go through the auth pipeline again
+        prefetch = CONF.listing_prefetch_time > 0 and \
+            not req.subrequests_need_auth
+        body = None
+        if prefetch and 'marker' in query:
+            body = self._get_prefetched_listing(req, query)
+        if body is None:
+            body = self._get_listing(req, query)
 
-        objects = json.loads(resp.body)
+        objects = json.loads(body)
 
         elem = Element('ListBucketResult')
         SubElement(elem, 'Name').text = req.container_name
         SubElement(elem, 'Prefix').text = req.params.get('prefix')
-        SubElement(elem, 'Marker').text = req.params.get('marker')
 
         # in order to judge that truncated is valid, check whether
         # max_keys + 1 th element exists in swift.
         is_truncated = max_keys > 0 and len(objects) > max_keys
         objects = objects[:max_keys]
 
-        if is_truncated and 'delimiter' in req.params:
-            if 'name' in objects[-1]:
-                SubElement(elem, 'NextMarker').text = \
-                    objects[-1]['name']
-            if 'subdir' in objects[-1]:
-                SubElement(elem, 'NextMarker').text = \
-                    objects[-1]['subdir']
+        if is_truncated:
+            next_marker = utf8encode(
+                objects[-1].get('name', objects[-1].get('subdir')))
+            if prefetch:
+                self._prefetch_listing(req, dict(query, marker=next_marker))
+
+        if listing_v2:
+            if is_truncated:
+                SubElement(elem, 'NextContinuationToken').text = \
+                    b64encode(next_marker)
+            if 'continuation-token' in req.params:
+                SubElement(elem, 'ContinuationToken').text = \
+                    req.params['continuation-token']
+            if 'start-after' in req.params:
+                SubElement(elem, 'StartAfter').text = \
+                    req.params['start-after']
+            SubElement(elem, 'KeyCount').text = str(len(objects))
+            fetch_owner = req.params.get('fetch-owner') == 'true'
+        else:
+            SubElement(elem, 'Marker').text = req.params.get('marker')
+            if is_truncated and 'delimiter' in req.params:
+                if 'name' in objects[-1]:
+                    SubElement(elem, 'NextMarker').text = \
+                        objects[-1]['name']
+                if 'subdir' in objects[-1]:
+                    SubElement(elem, 'NextMarker').text = \
+                        objects[-1]['subdir']
+            fetch_owner = True
 
         SubElement(elem, 'MaxKeys').text = str(tag_max_keys)
 
@@ -148,27 +213,127 @@ class BucketController(Controller):
         SubElement(elem, 'IsTruncated').text = \
             'true' if is_truncated else 'false'
 
+        # a page is at most max_bucket_listing rows, so it is serialized
+        # before responding: a key which can't be written in XML gets an
+        # error response, and the body a Content-Length
+        rows = list(self._iter_listing(req, objects, encoding_type,
+                                       fetch_owner))
+        body = ''.join(tostring_iter(elem, elem, rows,
+                                     encoding_type=encoding_type))
+        return HTTPOk(body=body, content_type='application/xml')
+
+    def _listing_prefetch_key(self, req, query):
+        # a page prefetched before the bucket changed is never served, as the
+        # change makes a new version; see forget_listings()
+        version = listing_version(req.environ, req.account,
+                                  req.container_name)
+        return (req.access_key, req.account, req.container_name, version,
+                query.get('prefix'), query.get('delimiter'),
+                query.get('marker'), query['limit'])
+
+    def _prefetch_listing(self, req, query):
+        """
+        Start fetching the Swift listing for the query in the background.
+        """
+        if not LISTING_PREFETCH_POOL.free():
+            return
+        key = self._listing_prefetch_key(req, query)
+        if key not in LISTING_PREFETCH_CACHE:
+            # the green thread only holds the subrequest, not the request
+            sw_req = req.to_swift_req('GET', req.container_name, None,
+                                      query=query)
+            LISTING_PREFETCH_CACHE.set(key, LISTING_PREFETCH_POOL.spawn(
+                self._fetch_listing, sw_req))
+
+    def _fetch_listing(self, sw_req):
+        """
+        Returns the body of the Swift listing of the subrequest, or None if
+        it could not be fetched.
+        """
+        try:
+            sw_resp = sw_req.get_response(self.app)
+            if sw_resp.status_int == HTTP_OK:
+                return sw_resp.body
+        except Exception:
+            LOGGER.exception('Failed to prefetch a listing of %s',
+                             sw_req.path)
+        return None
+
+    def _get_prefetched_listing(self, req, query):
+        """
+        Returns the body of the Swift listing for the query if it was
+        prefetched for the requester, or None.
+        """
+        key = self._listing_prefetch_key(req, query)
+        prefetch = LISTING_PREFETCH_CACHE.get(key)
+        body = None
+        if prefetch is not None:
+            LISTING_PREFETCH_CACHE.pop(key)
+            # the page was fetched for a previous request, so this one has
+            # to be authorized too
+            req.check_listing_permission(self.app)
+            body = prefetch.wait()
+
+        LOGGER.increment(
+            'listing_prefetch.%s' % ('miss' if body is None else 'hit'))
+        return body
+
+    def _get_listing(self, req, query):
+        """
+        Returns the body of the Swift listing for the query, from the listing
+        cache when it is enabled.
+        """
+        if CONF.listing_cache_time <= 0:
+            return req.get_response(self.app, query=query).body
+
+        # the cached listings are shared by all the requesters, so each one
+        # has to be authorized
+        req.check_listing_permission(self.app)
+        key = listing_cache_key(req.environ, req.account, req.container_name,
+                                query)
+        body = get_listing(req.environ, key)
+        LOGGER.increment(
+            'listing_cache.%s' % ('miss' if body is None else 'hit'))
+        if body is not None:
+            return body
+
+        def fetch():
+            body = req.get_response(self.app, query=query).body
+            set_listing(req.environ, key, body)
+            return body
+
+        return LISTING_COALESCER.run(key, fetch)
+
+    def _iter_listing(self, req, objects, encoding_type, fetch_owner=True):
+        """
+        Yields the serialized Contents and CommonPrefixes elements of a
+        bucket listing, straight from the Swift listing.
+        """
+        def text(tag, value):
+            return text_element(tag, value, encoding_type)
+
+        if fetch_owner:
+            owner = '<Owner>%s%s</Owner>' % (text('ID', req.user_id),
+                                             text('DisplayName', req.user_id))
+        else:
+            owner = ''
+        storage_class = text('StorageClass', 'STANDARD')
         for o in objects:
             if 'subdir' not in o:
-                contents = SubElement(elem, 'Contents')
-                SubElement(contents, 'Key').text = o['name']
-                SubElement(contents, 'LastModified').text = \
-                    o['last_modified'][:-3] + 'Z'
-                SubElement(contents, 'ETag').text = '"%s"' % o['hash']
-                SubElement(contents, 'Size').text = str(o['bytes'])
-                owner = SubElement(contents, 'Owner')
-                SubElement(owner, 'ID').text = req.user_id
-                SubElement(owner, 'DisplayName').text = req.user_id
-                SubElement(contents, 'StorageClass').text = 'STANDARD'
+                yield ''.join((
+                    '<Contents>',
+                    text('Key', o['name']),
+                    text('LastModified', o['last_modified'][:-3] + 'Z'),
+                    text('ETag', '"%s"' % o['hash']),
+                    text('Size', str(o['bytes'])),
+                    owner,
+                    storage_class,
+                    '</Contents>'))
 
         for o in objects:
             if 'subdir' in o:
-                common_prefixes = SubElement(elem, 'CommonPrefixes')
-                SubElement(common_prefixes, 'Prefix').text = o['subdir']
-
-        body = tostring(elem, encoding_type=encoding_type)
-
-        return HTTPOk(body=body, content_type='application/xml')
+                yield '<CommonPrefixes>%s</CommonPrefixes>' % text(
+                    'Prefix', o['subdir'])
 
     @public
     def PUT(self, req):
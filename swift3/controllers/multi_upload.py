@@ -153,6 +153,7 @@ class PartController(Controller):
 
             req.headers['Range'] = rng
             del req.headers['X-Amz-Copy-Source-Range']
+        req.check_content_sha256()
         resp = req.get_response(self.app)
 
         if 'X-Amz-Copy-Source' in req.headers:
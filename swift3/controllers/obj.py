@@ -110,6 +110,7 @@ class ObjectController(Controller):
                                   req.headers['X-Amz-Copy-Source-Range'],
                                   'Illegal copy header')
         req.check_copy_source(self.app)
+        req.check_content_sha256()
         resp = req.get_response(self.app)
 
         if 'X-Amz-Copy-Source' in req.headers:
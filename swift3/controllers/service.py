@@ -13,13 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from itertools import izip
+
+from eventlet import GreenPool
+
+from swift.common import constraints
 from swift.common.utils import json, public
 
 from swift3.controllers.base import Controller
-from swift3.etree import Element, SubElement, tostring
+from swift3.etree import Element, SubElement, tostring_iter
 from swift3.response import HTTPOk, AccessDenied, NoSuchBucket
-from swift3.utils import validate_bucket_name
+from swift3.utils import validate_bucket_name, utf8encode, LOGGER
 from swift3.cfg import CONF
+from swift3.bucket_cache import BUCKET_OWNER_CACHE
 
 
 class ServiceController(Controller):
@@ -31,12 +37,13 @@ class ServiceController(Controller):
         """
         Handle GET Service request
         """
-        resp = req.get_response(self.app, query={'format': 'json'})
-
-        containers = json.loads(resp.body)
-
-        containers = filter(
-            lambda item: validate_bucket_name(item['name']), containers)
+        # fetch the first page and check its owners now, so that errors get
+        # a proper response
+        check_owner = CONF.s3_acl and CONF.check_bucket_owner
+        pool = GreenPool(CONF.check_bucket_owner_concurrency) \
+            if check_owner else None
+        containers = self._get_containers(req)
+        names = self._owned_buckets(req, containers, pool)
 
         # we don't keep the creation time of a bucket (s3cmd doesn't
         # work without that) so we use something bogus.
@@ -47,20 +54,92 @@ class ServiceController(Controller):
         SubElement(owner, 'DisplayName').text = req.user_id
 
         buckets = SubElement(elem, 'Buckets')
-        for c in containers:
-            if CONF.s3_acl and CONF.check_bucket_owner:
-                try:
-                    req.get_response(self.app, 'HEAD', c['name'])
-                except AccessDenied:
-                    continue
-                except NoSuchBucket:
-                    continue
-
-            bucket = SubElement(buckets, 'Bucket')
-            SubElement(bucket, 'Name').text = c['name']
-            SubElement(bucket, 'CreationDate').text = \
-                '2009-02-03T16:45:09.000Z'
-
-        body = tostring(elem)
-
-        return HTTPOk(content_type='application/xml', body=body)
+
+        body = tostring_iter(elem, buckets,
+                             self._iter_buckets(req, containers, names, pool))
+        if len(containers) < constraints.ACCOUNT_LISTING_LIMIT:
+            # there is no next page, so the body gets a Content-Length
+            return HTTPOk(body=''.join(body), content_type='application/xml')
+        return HTTPOk(content_type='application/xml', app_iter=body)
+
+    def _get_containers(self, req, marker=None):
+        """
+        Returns a page of the account listing.
+        """
+        query = {'format': 'json',
+                 'limit': constraints.ACCOUNT_LISTING_LIMIT}
+        if marker is not None:
+            query['marker'] = utf8encode(marker)
+        resp = req.get_response(self.app, query=query)
+        return json.loads(resp.body)
+
+    def _owned_buckets(self, req, containers, pool=None):
+        """
+        Returns the names of the buckets of a page of the account listing
+        which should be listed for the user, checking their owners with the
+        green threads of the pool if it is given.
+        """
+        names = [c['name'] for c in containers
+                 if validate_bucket_name(c['name'])]
+        if pool is None:
+            return names
+        # HEAD the buckets concurrently, keeping their order
+        owned = pool.imap(lambda name: self._is_owner(req, name), names)
+        return [name for name, is_owner in izip(names, owned) if is_owner]
+
+    def _iter_buckets(self, req, containers, names, pool=None):
+        """
+        Yields a Bucket element for each of the names of the first page of
+        the account listing, then for the buckets of the next pages, which
+        are fetched as needed.
+
+        The 200 has been sent by then, so an error on the next pages aborts
+        the response before the document is complete, rather than ending it
+        normally.
+        """
+        try:
+            while True:
+                for name in names:
+                    bucket = Element('Bucket')
+                    SubElement(bucket, 'Name').text = name
+                    SubElement(bucket, 'CreationDate').text = \
+                        '2009-02-03T16:45:09.000Z'
+                    yield bucket
+
+                if len(containers) < constraints.ACCOUNT_LISTING_LIMIT:
+                    return
+                containers = self._get_containers(req,
+                                                  containers[-1]['name'])
+                names = self._owned_buckets(req, containers, pool)
+        except Exception:
+            LOGGER.exception('Aborting the bucket listing of %s',
+                             req.account)
+            raise
+
+    def _is_owner(self, req, container):
+        """
+        Returns whether the bucket should be listed for the user, i.e.
+        whether its ACL lets the user HEAD it.
+        """
+        use_cache = CONF.bucket_owner_cache_time > 0
+        if use_cache:
+            users = BUCKET_OWNER_CACHE.get((req.account, container))
+            if users is not None and req.user_id in users:
+                return users[req.user_id]
+
+        # the HEADs run concurrently, each with its own subrequest state
+        head_req = req.concurrent_copy()
+        try:
+            head_req.get_response(self.app, 'HEAD', container)
+            is_owner = True
+        except (AccessDenied, NoSuchBucket):
+            is_owner = False
+        finally:
+            req.subrequests.extend(head_req.subrequests)
+
+        if use_cache:
+            users = BUCKET_OWNER_CACHE.get((req.account, container))
+            if users is None:
+                users = BUCKET_OWNER_CACHE.set((req.account, container), {})
+            users[req.user_id] = is_owner
+        return is_owner
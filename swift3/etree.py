@@ -14,17 +14,34 @@
 # limitations under the License.
 
 import lxml.etree
+import re
 from urllib import quote
 from copy import deepcopy
+from itertools import chain
+from uuid import uuid4
 from pkg_resources import resource_stream  # pylint: disable-msg=E0611
 import sys
 
 from swift3.exception import S3Exception
 from swift3.utils import LOGGER, camel_to_snake, utf8encode, utf8decode
+from swift3 import tracing
 
 XMLNS_S3 = 'http://s3.amazonaws.com/doc/2006-03-01/'
 XMLNS_XSI = 'http://www.w3.org/2001/XMLSchema-instance'
 
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+
+# Size of the chunks yielded by tostring_iter
+XML_CHUNK_SIZE = 65536
+
+# Elements which are not url-encoded even when we specify encoding_type=url
+URL_ENCODING_BLACKLIST = ('LastModified', 'ID', 'DisplayName', 'Initiated',
+                          'ContinuationToken', 'NextContinuationToken')
+
+# Characters that lxml refuses in a text, i.e. that are not XML characters
+_INVALID_XML_CHARS_RE = re.compile(
+    u'[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\uFFFE\uFFFF]')
+
 
 class XMLSyntaxError(S3Exception):
     pass
@@ -83,26 +100,138 @@ def fromstring(text, root_tag=None):
 
 
 def tostring(tree, encoding_type=None, use_s3ns=True):
+    with tracing.span('xml', tag=tree.tag):
+        return _tostring(tree, encoding_type, use_s3ns)
+
+
+def _tostring(tree, encoding_type, use_s3ns):
+    add_s3ns = False
     if use_s3ns:
-        nsmap = tree.nsmap.copy()
-        nsmap[None] = XMLNS_S3
+        if tree.nsmap or tree.tag.startswith('{'):
+            # merge the S3 namespace with the ones of the tree in a new root
+            nsmap = tree.nsmap.copy()
+            nsmap[None] = XMLNS_S3
 
-        root = Element(tree.tag, attrib=tree.attrib, nsmap=nsmap)
-        root.text = tree.text
-        root.extend(deepcopy(tree.getchildren()))
-        tree = root
+            root = Element(tree.tag, attrib=tree.attrib, nsmap=nsmap)
+            root.text = tree.text
+            root.extend(deepcopy(tree.getchildren()))
+            tree = root
+        else:
+            # declare it in the serialized root, without copying the tree
+            add_s3ns = True
 
+    encoded = []
     if encoding_type == 'url':
-        tree = deepcopy(tree)
-        for e in tree.iter():
-            # Some elements are not url-encoded even when we specify
-            # encoding_type=url.
-            blacklist = ['LastModified', 'ID', 'DisplayName', 'Initiated']
-            if e.tag not in blacklist:
-                if isinstance(e.text, basestring):
-                    e.text = quote(e.text)
-
-    return lxml.etree.tostring(tree, xml_declaration=True, encoding='UTF-8')
+        # encode the texts only while the tree is serialized, through the
+        # lxml property rather than the utf-8 wrapper of _Element
+        for e in tree.iter(lxml.etree.Element):
+            if e.tag not in URL_ENCODING_BLACKLIST:
+                text = _lxml_text.__get__(e)
+                if text is not None:
+                    encoded.append((e, text))
+                    _lxml_text.__set__(e, quote(utf8encode(text)))
+    try:
+        body = lxml.etree.tostring(tree, xml_declaration=True,
+                                   encoding='UTF-8', with_tail=not use_s3ns)
+    finally:
+        for e, text in encoded:
+            _lxml_text.__set__(e, text)
+
+    if add_s3ns:
+        # right after the tag name, where lxml writes the namespace
+        # declarations of an element
+        pos = len(XML_DECLARATION) + len('<') + len(tree.tag)
+        body = '%s xmlns="%s"%s' % (body[:pos], XMLNS_S3, body[pos:])
+    return body
+
+
+def _url_encode(tree):
+    for e in tree.iter():
+        if e.tag not in URL_ENCODING_BLACKLIST:
+            if isinstance(e.text, basestring):
+                e.text = quote(e.text)
+
+
+def text_element(tag, text, encoding_type=None):
+    """
+    Returns an element with only a text, serialized as tostring() would
+    write it in a document, without building the element.
+
+    :raises ValueError: if the text has characters which are not allowed in
+                        XML, like lxml does
+    """
+    if text is None:
+        return '<%s/>' % tag
+    if isinstance(text, unicode):
+        unicode_text = text
+        text = text.encode('utf-8')
+    else:
+        unicode_text = text.decode('utf-8')
+    if _INVALID_XML_CHARS_RE.search(unicode_text):
+        raise ValueError('All strings must be XML compatible: Unicode or '
+                         'ASCII, no NULL bytes or control characters')
+    if encoding_type == 'url' and tag not in URL_ENCODING_BLACKLIST:
+        text = quote(text)
+    else:
+        text = text.replace('&', '&amp;').replace('<', '&lt;') \
+            .replace('>', '&gt;').replace('\r', '&#13;')
+    return '<%s>%s</%s>' % (tag, text, tag)
+
+
+def tostring_iter(tree, container, children, encoding_type=None,
+                  use_s3ns=True):
+    """
+    Yields the same document as tostring() would return if the elements
+    from the children iterable were appended to container, an element of
+    the tree, but only one child is held in memory at a time.  The document
+    is yielded in chunks of about XML_CHUNK_SIZE bytes, and the children may
+    be modified.
+
+    A child may also be given already serialized, e.g. by text_element(),
+    as a string.
+    """
+    children = iter(children)
+    first = next(children, None)
+    if first is None:
+        yield tostring(tree, encoding_type, use_s3ns)
+        return
+
+    # the marker splits the document where the children go
+    marker = uuid4().hex
+    last = container[-1] if len(container) else None
+    if last is None:
+        container.text = marker
+    else:
+        last.tail = marker
+    try:
+        head, tail = tostring(tree, encoding_type, use_s3ns).split(marker)
+    finally:
+        if last is None:
+            container.text = None
+        else:
+            last.tail = None
+
+    chunk = [head]
+    size = len(head)
+    for child in chain([first], children):
+        if isinstance(child, basestring):
+            data = child
+        else:
+            if encoding_type == 'url':
+                _url_encode(child)
+            data = lxml.etree.tostring(child, encoding='UTF-8',
+                                       xml_declaration=False)
+        chunk.append(data)
+        size += len(data)
+        if size >= XML_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(tail)
+    yield ''.join(chunk)
+
+
+_lxml_text = lxml.etree.ElementBase.text
 
 
 class _Element(lxml.etree.ElementBase):
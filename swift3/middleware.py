@@ -52,31 +52,155 @@ following for an SAIO setup::
         calling_format=boto.s3.connection.OrdinaryCallingFormat())
 """
 
+import time
+
 from paste.deploy import loadwsgi
 
+from swift.common.utils import close_if_possible
 from swift.common.wsgi import PipelineWrapper, loadcontext
 
 from swift3 import __version__ as swift3_version
 from swift3.exception import NotS3Request
-from swift3.request import get_request_class
+from swift3.profiler import Profiler
+from swift3.request import get_request_class, SIGNING_KEY_CACHE, \
+    AUTH_CACHE, CONTAINER_INFO_CACHE
+from swift3.bucket_cache import BUCKET_OWNER_CACHE, LISTING_CACHE, \
+    LISTING_VERSIONS
+from swift3.controllers.bucket import LISTING_PREFETCH_CACHE, \
+    LISTING_PREFETCH_POOL
 from swift3.response import ErrorResponse, InternalError, MethodNotAllowed, \
     ResponseBase
 from swift3.cfg import CONF
+from swift3 import tracing
 from swift3.utils import LOGGER
 from swift.common.utils import get_logger, register_swift_info
 
 
+class OperationMetrics(object):
+    """
+    Emits the statsd metrics of an S3 operation once its response has been
+    sent.
+
+    All the metrics are named after the operation, e.g. GET.Object or
+    POST.Upload:
+
+    * ``<operation>.<status>.timing``: time until the end of the response
+    * ``<operation>.<status>.first-byte.timing``: time until the first byte
+      of the response body, for GET requests
+    * ``<operation>.<status class>``, e.g. ``GET.Object.2xx``: requests
+    * ``<operation>.errors.<S3 error code>``: error responses
+    * ``<operation>.bytes_in`` and ``<operation>.bytes_out``: bytes of the
+      request and response bodies
+    """
+    def __init__(self, operation, start_time, bytes_in, error_code=None):
+        self.operation = operation
+        self.start_time = start_time
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.error_code = error_code
+        self.status = None
+
+    def start_response(self, start_response):
+        def wrapped(status, headers, exc_info=None):
+            self.status = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+        return wrapped
+
+    def iter_response(self, app_iter, method):
+        """
+        Yields the chunks of the app_iter, counting their bytes.  It neither
+        closes the app_iter nor emits the metrics, as a generator which is
+        never iterated can't do anything when it is closed: the caller does
+        both in an OnClose callback.
+        """
+        for chunk in app_iter:
+            if not self.bytes_out and chunk and method == 'GET':
+                LOGGER.timing_since(
+                    '%s.%s.first-byte.timing' % (self.operation, self.status),
+                    self.start_time)
+            self.bytes_out += len(chunk)
+            yield chunk
+
+    def emit(self):
+        LOGGER.timing_since('%s.%s.timing' % (self.operation, self.status),
+                            self.start_time)
+        LOGGER.increment('%s.%dxx' % (self.operation, self.status // 100))
+        if self.error_code:
+            LOGGER.increment('%s.errors.%s' % (self.operation,
+                                               self.error_code))
+        if self.bytes_in:
+            LOGGER.update_stats('%s.bytes_in' % self.operation,
+                                self.bytes_in)
+        if self.bytes_out:
+            LOGGER.update_stats('%s.bytes_out' % self.operation,
+                                self.bytes_out)
+
+
+class OnClose(object):
+    """
+    Wraps an app_iter to call ``callback`` once it has been exhausted or
+    closed, i.e. once the response body has been sent or the client went
+    away.  Unlike a generator, it is called even if the app_iter was never
+    iterated.
+    """
+    def __init__(self, app_iter, callback):
+        self.app_iter = app_iter
+        self.callback = callback
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            yield chunk
+        self.close()
+
+    def close(self):
+        try:
+            close_if_possible(self.app_iter)
+        finally:
+            callback, self.callback = self.callback, None
+            if callback is not None:
+                callback()
+
+
 class Swift3Middleware(object):
     """Swift3 S3 compatibility middleware"""
     def __init__(self, app, conf, *args, **kwargs):
         self.app = app
         self.slo_enabled = conf['allow_multipart_uploads']
+        self.profiler = Profiler(conf)
+        self.tracer = tracing.Tracer(conf)
+        for name in ('check_bucket_owner_concurrency',
+                     'listing_prefetch_concurrency'):
+            if conf[name] < 1:
+                raise ValueError('%s must be a positive integer' % name)
+        if conf['listing_cache_backend'] not in ('local', 'memcache'):
+            raise ValueError('listing_cache_backend must be either local or '
+                             'memcache')
         self.check_pipeline(conf)
 
     def __call__(self, env, start_response):
+        req_class = get_request_class(env)
+        if req_class is None:
+            # not an S3 request, don't spend any time on it
+            return self.app(env, start_response)
+
+        start_time = time.time()
+        method = env['REQUEST_METHOD']
+        try:
+            bytes_in = int(env.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            bytes_in = 0
+
+        profile = None
+        if self.profiler.enabled and self.profiler.wants(env):
+            profile = self.profiler.start()
+        trace = None
+        if self.tracer.enabled:
+            trace = self.tracer.start(env)
+
+        req = None
         try:
-            req_class = get_request_class(env)
-            req = req_class(env, self.app, self.slo_enabled)
+            with tracing.span('parse'):
+                req = req_class(env, self.app, self.slo_enabled)
             resp = self.handle_request(req)
         except NotS3Request:
             resp = self.app
@@ -88,11 +212,79 @@ class Swift3Middleware(object):
             LOGGER.exception(e)
             resp = InternalError(reason=e)
 
+        operation = None
+        if req is not None:
+            req.forget_listings()
+            try:
+                operation = req.operation_name
+            except ErrorResponse:
+                # the operation isn't supported
+                pass
+
+        def finish():
+            # the response body may be generated lazily, e.g. the pages of
+            # a listing and their subrequests, so this waits until it has
+            # been sent
+            if operation is not None:
+                self.report_subrequests(req, operation, env)
+            if profile is not None:
+                self.profiler.stop(profile,
+                                   operation or '%s.Unknown' % method)
+            if trace is not None:
+                self.tracer.finish(trace, operation=operation,
+                                   status=getattr(resp, 'status_int', None))
+
         if isinstance(resp, ResponseBase) and 'swift.trans_id' in env:
             resp.headers['x-amz-id-2'] = env['swift.trans_id']
             resp.headers['x-amz-request-id'] = env['swift.trans_id']
 
-        return resp(env, start_response)
+        if resp is self.app:
+            # not an S3 request after all
+            finish()
+            return resp(env, start_response)
+
+        metrics = OperationMetrics(
+            operation or '%s.Unknown' % method, start_time, bytes_in,
+            resp._code if isinstance(resp, ErrorResponse) else None)
+        app_iter = resp(env, metrics.start_response(start_response))
+
+        def finish_operation():
+            try:
+                # the counting generator doesn't close it
+                close_if_possible(app_iter)
+            finally:
+                metrics.emit()
+                finish()
+
+        return OnClose(metrics.iter_response(app_iter, method),
+                       finish_operation)
+
+    def report_subrequests(self, req, operation, env):
+        """
+        Emit the number, time and status codes of the Swift subrequests made
+        for the S3 request as metrics of its operation, and add a summary to
+        the proxy log line.
+
+        This is done once the response body has been sent, so the summary
+        is only in the log line if the body was sent completely; the proxy
+        logs it before closing an interrupted response.
+        """
+        total_time = sum(duration for _, _, duration in req.subrequests)
+        LOGGER.update_stats('%s.subrequests' % operation, len(req.subrequests))
+        LOGGER.timing('%s.subrequest_time' % operation, total_time * 1000)
+
+        counts = {}
+        for method, status, _ in req.subrequests:
+            key = '%s.%d' % (method, status)
+            counts[key] = counts.get(key, 0) + 1
+        for key, count in sorted(counts.items()):
+            LOGGER.update_stats(
+                '%s.subrequest.%s' % (operation, key), count)
+
+        env.setdefault('swift.log_info', []).append(
+            'swift3.%s:subrequests=%d:time=%.4f:%s' % (
+                operation, len(req.subrequests), total_time,
+                '+'.join('%s*%d' % item for item in sorted(counts.items()))))
 
     def handle_request(self, req):
         LOGGER.debug('Calling Swift3 Middleware')
@@ -104,7 +296,8 @@ class Swift3Middleware(object):
             if not getattr(handler, 'publicly_accessible', False):
                 raise MethodNotAllowed(req.method,
                                        req.controller.resource_type())
-            res = handler(req)
+            with tracing.span('controller', operation=req.operation_name):
+                res = handler(req)
         else:
             raise MethodNotAllowed(req.method,
                                    req.controller.resource_type())
@@ -183,6 +376,21 @@ def filter_factory(global_conf, **local_conf):
     global LOGGER
     LOGGER = get_logger(CONF, log_route='swift3')
 
+    SIGNING_KEY_CACHE.maxsize = CONF.signing_key_cache_size
+    AUTH_CACHE.maxsize = CONF.auth_cache_size
+    AUTH_CACHE.maxtime = CONF.auth_cache_time
+    CONTAINER_INFO_CACHE.maxsize = CONF.container_info_cache_size
+    CONTAINER_INFO_CACHE.maxtime = CONF.container_info_cache_time
+    BUCKET_OWNER_CACHE.maxsize = CONF.bucket_owner_cache_size
+    BUCKET_OWNER_CACHE.maxtime = CONF.bucket_owner_cache_time
+    LISTING_PREFETCH_CACHE.maxsize = CONF.listing_prefetch_size
+    LISTING_PREFETCH_CACHE.maxtime = CONF.listing_prefetch_time
+    LISTING_PREFETCH_POOL.resize(CONF.listing_prefetch_concurrency)
+    LISTING_CACHE.maxsize = CONF.listing_cache_size
+    LISTING_CACHE.maxtime = CONF.listing_cache_time
+    LISTING_VERSIONS.maxsize = max(CONF.listing_cache_size,
+                                   CONF.listing_prefetch_size)
+
     register_swift_info(
         'swift3',
         max_bucket_listing=CONF['max_bucket_listing'],
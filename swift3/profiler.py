@@ -0,0 +1,140 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Profiling of sampled S3 requests.
+
+When ``profile_sample_rate`` is set or ``profile_access_keys`` lists some
+access keys, the middleware runs the matching requests under cProfile, from
+the parsing of the request until its response body has been sent.  The
+profiles are aggregated per S3 operation, and every ``profile_dump_interval``
+seconds they are written as ``<operation>-<timestamp>.prof`` to
+``profile_dir``, which keeps the last ``profile_dump_count`` files of each
+operation.  The files are written from eventlet's thread pool, and can be
+read with the standard ``pstats`` module.
+
+Only one request is profiled at a time in each worker.  As cProfile follows
+the OS thread, the work of the other green threads running meanwhile is
+accounted in the profile too, so the sample rate should stay low.
+"""
+
+import cProfile
+import glob
+import os
+import pstats
+import random
+import time
+from urllib import unquote
+
+from eventlet import tpool
+
+from swift3.utils import LOGGER
+
+
+def _access_key(env):
+    """
+    Extract the access key of an S3 request without parsing it.
+    """
+    auth = env.get('HTTP_AUTHORIZATION', '')
+    if auth.startswith('AWS '):
+        return auth[4:].rsplit(':', 1)[0]
+    if auth.startswith('AWS4-HMAC-SHA256 '):
+        return auth.partition('Credential=')[2].split('/', 1)[0]
+
+    query = env.get('QUERY_STRING', '')
+    for param in ('AWSAccessKeyId=', 'X-Amz-Credential='):
+        if param in query:
+            value = query.split(param, 1)[1].split('&', 1)[0]
+            return unquote(value).split('/', 1)[0]
+    return None
+
+
+class Profiler(object):
+    """
+    Profiles sampled requests and dumps the aggregated profiles.
+    """
+    def __init__(self, conf):
+        self.sample_rate = float(conf.get('profile_sample_rate') or 0)
+        self.access_keys = set(
+            key.strip()
+            for key in (conf.get('profile_access_keys') or '').split(',')
+            if key.strip())
+        self.profile_dir = conf.get('profile_dir') or '/tmp/swift3-profile'
+        self.dump_interval = float(conf.get('profile_dump_interval') or 300)
+        self.dump_count = int(conf.get('profile_dump_count') or 24)
+        if not 0 <= self.sample_rate <= 1:
+            raise ValueError('profile_sample_rate must be between 0 and 1')
+        self._stats = {}
+        self._busy = False
+        self._next_dump = time.time() + self.dump_interval
+
+    @property
+    def enabled(self):
+        return bool(self.sample_rate or self.access_keys)
+
+    def wants(self, env):
+        """
+        Returns whether the request should be profiled.
+        """
+        if self._busy:
+            return False
+        if self.access_keys and _access_key(env) in self.access_keys:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        self._busy = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, operation):
+        """
+        Stop a profile, and add it to the aggregate of the operation.
+        """
+        profile.disable()
+        self._busy = False
+        stats = self._stats.get(operation)
+        if stats is None:
+            self._stats[operation] = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+        if time.time() >= self._next_dump:
+            self.dump()
+
+    def dump(self):
+        """
+        Write the aggregated profiles, and start new ones.
+        """
+        now = time.time()
+        self._next_dump = now + self.dump_interval
+        stats, self._stats = self._stats, {}
+        # don't block the other green threads on the disk
+        tpool.execute(self._write, stats, now)
+
+    def _write(self, stats, now):
+        try:
+            if not os.path.isdir(self.profile_dir):
+                os.makedirs(self.profile_dir)
+            for operation, op_stats in stats.items():
+                op_stats.dump_stats(os.path.join(
+                    self.profile_dir, '%s-%d.prof' % (operation, now)))
+                old_files = sorted(glob.glob(os.path.join(
+                    self.profile_dir, '%s-*.prof' % operation)))
+                for path in old_files[:-self.dump_count]:
+                    os.unlink(path)
+        except (IOError, OSError) as e:
+            LOGGER.warning('Failed to dump profiles to %s: %s',
+                           self.profile_dir, e)
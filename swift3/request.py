@@ -14,16 +14,23 @@
 # limitations under the License.
 
 import base64
+import copy
 from email.header import Header
 from hashlib import sha1, sha256, md5
 import hmac
 import re
 import six
+from six import StringIO
 import string
+import time
 from urllib import quote, unquote
+from urlparse import parse_qsl
+
+from eventlet import tpool
 
 from swift.common.utils import split_path
 from swift.common import swob
+from swift.common.swob import WsgiBytesIO
 from swift.common.http import HTTP_OK, HTTP_CREATED, HTTP_ACCEPTED, \
     HTTP_NO_CONTENT, HTTP_UNAUTHORIZED, HTTP_FORBIDDEN, HTTP_NOT_FOUND, \
     HTTP_CONFLICT, HTTP_UNPROCESSABLE_ENTITY, HTTP_REQUEST_ENTITY_TOO_LARGE, \
@@ -46,7 +53,9 @@ from swift3.response import AccessDenied, InvalidArgument, InvalidDigest, \
     InternalError, NoSuchBucket, NoSuchKey, PreconditionFailed, InvalidRange, \
     MissingContentLength, InvalidStorageClass, S3NotImplemented, InvalidURI, \
     MalformedXML, InvalidRequest, RequestTimeout, InvalidBucketName, \
-    BadDigest, AuthorizationHeaderMalformed, AuthorizationQueryParametersError
+    BadDigest, AuthorizationHeaderMalformed, \
+    AuthorizationQueryParametersError, IncompleteBody, \
+    XAmzContentSHA256Mismatch
 from swift3.exception import NotS3Request, BadSwiftRequest
 from swift3.utils import utf8encode, LOGGER, check_path_header, S3Timestamp, \
     mktime
@@ -55,6 +64,9 @@ from swift3.subresource import decode_acl, encode_acl
 from swift3.utils import sysmeta_header, validate_bucket_name
 from swift3.acl_utils import handle_acl_header
 from swift3.acl_handlers import get_acl_handler
+from swift3.cache import LRUCache
+from swift3.bucket_cache import BUCKET_OWNER_CACHE, forget_listings
+from swift3 import tracing
 
 
 # List of sub-resources that must be maintained as part of the HMAC
@@ -74,6 +86,115 @@ SIGV2_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
 SIGV4_X_AMZ_DATE_FORMAT = '%Y%m%dT%H%M%SZ'
 SERVICE = 's3'  # useful for mocking out in tests
 
+# Derived SigV4 signing keys, keyed by (secret fingerprint, date, region,
+# service).  A signing key is only valid for one day, so we never need to
+# keep many of them per credential.
+SIGNING_KEY_CACHE = LRUCache(maxsize=CONF.signing_key_cache_size)
+
+# Results of the s3_acl pre-authentication, keyed by (access key, signature,
+# string to sign digest) so that only the very same signed request hits.
+AUTH_CACHE = LRUCache(maxsize=CONF.auth_cache_size,
+                      maxtime=CONF.auth_cache_time)
+
+# Info of the existing buckets, keyed by (access key or account, bucket) so
+# that get_container_info can skip the HEAD before and after authentication.
+CONTAINER_INFO_CACHE = LRUCache(maxsize=CONF.container_info_cache_size,
+                                maxtime=CONF.container_info_cache_time)
+
+STREAMING_PAYLOAD = 'STREAMING-AWS4-HMAC-SHA256-PAYLOAD'
+EMPTY_SHA256 = sha256('').hexdigest()
+# Upper bound of a chunk header line, i.e. the hex size and the signature
+MAX_CHUNK_HEADER_LENGTH = 4096
+SHA256_HEX_RE = re.compile('^[0-9a-f]{64}$')
+# Bytes of payload hashed per round trip to the thread pool
+HASH_OFFLOAD_BATCH_SIZE = 1024 * 1024
+
+# Expected success codes from Swift, per kind of path and method
+SWIFT_SUCCESS_CODES = {
+    'account': {
+        'GET': (HTTP_OK,),
+    },
+    'container': {
+        'HEAD': (HTTP_NO_CONTENT,),
+        'GET': (HTTP_OK, HTTP_NO_CONTENT),
+        'PUT': (HTTP_CREATED,),
+        'POST': (HTTP_NO_CONTENT,),
+        'DELETE': (HTTP_NO_CONTENT,),
+    },
+    'object': {
+        'HEAD': (HTTP_OK, HTTP_PARTIAL_CONTENT, HTTP_NOT_MODIFIED),
+        'GET': (HTTP_OK, HTTP_PARTIAL_CONTENT, HTTP_NOT_MODIFIED),
+        'PUT': (HTTP_CREATED,),
+        'POST': (HTTP_ACCEPTED,),
+        'DELETE': (HTTP_OK, HTTP_NO_CONTENT),
+    },
+}
+
+# Expected error codes from Swift, per kind of path and method, mapped to the
+# S3 error response and the names of its arguments
+SWIFT_ERROR_CODES = {
+    'account': {
+        'GET': {},
+    },
+    'container': {
+        'HEAD': {
+            HTTP_NOT_FOUND: (NoSuchBucket, 'container'),
+        },
+        'GET': {
+            HTTP_NOT_FOUND: (NoSuchBucket, 'container'),
+        },
+        'PUT': {
+            HTTP_ACCEPTED: (BucketAlreadyExists, 'container'),
+        },
+        'POST': {
+            HTTP_NOT_FOUND: (NoSuchBucket, 'container'),
+        },
+        'DELETE': {
+            HTTP_NOT_FOUND: (NoSuchBucket, 'container'),
+            HTTP_CONFLICT: (BucketNotEmpty,),
+        },
+    },
+    'object': {
+        'HEAD': {
+            HTTP_NOT_FOUND: (NoSuchKey, 'obj'),
+            HTTP_PRECONDITION_FAILED: (PreconditionFailed,),
+        },
+        'GET': {
+            HTTP_NOT_FOUND: (NoSuchKey, 'obj'),
+            HTTP_PRECONDITION_FAILED: (PreconditionFailed,),
+            HTTP_REQUESTED_RANGE_NOT_SATISFIABLE: (InvalidRange,),
+        },
+        'PUT': {
+            HTTP_NOT_FOUND: (NoSuchBucket, 'container'),
+            HTTP_UNPROCESSABLE_ENTITY: (BadDigest,),
+            HTTP_REQUEST_ENTITY_TOO_LARGE: (EntityTooLarge,),
+            HTTP_LENGTH_REQUIRED: (MissingContentLength,),
+            HTTP_REQUEST_TIMEOUT: (RequestTimeout,),
+        },
+        'POST': {
+            HTTP_NOT_FOUND: (NoSuchKey, 'obj'),
+            HTTP_PRECONDITION_FAILED: (PreconditionFailed,),
+        },
+        'DELETE': {
+            HTTP_NOT_FOUND: (NoSuchKey, 'obj'),
+        },
+    },
+}
+
+# What swob.Request.blank() fills in when the environ of a subrequest lacks it
+SUBREQUEST_ENVIRON_DEFAULTS = (
+    ('REQUEST_METHOD', 'GET'),
+    ('SCRIPT_NAME', ''),
+    ('SERVER_NAME', 'localhost'),
+    ('SERVER_PORT', '80'),
+    ('HTTP_HOST', 'localhost:80'),
+    ('SERVER_PROTOCOL', 'HTTP/1.0'),
+    ('wsgi.version', (1, 0)),
+    ('wsgi.url_scheme', 'http'),
+    ('wsgi.multithread', False),
+    ('wsgi.multiprocess', False),
+)
+
 
 def _header_strip(value):
     # S3 seems to strip *all* control characters
@@ -87,6 +208,55 @@ def _header_strip(value):
     return stripped
 _header_strip.re = re.compile('^[\x00-\x20]*|[\x00-\x20]*$')
 
+# Boto versions < 2.9.3 strip the port component of the host:port header
+_OLD_BOTO_USER_AGENT_RE = re.compile('Boto/2.[0-9].[0-2]')
+# Strings made only of these characters are left as they are by _aws_quote
+_UNRESERVED_RE = re.compile('^[A-Za-z0-9_.~-]*$')
+# Signed header names are lower case, and dashes stand for underscores in
+# the WSGI environ
+_SIGNED_HEADER_NAME_RE = re.compile('^[a-z0-9!#$%&\'*+.^`|~-]+$')
+# Header name to WSGI environ key, filled in on demand
+_HEADER_ENVIRON_KEYS = {'content-type': 'CONTENT_TYPE',
+                        'content-length': 'CONTENT_LENGTH'}
+MAX_HEADER_ENVIRON_KEYS = 1024
+
+
+def _header_environ_key(name):
+    """
+    Return the WSGI environ key of a lower case header name, or None if the
+    name can't have come from a request header.
+    """
+    try:
+        return _HEADER_ENVIRON_KEYS[name]
+    except KeyError:
+        pass
+
+    if not _SIGNED_HEADER_NAME_RE.match(name):
+        return None
+    key = 'HTTP_' + name.upper().replace('-', '_')
+    if len(_HEADER_ENVIRON_KEYS) < MAX_HEADER_ENVIRON_KEYS:
+        _HEADER_ENVIRON_KEYS[name] = key
+    return key
+
+
+def _canonical_header_value(value):
+    """
+    Strip a header value and collapse its inner runs of whitespace.
+    """
+    value = _header_strip(value or '')
+    if not value:
+        return ''
+    return ' '.join(value.split())
+
+
+def _aws_quote(value):
+    """
+    URI-encode a query key or value the way AWS does for SigV4.
+    """
+    if _UNRESERVED_RE.match(value):
+        return value
+    return quote(value, safe='-_.~')
+
 
 def _header_acl_property(resource):
     """
@@ -106,20 +276,275 @@ def _header_acl_property(resource):
                     doc='Get and set the %s acl property' % resource)
 
 
+class StreamingInput(object):
+    """
+    wsgi.input wrapper which decodes an aws-chunked request body.
+
+    Each chunk is framed as::
+
+        <hex size>;chunk-signature=<signature>\r\n<data>\r\n
+
+    and the body ends with a chunk of size 0.  The chunk data is passed
+    through as it is read, so only the payload reaches Swift and memory use
+    doesn't depend on the chunk size.  Every chunk signature is checked
+    against ``chunk_signer(previous_signature, chunk_sha256)`` once the
+    chunk data is consumed, starting from the seed signature of the request.
+    The signer returns None while the signing key is unknown (i.e. the auth
+    middleware validated the seed signature without handing us the secret),
+    in which case the framing is decoded without checking the signatures,
+    and the upload is logged and counted in the
+    ``chunk_signatures.unverified`` metric.
+
+    On an error, the matching S3 error response is kept in ``error`` and an
+    IOError is raised, which Swift handles as a client disconnect.
+    """
+    def __init__(self, wsgi_input, decoded_length, seed_signature,
+                 chunk_signer):
+        self._input = wsgi_input
+        self._decoded_length = decoded_length
+        self._signature = seed_signature
+        self._chunk_signer = chunk_signer
+        self._bytes_read = 0
+        self._chunk_left = 0
+        self._chunk_signature = None
+        self._chunk_hash = None
+        self._done = False
+        self._unverified = False
+        self.error = None
+
+    def _fail(self, error):
+        self.error = error
+        raise IOError(error._msg)
+
+    def _read_chunk_header(self):
+        line = self._input.readline(MAX_CHUNK_HEADER_LENGTH)
+        if not line.endswith('\r\n'):
+            self._fail(IncompleteBody())
+        size, _, signature = line[:-2].partition(';')
+        if not signature.startswith('chunk-signature='):
+            self._fail(InvalidRequest('Invalid chunk header'))
+        try:
+            self._chunk_left = int(size, 16)
+        except ValueError:
+            self._fail(InvalidRequest('Invalid chunk size'))
+        if self._chunk_left < 0:
+            self._fail(InvalidRequest('Invalid chunk size'))
+        self._chunk_signature = signature[len('chunk-signature='):]
+        self._chunk_hash = sha256()
+
+    def _finish_chunk(self):
+        expected = self._chunk_signer(self._signature,
+                                      self._chunk_hash.hexdigest())
+        if expected is None:
+            if not self._unverified:
+                self._unverified = True
+                LOGGER.info('Signing key unknown, not verifying the chunk '
+                            'signatures of a streaming upload')
+                LOGGER.increment('chunk_signatures.unverified')
+        elif expected != self._chunk_signature:
+            self._fail(SignatureDoesNotMatch())
+        self._signature = self._chunk_signature
+        self._chunk_hash = None
+
+    def _read_chunk_data(self, size):
+        data = self._input.read(min(size, self._chunk_left))
+        if not data:
+            self._fail(IncompleteBody())
+        self._chunk_hash.update(data)
+        self._chunk_left -= len(data)
+        self._bytes_read += len(data)
+        if self._bytes_read > self._decoded_length:
+            self._fail(InvalidRequest(
+                'The decoded body is longer than '
+                'x-amz-decoded-content-length'))
+        if not self._chunk_left:
+            if self._input.read(2) != '\r\n':
+                self._fail(IncompleteBody())
+            self._finish_chunk()
+        return data
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            return ''.join(iter(lambda: self.read(65536), ''))
+
+        while not self._done and size > 0:
+            if self._chunk_hash is None:
+                self._read_chunk_header()
+                if not self._chunk_left:
+                    # the final chunk has no data, but is signed too
+                    if self._input.read(2) != '\r\n':
+                        self._fail(IncompleteBody())
+                    self._finish_chunk()
+                    self._done = True
+                    if self._bytes_read != self._decoded_length:
+                        self._fail(IncompleteBody())
+                    break
+            if self._chunk_left:
+                return self._read_chunk_data(size)
+        return ''
+
+
+class HashingInput(object):
+    """
+    wsgi.input wrapper which checks the SHA256 of the body while it's read.
+
+    The digest is compared in the read which returns the last bytes of the
+    body, as told by ``content_length``, before they are handed to Swift,
+    so that Swift never commits the object.  Without a length, it's
+    compared once the wrapped input is exhausted.  On a mismatch, the S3
+    error response is kept in ``error`` and an IOError is raised, which
+    Swift handles as a client disconnect.  With ``offload``, hashing runs
+    in eventlet's thread pool, HASH_OFFLOAD_BATCH_SIZE bytes at a time, so
+    that big bodies don't starve the hub.
+    """
+    def __init__(self, wsgi_input, expected_hash, content_length=None,
+                 offload=False):
+        self._input = wsgi_input
+        self._expected_hash = expected_hash
+        self._bytes_left = content_length
+        self._offload = offload
+        self._pending = []
+        self._pending_size = 0
+        self._hash = sha256()
+        self._checked = False
+        self.error = None
+
+    def _update(self, chunks):
+        for chunk in chunks:
+            self._hash.update(chunk)
+
+    def _hash_data(self, data, final):
+        if not self._offload:
+            self._hash.update(data)
+            return
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= HASH_OFFLOAD_BATCH_SIZE:
+            tpool.execute(self._update, self._pending)
+        elif final:
+            self._update(self._pending)
+        else:
+            return
+        self._pending = []
+        self._pending_size = 0
+
+    def _check(self):
+        self._checked = True
+        computed_hash = self._hash.hexdigest()
+        if computed_hash != self._expected_hash:
+            self.error = XAmzContentSHA256Mismatch(
+                client_computed_content_s_h_a256=self._expected_hash,
+                s3_computed_content_s_h_a256=computed_hash)
+            raise IOError(self.error._msg)
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            data = self._input.read()
+        else:
+            data = self._input.read(size)
+        final = not data or size is None or size < 0
+        if self._bytes_left is not None:
+            self._bytes_left -= len(data)
+            final = final or self._bytes_left <= 0
+        if self._checked:
+            return data
+        if data or final:
+            self._hash_data(data, final)
+        if final:
+            self._check()
+        return data
+
+
 class SigV4Mixin(object):
     """
     A request class mixin to provide S3 signature v4 functionality
     """
+    # The signing key, once an auth middleware has checked the signature
+    # with our check_signature.  It's needed to verify the chunk signatures
+    # of a streaming upload.
+    _chunk_signing_key = None
+
+    def __init__(self, env, app=None, slo_enabled=True):
+        super(SigV4Mixin, self).__init__(env, app, slo_enabled)
+        if self.headers.get('X-Amz-Content-SHA256') == STREAMING_PAYLOAD:
+            self._setup_streaming_input()
+
+    def _setup_streaming_input(self):
+        """
+        Replace wsgi.input by a decoder of the aws-chunked body, and make
+        the headers describe the decoded payload.  This must happen after
+        the string to sign is locked in, as it covers the original headers.
+        """
+        if 'X-Amz-Decoded-Content-Length' not in self.headers:
+            raise MissingContentLength()
+        try:
+            decoded_length = int(self.headers['X-Amz-Decoded-Content-Length'])
+            if decoded_length < 0:
+                raise ValueError()
+        except ValueError:
+            raise InvalidArgument(
+                'x-amz-decoded-content-length',
+                self.headers['X-Amz-Decoded-Content-Length'])
+
+        self.streaming_input = StreamingInput(
+            self.environ['wsgi.input'], decoded_length, self.signature,
+            self._chunk_signature)
+        self.environ['wsgi.input'] = self.streaming_input
+        self.environ['CONTENT_LENGTH'] = str(decoded_length)
+        self.environ.pop('HTTP_TRANSFER_ENCODING', None)
+
+        encodings = [e.strip() for e in
+                     self.headers.get('Content-Encoding', '').split(',')
+                     if e.strip() and e.strip() != 'aws-chunked']
+        if encodings:
+            self.headers['Content-Encoding'] = ', '.join(encodings)
+        else:
+            self.environ.pop('HTTP_CONTENT_ENCODING', None)
+
+    def _chunk_signature(self, previous_signature, chunk_hash):
+        """
+        Return the expected signature of a chunk of a streaming upload, or
+        None if the signing key is unknown.
+        """
+        if self._chunk_signing_key is None:
+            return None
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256-PAYLOAD',
+            self.timestamp.amz_date_format,
+            '/'.join(self.scope),
+            previous_signature,
+            EMPTY_SHA256,
+            chunk_hash])
+        return hmac.new(self._chunk_signing_key, string_to_sign,
+                        sha256).hexdigest()
+
+    def _signing_key(self, secret):
+        """
+        Return the signing key derived from the secret and the scope of this
+        request.  The derivation takes four chained HMACs but the result only
+        changes once a day per credential, so it's looked up in
+        SIGNING_KEY_CACHE first.
+        """
+        date, region, service, terminator = self.scope
+        cache_key = (sha256(secret).hexdigest(), date, region, service)
+        signing_key = SIGNING_KEY_CACHE.get(cache_key)
+        if signing_key is None:
+            signing_key = 'AWS4' + secret
+            for scope_piece in self.scope:
+                signing_key = hmac.new(
+                    signing_key, scope_piece, sha256).digest()
+            SIGNING_KEY_CACHE.set(cache_key, signing_key)
+        return signing_key
 
     def check_signature(self, secret):
         user_signature = self.signature
-        derived_secret = 'AWS4' + secret
-        for scope_piece in self.scope:
-            derived_secret = hmac.new(
-                derived_secret, scope_piece, sha256).digest()
+        signing_key = self._signing_key(secret)
         valid_signature = hmac.new(
-            derived_secret, self.string_to_sign, sha256).hexdigest()
-        return user_signature == valid_signature
+            signing_key, self.string_to_sign, sha256).hexdigest()
+        if user_signature != valid_signature:
+            return False
+        self._chunk_signing_key = signing_key
+        return True
 
     @property
     def _is_query_auth(self):
@@ -253,9 +678,8 @@ class SigV4Mixin(object):
 
     def _canonical_query_string(self):
         return '&'.join(
-            '%s=%s' % (quote(key, safe='-_.~'),
-                       quote(value, safe='-_.~'))
-            for key, value in sorted(self.params.items())
+            '%s=%s' % (_aws_quote(key), _aws_quote(value))
+            for key, value in self._sorted_params()
             if key not in ('Signature', 'X-Amz-Signature'))
 
     def _headers_to_sign(self):
@@ -263,40 +687,37 @@ class SigV4Mixin(object):
         Select the headers from the request that need to be included
         in the StringToSign.
 
+        Only the headers listed in SignedHeaders are looked up and
+        canonicalized; the rest of the request headers are never touched.
+
         :return : dict of headers to sign, the keys are all lower case
         """
-        headers_lower_dict = dict(
-            (k.lower().strip(), ' '.join(_header_strip(v or '').split()))
-            for (k, v) in six.iteritems(self.headers))
-
-        if 'host' in headers_lower_dict and re.match(
-                'Boto/2.[0-9].[0-2]',
-                headers_lower_dict.get('user-agent', '')):
+        headers_to_sign = {}
+        for name in self._signed_headers:
+            key = _header_environ_key(name)
+            if key is None or key not in self.environ:
+                # NOTE: if we are missing the header suggested via
+                # signed_header in actual header, it results in
+                # SignatureDoesNotMatch in actual S3 so we can raise
+                # the error immediately here to save redundant check
+                # process.
+                raise SignatureDoesNotMatch()
+            headers_to_sign[name] = _canonical_header_value(self.environ[key])
+
+        if 'host' in headers_to_sign and _OLD_BOTO_USER_AGENT_RE.match(
+                _canonical_header_value(self.environ.get('HTTP_USER_AGENT'))):
             # Boto versions < 2.9.3 strip the port component of the host:port
             # header, so detect the user-agent via the header and strip the
             # port if we detect an old boto version.
-            headers_lower_dict['host'] = \
-                headers_lower_dict['host'].split(':')[0]
-
-        headers_to_sign = [
-            (key, value) for key, value in headers_lower_dict.items()
-            if key in self._signed_headers]
-
-        if len(headers_to_sign) != len(self._signed_headers):
-            # NOTE: if we are missing the header suggested via
-            # signed_header in actual header, it results in
-            # SignatureDoesNotMatch in actual S3 so we can raise
-            # the error immediately here to save redundant check
-            # process.
-            raise SignatureDoesNotMatch()
+            headers_to_sign['host'] = headers_to_sign['host'].split(':')[0]
 
-        return dict(headers_to_sign)
+        return headers_to_sign
 
     def _canonical_uri(self):
         """
         It won't require bucket name in canonical_uri for v4.
         """
-        return self.environ.get('RAW_PATH_INFO', self.path)
+        return self._raw_path()
 
     def _canonical_request(self):
         # prepare 'canonical_request'
@@ -364,24 +785,67 @@ class SigV4Mixin(object):
                           sha256(self._canonical_request()).hexdigest()])
 
 
+def _swift_path_kind(container, obj):
+    if not container:
+        return 'account'
+    return 'object' if obj else 'container'
+
+
+def _swift_meta_headers(environ):
+    """
+    Translate the x-amz-meta-* headers of an S3 request into Swift's
+    x-object-meta-* ones.
+
+    :return: a list of (S3 environ key, Swift environ key, value)
+    """
+    meta_headers = []
+    for key, value in environ.items():
+        if not key.startswith('HTTP_X_AMZ_META_'):
+            continue
+        if not set(value).issubset(string.printable):
+            value = Header(value, 'UTF-8').encode()
+            if value.startswith('=?utf-8?q?'):
+                value = '=?UTF-8?Q?' + value[10:]
+            elif value.startswith('=?utf-8?b?'):
+                value = '=?UTF-8?B?' + value[10:]
+        meta_headers.append((key, 'HTTP_X_OBJECT_META_' + key[16:], value))
+    return meta_headers
+
+
+def _query_keys(query_string):
+    """
+    Return the parameter names of a query string, but don't bother parsing
+    it when it can't hold any of the S3 auth parameters.
+    """
+    if not query_string or not ('AWSAccessKeyId' in query_string or
+                                'X-Amz-Credential' in query_string or
+                                '%' in query_string):
+        return ()
+    return set(key for key, _ in parse_qsl(query_string, True))
+
+
 def get_request_class(env):
     """
     Helper function to find a request class to use from Map
+
+    Only the raw environ is looked at, and None is returned for requests
+    which carry no S3 authentication, i.e. native Swift requests.
     """
     if CONF.s3_acl:
         request_classes = (S3AclRequest, SigV4S3AclRequest)
     else:
         request_classes = (Request, SigV4Request)
 
-    req = swob.Request(env)
-    if 'X-Amz-Credential' in req.params or \
-            req.headers.get('Authorization', '').startswith(
-                'AWS4-HMAC-SHA256 '):
+    auth = env.get('HTTP_AUTHORIZATION')
+    query_keys = _query_keys(env.get('QUERY_STRING'))
+    if 'X-Amz-Credential' in query_keys or \
+            (auth or '').startswith('AWS4-HMAC-SHA256 '):
         # This is an Amazon SigV4 request
         return request_classes[1]
-    else:
+    elif auth is not None or 'AWSAccessKeyId' in query_keys:
         # The others using Amazon SigV2 class
         return request_classes[0]
+    return None
 
 
 class Request(swob.Request):
@@ -391,6 +855,14 @@ class Request(swob.Request):
 
     bucket_acl = _header_acl_property('container')
     object_acl = _header_acl_property('object')
+    # the StreamingInput decoding an aws-chunked body, if any
+    streaming_input = None
+    # the HashingInput checking x-amz-content-sha256, if any
+    hashing_input = None
+    # whether the subrequests carry the credentials through the auth pipeline
+    subrequests_need_auth = True
+    # (S3 key, Swift key, value) of the user metadata for subrequests
+    _swift_meta_headers = None
 
     def __init__(self, env, app=None, slo_enabled=True):
         # NOTE: app is not used by this class, need for compatibility of S3acl
@@ -412,6 +884,14 @@ class Request(swob.Request):
         self.account = None
         self.user_id = None
         self.slo_enabled = slo_enabled
+        # HEAD responses from Swift, until the next mutating subrequest
+        self._head_memo = {}
+        # (method, status, seconds) of each Swift subrequest
+        self.subrequests = []
+        # (account, container) of the buckets changed by the subrequests
+        self._changed_listings = set()
+        # Subrequests share Swift's account and container info cache
+        self.environ.setdefault('swift.infocache', {})
 
         # NOTE(andrey-mp): substitute authorization header for next modules
         # in pipeline (s3token). it uses this and X-Auth-Token in specific
@@ -713,6 +1193,22 @@ class Request(swob.Request):
         if self.environ['HTTP_CONTENT_MD5'] != digest:
             raise BadDigest(content_md5=self.environ['HTTP_CONTENT_MD5'])
 
+    def check_content_sha256(self):
+        """
+        Have the request body checked against x-amz-content-sha256 while
+        Swift reads it, if the header holds the SHA256 of the payload.
+        """
+        value = self.headers.get('X-Amz-Content-SHA256', '').lower()
+        if not SHA256_HEX_RE.match(value) or self.hashing_input is not None \
+                or 'X-Amz-Copy-Source' in self.headers:
+            return
+
+        offload = 0 < CONF.payload_hash_offload_size <= \
+            (self.content_length or 0)
+        self.hashing_input = HashingInput(
+            self.environ['wsgi.input'], value, self.content_length, offload)
+        self.environ['wsgi.input'] = self.hashing_input
+
     def _copy_source_headers(self):
         env = {}
         for key, value in self.environ.items():
@@ -761,11 +1257,26 @@ class Request(swob.Request):
                                  "attributes.")
         return src_resp
 
+    def _raw_path(self):
+        """
+        The request path as the client sent it.
+        """
+        return self.environ.get('RAW_PATH_INFO', self.path)
+
+    def _sorted_params(self):
+        """
+        The query parameters sorted by key, as both signature versions need
+        them.
+        """
+        if not self.query_string:
+            return []
+        return sorted(self.params.items())
+
     def _canonical_uri(self):
         """
         Require bucket name in canonical_uri for v2 in virtual hosted-style.
         """
-        raw_path_info = self.environ.get('RAW_PATH_INFO', self.path)
+        raw_path_info = self._raw_path()
         if self.bucket_in_host:
             raw_path_info = '/' + self.bucket_in_host + raw_path_info
         return raw_path_info
@@ -774,18 +1285,18 @@ class Request(swob.Request):
         """
         Create 'StringToSign' value in Amazon terminology for v2.
         """
-        amz_headers = {}
-
         buf = [self.method,
                _header_strip(self.headers.get('Content-MD5')) or '',
                _header_strip(self.headers.get('Content-Type')) or '']
 
-        for amz_header in sorted((key.lower() for key in self.headers
-                                  if key.lower().startswith('x-amz-'))):
-            amz_headers[amz_header] = self.headers[amz_header]
+        # x-amz-* headers live in the environ as HTTP_X_AMZ_*
+        amz_headers = sorted(
+            (key[5:].replace('_', '-').lower(), value)
+            for key, value in six.iteritems(self.environ)
+            if key.startswith('HTTP_X_AMZ_'))
 
         if self._is_header_auth:
-            if 'x-amz-date' in amz_headers:
+            if 'HTTP_X_AMZ_DATE' in self.environ:
                 buf.append('')
             elif 'Date' in self.headers:
                 buf.append(self.headers['Date'])
@@ -796,18 +1307,13 @@ class Request(swob.Request):
             # but as a sanity check...
             raise AccessDenied()
 
-        for k in sorted(key.lower() for key in amz_headers):
-            buf.append("%s:%s" % (k, amz_headers[k]))
+        for k, v in amz_headers:
+            buf.append("%s:%s" % (k, v))
 
         path = self._canonical_uri()
-        if self.query_string:
-            path += '?' + self.query_string
-        params = []
-        if '?' in path:
-            path, args = path.split('?', 1)
-            for key, value in sorted(self.params.items()):
-                if key in ALLOWED_SUB_RESOURCES:
-                    params.append('%s=%s' % (key, value) if value else key)
+        params = ['%s=%s' % (key, value) if value else key
+                  for key, value in self._sorted_params()
+                  if key in ALLOWED_SUB_RESOURCES]
         if params:
             buf.append('%s?%s' % (path, '&'.join(params)))
         else:
@@ -881,18 +1387,13 @@ class Request(swob.Request):
         else:
             account = self.account
 
-        env = self.environ.copy()
+        env = dict(self.environ)
 
-        for key in self.environ:
-            if key.startswith('HTTP_X_AMZ_META_'):
-                if not(set(env[key]).issubset(string.printable)):
-                    env[key] = Header(env[key], 'UTF-8').encode()
-                    if env[key].startswith('=?utf-8?q?'):
-                        env[key] = '=?UTF-8?Q?' + env[key][10:]
-                    elif env[key].startswith('=?utf-8?b?'):
-                        env[key] = '=?UTF-8?B?' + env[key][10:]
-                env['HTTP_X_OBJECT_META_' + key[16:]] = env[key]
-                del env[key]
+        if self._swift_meta_headers is None:
+            self._swift_meta_headers = _swift_meta_headers(self.environ)
+        for key, swift_key, value in self._swift_meta_headers:
+            env.pop(key, None)
+            env[swift_key] = value
 
         if 'HTTP_X_AMZ_COPY_SOURCE' in env:
             env['HTTP_X_COPY_FROM'] = env['HTTP_X_AMZ_COPY_SOURCE']
@@ -926,127 +1427,49 @@ class Request(swob.Request):
             query_string = '&'.join(params)
         env['QUERY_STRING'] = query_string
 
-        return swob.Request.blank(quote(path), environ=env, body=body,
-                                  headers=headers)
+        # the same as swob.Request.blank(), without parsing the path again
+        for key, value in SUBREQUEST_ENVIRON_DEFAULTS:
+            if key not in env:
+                env[key] = value
+        if 'wsgi.errors' not in env:
+            env['wsgi.errors'] = StringIO()
+        if body is not None:
+            env['wsgi.input'] = WsgiBytesIO(body)
+            env['CONTENT_LENGTH'] = str(len(body))
+        elif 'wsgi.input' not in env:
+            env['wsgi.input'] = WsgiBytesIO()
+
+        sw_req = swob.Request(env)
+        if headers:
+            for key, value in headers.items():
+                sw_req.headers[key] = value
+        return sw_req
 
     def _swift_success_codes(self, method, container, obj):
         """
         Returns a list of expected success codes from Swift.
         """
-        if not container:
-            # Swift account access.
-            code_map = {
-                'GET': [
-                    HTTP_OK,
-                ],
-            }
-        elif not obj:
-            # Swift container access.
-            code_map = {
-                'HEAD': [
-                    HTTP_NO_CONTENT,
-                ],
-                'GET': [
-                    HTTP_OK,
-                    HTTP_NO_CONTENT,
-                ],
-                'PUT': [
-                    HTTP_CREATED,
-                ],
-                'POST': [
-                    HTTP_NO_CONTENT,
-                ],
-                'DELETE': [
-                    HTTP_NO_CONTENT,
-                ],
-            }
-        else:
-            # Swift object access.
-            code_map = {
-                'HEAD': [
-                    HTTP_OK,
-                    HTTP_PARTIAL_CONTENT,
-                    HTTP_NOT_MODIFIED,
-                ],
-                'GET': [
-                    HTTP_OK,
-                    HTTP_PARTIAL_CONTENT,
-                    HTTP_NOT_MODIFIED,
-                ],
-                'PUT': [
-                    HTTP_CREATED,
-                ],
-                'POST': [
-                    HTTP_ACCEPTED,
-                ],
-                'DELETE': [
-                    HTTP_OK,
-                    HTTP_NO_CONTENT,
-                ],
-            }
-
-        return code_map[method]
+        return SWIFT_SUCCESS_CODES[_swift_path_kind(container, obj)][method]
 
     def _swift_error_codes(self, method, container, obj):
         """
         Returns a dict from expected Swift error codes to the corresponding S3
         error responses.
         """
-        if not container:
-            # Swift account access.
-            code_map = {
-                'GET': {
-                },
-            }
-        elif not obj:
-            # Swift container access.
-            code_map = {
-                'HEAD': {
-                    HTTP_NOT_FOUND: (NoSuchBucket, container),
-                },
-                'GET': {
-                    HTTP_NOT_FOUND: (NoSuchBucket, container),
-                },
-                'PUT': {
-                    HTTP_ACCEPTED: (BucketAlreadyExists, container),
-                },
-                'POST': {
-                    HTTP_NOT_FOUND: (NoSuchBucket, container),
-                },
-                'DELETE': {
-                    HTTP_NOT_FOUND: (NoSuchBucket, container),
-                    HTTP_CONFLICT: BucketNotEmpty,
-                },
-            }
-        else:
-            # Swift object access.
-            code_map = {
-                'HEAD': {
-                    HTTP_NOT_FOUND: (NoSuchKey, obj),
-                    HTTP_PRECONDITION_FAILED: PreconditionFailed,
-                },
-                'GET': {
-                    HTTP_NOT_FOUND: (NoSuchKey, obj),
-                    HTTP_PRECONDITION_FAILED: PreconditionFailed,
-                    HTTP_REQUESTED_RANGE_NOT_SATISFIABLE: InvalidRange,
-                },
-                'PUT': {
-                    HTTP_NOT_FOUND: (NoSuchBucket, container),
-                    HTTP_UNPROCESSABLE_ENTITY: BadDigest,
-                    HTTP_REQUEST_ENTITY_TOO_LARGE: EntityTooLarge,
-                    HTTP_LENGTH_REQUIRED: MissingContentLength,
-                    HTTP_REQUEST_TIMEOUT: RequestTimeout,
-                },
-                'POST': {
-                    HTTP_NOT_FOUND: (NoSuchKey, obj),
-                    HTTP_PRECONDITION_FAILED: PreconditionFailed,
-                },
-                'DELETE': {
-                    HTTP_NOT_FOUND: (NoSuchKey, obj),
-                },
-            }
-
-        return code_map[method]
+        names = {'container': container, 'obj': obj}
+        return dict(
+            (status, (error[0],) + tuple(names[arg] for arg in error[1:]))
+            for status, error in SWIFT_ERROR_CODES[
+                _swift_path_kind(container, obj)][method].items())
+
+    def _check_input_errors(self):
+        """
+        Raise the S3 error found by a wsgi.input wrapper while the body was
+        read, if any.
+        """
+        for checked_input in (self.streaming_input, self.hashing_input):
+            if checked_input is not None and checked_input.error:
+                raise checked_input.error
 
     def _get_response(self, app, method, container, obj,
                       headers=None, body=None, query=None):
@@ -1062,16 +1485,51 @@ class Request(swob.Request):
         if obj is None:
             obj = self.object_name
 
-        sw_req = self.to_swift_req(method, container, obj, headers=headers,
-                                   body=body, query=query)
+        memo_key = None
+        sw_resp = None
+        if method == 'HEAD':
+            # the account can't change within an S3 request
+            memo_key = (container, obj,
+                        tuple(sorted(query.items())) if query else None,
+                        tuple(sorted(headers.items())) if headers else None)
+            sw_resp = self._head_memo.get(memo_key)
+            LOGGER.increment('head_memo.%s' % ('hit' if sw_resp else 'miss'))
+        elif method != 'GET':
+            self._invalidate_backend_memo()
+
+        if sw_resp is None:
+            sw_req = self.to_swift_req(method, container, obj,
+                                       headers=headers, body=body,
+                                       query=query)
 
-        sw_resp = sw_req.get_response(app)
+            try:
+                sw_resp = self._call_swift(sw_req, app)
+            except IOError:
+                self._check_input_errors()
+                raise
+
+            if memo_key and (is_success(sw_resp.status_int) or
+                             sw_resp.status_int == HTTP_NOT_FOUND):
+                # read the body to drain the app_iter, so that the memoized
+                # response can be wrapped again
+                _ = sw_resp.body
+                self._head_memo[memo_key] = sw_resp
 
         # reuse account and tokens
         _, self.account, _ = split_path(sw_resp.environ['PATH_INFO'],
                                         2, 3, True)
         self.account = utf8encode(self.account)
 
+        if container and method not in ('GET', 'HEAD'):
+            # the bucket listing may have changed; see forget_listings()
+            self._changed_listings.add((self.account, container))
+            if not obj:
+                # the bucket may have been created, deleted or changed
+                self._forget_container_info(container)
+
+        # Swift reports a failed body read as a client disconnect
+        self._check_input_errors()
+
         resp = Response.from_swift_resp(sw_resp)
         status = resp.status_int  # pylint: disable-msg=E1101
 
@@ -1086,21 +1544,15 @@ class Request(swob.Request):
                 # tempauth
                 self.user_id = self.access_key
 
-        success_codes = self._swift_success_codes(method, container, obj)
-        error_codes = self._swift_error_codes(method, container, obj)
-
-        if status in success_codes:
+        if status in self._swift_success_codes(method, container, obj):
             return resp
 
         err_msg = resp.body
 
+        error_codes = self._swift_error_codes(method, container, obj)
         if status in error_codes:
-            err_resp = \
-                error_codes[sw_resp.status_int]  # pylint: disable-msg=E1101
-            if isinstance(err_resp, tuple):
-                raise err_resp[0](*err_resp[1:])
-            else:
-                raise err_resp()
+            err_resp = error_codes[status]
+            raise err_resp[0](*err_resp[1:])
 
         if status == HTTP_BAD_REQUEST:
             raise BadSwiftRequest(err_msg)
@@ -1111,6 +1563,61 @@ class Request(swob.Request):
 
         raise InternalError('unexpected status code %d' % status)
 
+    def _call_swift(self, sw_req, app):
+        """
+        Send a subrequest to Swift, and account for it in subrequests.  The
+        time is measured until Swift starts to respond.
+        """
+        status = 0
+        start = time.time()
+        try:
+            with tracing.span('backend', method=sw_req.method,
+                              path=sw_req.path) as span:
+                if span is not None:
+                    sw_req.environ['HTTP_TRACEPARENT'] = span.traceparent
+                sw_resp = sw_req.get_response(app)
+                status = sw_resp.status_int
+                if span is not None:
+                    span.attributes['status'] = status
+            return sw_resp
+        finally:
+            self.subrequests.append(
+                (sw_req.method, status, time.time() - start))
+
+    @property
+    def operation_name(self):
+        """
+        The S3 operation, like GET.Object or POST.Upload, as used in metric
+        names.
+        """
+        name = self.controller_name
+        if name == 'S3Acl':
+            # the same operation as without s3_acl
+            name = 'Acl'
+        return '%s.%s' % (self.method, name)
+
+    def concurrent_copy(self):
+        """
+        Returns a copy of this request which can send subrequests
+        concurrently with it.  The copy has its own environment, HEAD memo
+        and list of subrequests, which the caller merges back as needed.
+        """
+        sub_req = copy.copy(self)
+        sub_req.environ = dict(self.environ)
+        sub_req._head_memo = {}
+        sub_req.subrequests = []
+        return sub_req
+
+    def _invalidate_backend_memo(self):
+        """
+        Forget the HEAD responses and the Swift account and container info
+        seen so far, as the next subrequest may change them.
+        """
+        self._head_memo.clear()
+        infocache = self.environ.get('swift.infocache')
+        if infocache:
+            infocache.clear()
+
     def get_response(self, app, method=None, container=None, obj=None,
                      headers=None, body=None, query=None):
         """
@@ -1151,23 +1658,37 @@ class Request(swob.Request):
 
         return value
 
-    def get_container_info(self, app):
+    def get_container_info(self, app, authorizing=False):
         """
         get_container_info will return a result dict of get_container_info
         from the backend Swift.
 
+        :param authorizing: whether the info is used to authorize the
+                            request; it is then never taken from
+                            CONTAINER_INFO_CACHE, which only this worker
+                            invalidates, but from the info cached by Swift
         :returns: a dictionary of container info from
                   swift.controllers.base.get_container_info
         :raises: NoSuchBucket when the container doesn't exist
         :raises: InternalError when the request failed without 404
         """
+        cache_keys = ()
+        if CONF.container_info_cache_time > 0:
+            cache_keys = self._container_info_cache_keys(self.container_name)
+        if cache_keys and not authorizing:
+            info = CONTAINER_INFO_CACHE.get(cache_keys[-1])
+            LOGGER.increment(
+                'container_info_cache.%s' % ('hit' if info else 'miss'))
+            if info:
+                return info
+
         if self.is_authenticated:
             # if we have already authenticated, yes we can use the account
             # name like as AUTH_xxx for performance efficiency
-            sw_req = self.to_swift_req(app, self.container_name, None)
+            sw_req = self.to_swift_req('HEAD', self.container_name, None)
             info = get_container_info(sw_req.environ, app)
             if is_success(info['status']):
-                return info
+                pass
             elif info['status'] == 404:
                 raise NoSuchBucket(self.container_name)
             else:
@@ -1176,9 +1697,52 @@ class Request(swob.Request):
         else:
             # otherwise we do naive HEAD request with the authentication
             resp = self.get_response(app, 'HEAD', self.container_name, '')
-            return headers_to_container_info(
+            info = headers_to_container_info(
                 resp.sw_headers, resp.status_int)  # pylint: disable-msg=E1101
 
+        if cache_keys:
+            # the request is authenticated by now, so the info can be cached
+            # for both the access key and the account
+            for key in self._container_info_cache_keys(self.container_name):
+                CONTAINER_INFO_CACHE.set(key, info)
+        return info
+
+    def _container_info_cache_keys(self, container):
+        """
+        Returns the keys of the container in CONTAINER_INFO_CACHE, the one
+        usable at this point of the request last.
+        """
+        keys = [(self.access_key, container)]
+        if self.account is not None:
+            keys.append((self.account, container))
+        return keys
+
+    def _forget_container_info(self, container):
+        """
+        Drop what the caches know about the container.
+        """
+        for key in self._container_info_cache_keys(container):
+            CONTAINER_INFO_CACHE.pop(key)
+        if self.account is not None:
+            BUCKET_OWNER_CACHE.pop((self.account, container))
+
+    def check_listing_permission(self, app):
+        """
+        Check that the requester may list the bucket, like its GET would,
+        but with a HEAD of the bucket.  Without s3_acl, that HEAD is what
+        verifies the signature, so it is sent even for a cached listing.
+        """
+        self.get_response(app, 'HEAD')
+
+    def forget_listings(self):
+        """
+        Drop the cached listings of the buckets changed by the subrequests,
+        once per bucket.  Called once the S3 operation is over.
+        """
+        changed, self._changed_listings = self._changed_listings, set()
+        for account, container in changed:
+            forget_listings(self.environ, account, container)
+
     def gen_multipart_manifest_delete_query(self, app):
         if not CONF.allow_multipart_uploads:
             return None
@@ -1191,6 +1755,8 @@ class S3AclRequest(Request):
     """
     S3Acl request object.
     """
+    subrequests_need_auth = False
+
     def __init__(self, env, app, slo_enabled=True):
         super(S3AclRequest, self).__init__(env, slo_enabled)
         self.authenticate(app)
@@ -1208,11 +1774,45 @@ class S3AclRequest(Request):
         Note that it currently supports only keystone and tempauth.
         (no support for the third party authentication middleware)
         """
+        with tracing.span('auth') as span:
+            cache_key = None
+            cached = None
+            if CONF.auth_cache_time > 0:
+                cache_key = (
+                    self.access_key, self.signature,
+                    sha256(utf8encode(self.string_to_sign)).hexdigest())
+                cached = AUTH_CACHE.get(cache_key)
+                LOGGER.increment(
+                    'auth_cache.%s' % ('hit' if cached else 'miss'))
+            if span is not None:
+                span.attributes['cached'] = bool(cached)
+
+            if cached:
+                self.account, self.user_id, self.token, signing_key = cached
+                if signing_key is not None:
+                    self._chunk_signing_key = signing_key
+            else:
+                self._pre_authenticate(app)
+                if cache_key:
+                    AUTH_CACHE.set(cache_key, (
+                        self.account, self.user_id, self.token,
+                        getattr(self, '_chunk_signing_key', None)))
+
+        # Need to skip S3 authorization on subsequent requests to prevent
+        # overwriting the account in PATH_INFO
+        del self.headers['Authorization']
+        del self.environ['swift3.auth_details']
+
+    def _pre_authenticate(self, app):
+        """
+        Send a TEST request through the auth pipeline to verify the
+        signature and learn the account, user and token.
+        """
         sw_req = self.to_swift_req('TEST', None, None, body='')
         # don't show log message of this request
         sw_req.environ['swift.proxy_access_log_made'] = True
 
-        sw_resp = sw_req.get_response(app)
+        sw_resp = self._call_swift(sw_req, app)
 
         if not sw_req.remote_user:
             raise SignatureDoesNotMatch()
@@ -1231,11 +1831,6 @@ class S3AclRequest(Request):
             # tempauth
             self.user_id = self.access_key
 
-        # Need to skip S3 authorization on subsequent requests to prevent
-        # overwriting the account in PATH_INFO
-        del self.headers['Authorization']
-        del self.environ['swift3.auth_details']
-
     def to_swift_req(self, method, container, obj, query=None,
                      body=None, headers=None):
         sw_req = super(S3AclRequest, self).to_swift_req(
@@ -1246,6 +1841,20 @@ class S3AclRequest(Request):
             sw_req.environ['swift.authorize'] = lambda req: None
         return sw_req
 
+    def check_listing_permission(self, app):
+        """
+        Check the READ permission of the bucket, like its GET would.  The
+        request is authenticated already, so the ACL is taken from the
+        container info cached by Swift, which the proxies invalidate when
+        the bucket ACL is changed.
+        """
+        with tracing.span('acl', resource='container', permission='READ'):
+            info = self.get_container_info(app, authorizing=True)
+            headers = dict(('x-container-sysmeta-' + key, value)
+                           for key, value in info.get('sysmeta', {}).items())
+            decode_acl('container', headers).check_permission(
+                self.user_id, 'READ')
+
     def get_acl_response(self, app, method=None, container=None, obj=None,
                          headers=None, body=None, query=None):
         """
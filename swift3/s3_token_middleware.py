@@ -32,22 +32,39 @@ This WSGI component:
 """
 
 import base64
+import calendar
+from hashlib import sha256
 import json
 import logging
+import re
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, \
+    HTTPSConnectionPool
+from requests.packages.urllib3.exceptions import PoolError
 import six
+from six.moves import urllib
 
+from swift.common.http import HTTP_UNAUTHORIZED
 from swift.common.swob import Request, HTTPBadRequest, HTTPUnauthorized, \
-    HTTPException
-from swift.common.utils import config_true_value, split_path
+    HTTPServiceUnavailable, HTTPException
+from swift.common.utils import cache_from_env, config_true_value, \
+    split_path
 from swift.common.wsgi import ConfigFileError
 
+from swift3.cache import CircuitBreaker, FailureBackoff, LRUCache, \
+    RequestCoalescer
 from swift3.utils import is_valid_ipv6
 
 
 PROTOCOL_NAME = 'S3 Token Authentication'
 
+# The expiry of a Keystone token, e.g. 2017-04-20T12:00:00.000000Z
+_ISO8601_RE = re.compile(
+    r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?$')
+
 # Headers to purge if they came from (or may have come from) the client
 KEYSTONE_AUTH_HEADERS = (
     'X-Identity-Status', 'X-Service-Identity-Status',
@@ -73,6 +90,36 @@ KEYSTONE_AUTH_HEADERS = (
 )
 
 
+class KeystoneUnavailable(Exception):
+    """
+    Keystone could not be reached, or failed with a 5xx reply.
+    """
+    pass
+
+
+def token_expiry(token):
+    """
+    Returns when the token of a Keystone v2 or v3 reply expires, in seconds
+    since the epoch, or None if the reply doesn't say or can't be parsed.
+    """
+    try:
+        if 'access' in token:
+            expires = token['access']['token']['expires']
+        else:
+            expires = token['token']['expires_at']
+        match = _ISO8601_RE.match(expires)
+    except (KeyError, TypeError):
+        return None
+    if not match:
+        return None
+    date, offset = match.groups()
+    expiry = calendar.timegm(time.strptime(date, '%Y-%m-%dT%H:%M:%S'))
+    if offset and offset != 'Z':
+        minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+        expiry -= minutes * 60 if offset[0] == '+' else -minutes * 60
+    return expiry
+
+
 def parse_v2_response(token):
     access_info = token['access']
     headers = {
@@ -112,6 +159,83 @@ def parse_v3_response(token):
     return headers, None, token['project']
 
 
+class _InstrumentedPoolMixin(object):
+    """
+    Keeps track of the connections handed out by a urllib3 connection pool.
+    """
+    pool_timeout = None
+    in_use = 0
+    wait_time = 0.0
+
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = self.pool_timeout
+        start = time.time()
+        try:
+            conn = super(_InstrumentedPoolMixin, self)._get_conn(timeout)
+        finally:
+            self.wait_time += time.time() - start
+        self.in_use += 1
+        return conn
+
+    def _put_conn(self, conn):
+        # urllib3 also gives back a placeholder when checking out failed
+        if self.in_use > 0:
+            self.in_use -= 1
+        super(_InstrumentedPoolMixin, self)._put_conn(conn)
+
+    def idle_connections(self):
+        queue = getattr(self.pool, 'queue', None) or []
+        return sum(1 for conn in queue if conn is not None)
+
+
+class KeystoneHTTPAdapter(HTTPAdapter):
+    """
+    A requests transport adapter which keeps connections to Keystone alive.
+
+    Connections (and so their TLS sessions) are reused between requests.
+    With ``pool_block`` enabled, at most ``pool_maxsize`` connections are
+    opened per host and callers wait up to ``pool_timeout`` seconds for one
+    to become available.  The sockets are whatever the ``socket`` module
+    provides, so once eventlet has monkey patched it a waiting request only
+    blocks its own green thread.
+    """
+    def __init__(self, pool_timeout=None, **kwargs):
+        self.pool_timeout = pool_timeout
+        super(KeystoneHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(KeystoneHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        attrs = {'pool_timeout': self.pool_timeout}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('InstrumentedHTTPConnectionPool',
+                         (_InstrumentedPoolMixin, HTTPConnectionPool), attrs),
+            'https': type('InstrumentedHTTPSConnectionPool',
+                          (_InstrumentedPoolMixin, HTTPSConnectionPool),
+                          attrs),
+        }
+
+    def pool_stats(self):
+        """
+        Returns a dict of the connection counters summed over all hosts.
+
+        ``created`` is the number of connections opened so far and
+        ``wait_time`` the total number of seconds spent waiting for a
+        connection to become available.
+        """
+        stats = {'in_use': 0, 'idle': 0, 'created': 0, 'wait_time': 0.0}
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['in_use'] += pool.in_use
+            stats['idle'] += pool.idle_connections()
+            stats['created'] += pool.num_connections
+            stats['wait_time'] += pool.wait_time
+        return stats
+
+
 class S3Token(object):
     """Middleware that handles S3 authentication."""
 
@@ -164,11 +288,320 @@ class S3Token(object):
         else:
             self._verify = None
 
+        # Keep-alive connections to Keystone
+        pool_size = int(conf.get('http_pool_size', 10))
+        if pool_size < 1:
+            raise ValueError('http_pool_size must be a positive integer')
+        self._adapter = KeystoneHTTPAdapter(
+            pool_timeout=self._timeout, pool_maxsize=pool_size,
+            pool_block=config_true_value(conf.get('http_pool_block')))
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+        # Cache of validated credentials
+        self._token_cache_time = float(conf.get('token_cache_time', 0))
+        if self._token_cache_time < 0:
+            raise ValueError('token_cache_time must not be negative')
+        self._token_cache_backend = conf.get('token_cache_backend', 'local')
+        if self._token_cache_backend not in ('local', 'memcache'):
+            raise ValueError('token_cache_backend must be either local or '
+                             'memcache')
+        self._token_cache = LRUCache(
+            maxsize=int(conf.get('token_cache_size', 10000)),
+            maxtime=self._token_cache_time)
+        # the requests waiting on a failed call share its failure rather
+        # than calling Keystone, and its breaker, in turn
+        self._coalescer = RequestCoalescer(share_failures=True)
+
+        # Cache of EC2 secrets for verifying signatures locally
+        self._secret_cache_duration = float(
+            conf.get('secret_cache_duration', 0))
+        if self._secret_cache_duration < 0:
+            raise ValueError('secret_cache_duration must not be negative')
+        # NB: secrets are only ever kept in the memory of this process, even
+        # with the memcache token_cache_backend
+        self._secret_cache = LRUCache(
+            maxsize=int(conf.get('token_cache_size', 10000)),
+            maxtime=self._secret_cache_duration)
+        # Access keys whose secret couldn't be fetched lately
+        secret_failure_duration = float(
+            conf.get('secret_failure_cache_duration', 10))
+        if secret_failure_duration < 0:
+            raise ValueError('secret_failure_cache_duration must not be '
+                             'negative')
+        self._secret_failures = LRUCache(
+            maxsize=int(conf.get('token_cache_size', 10000)),
+            maxtime=secret_failure_duration)
+        self._service_token = None
+        if self._secret_cache_duration > 0:
+            self._service_auth_url = conf.get(
+                'auth_url', self._request_uri).rstrip('/')
+            self._service_credentials = {
+                'user': {
+                    'name': conf.get('username'),
+                    'password': conf.get('password'),
+                    'domain': {
+                        'name': conf.get('user_domain_name', 'Default')},
+                },
+            }
+            self._service_scope = {
+                'project': {
+                    'name': conf.get('project_name'),
+                    'domain': {
+                        'name': conf.get('project_domain_name', 'Default')},
+                },
+            }
+            if not all((conf.get('username'), conf.get('password'),
+                        conf.get('project_name'))):
+                raise ConfigFileError(
+                    'username, password and project_name are required '
+                    'when secret_cache_duration is set')
+
+        # Back off access keys and clients which keep failing to
+        # authenticate, so that they can't saturate Keystone
+        backoff_conf = {
+            'backoff': float(conf.get('auth_failure_backoff', 1)),
+            'max_backoff': float(conf.get('auth_failure_max_backoff', 300)),
+            'maxsize': int(conf.get('auth_failure_cache_size', 10000)),
+        }
+        if backoff_conf['backoff'] <= 0 or \
+                backoff_conf['max_backoff'] < backoff_conf['backoff']:
+            raise ValueError('auth_failure_backoff must be positive and not '
+                             'greater than auth_failure_max_backoff')
+        self._key_failures = FailureBackoff(
+            threshold=int(conf.get('auth_failure_threshold', 0)),
+            **backoff_conf)
+        self._source_failures = FailureBackoff(
+            threshold=int(conf.get('auth_failure_source_threshold', 0)),
+            **backoff_conf)
+        self._auth_rejections = {'access_key': 0, 'source': 0}
+
+        # Stop waiting on Keystone while it keeps failing, and fall back to
+        # the last known good secrets to verify signatures meanwhile
+        self._breaker = CircuitBreaker(
+            threshold=int(conf.get('breaker_threshold', 0)),
+            reset_timeout=float(conf.get('breaker_reset_timeout', 30)),
+            on_change=self._breaker_changed)
+        self._stale_secret_duration = float(
+            conf.get('stale_secret_duration', 0))
+        if self._stale_secret_duration < 0:
+            raise ValueError('stale_secret_duration must not be negative')
+        self._stale_secrets = LRUCache(
+            maxsize=int(conf.get('token_cache_size', 10000))
+            if self._secret_cache_duration > 0 else 0,
+            maxtime=self._stale_secret_duration)
+        self._breaker_rejections = {'fallback': 0, 'fail_fast': 0}
+
+    def _token_cache_key(self, credentials, force_tenant):
+        """
+        Returns a cache key for the validation result of the credentials.
+
+        The key covers the signature and the string to sign as well as the
+        access key, so a cached result only ever matches the exact signed
+        request which was validated.  Swift3 rejects the request before it
+        gets here once its date or expiry is out of the validity window, so
+        the entry cannot be reused with a replayed signature after that.
+        """
+        key = '\n'.join([credentials['access'], force_tenant or '',
+                         credentials['signature'], credentials['token']])
+        if isinstance(key, six.text_type):
+            key = key.encode('utf-8')
+        return 's3token/%s' % sha256(key).hexdigest()
+
+    def _cache_get(self, environ, local_cache, key):
+        if self._token_cache_backend == 'memcache':
+            memcache_client = cache_from_env(environ, True)
+            if memcache_client is None:
+                return None
+            return memcache_client.get(key)
+        return local_cache.get(key)
+
+    def _cache_set(self, environ, local_cache, key, value, ttl):
+        if self._token_cache_backend == 'memcache':
+            memcache_client = cache_from_env(environ, True)
+            if memcache_client is not None:
+                memcache_client.set(key, value, time=ttl)
+        else:
+            local_cache.set(key, value)
+
+    def _cache_delete(self, environ, local_cache, key):
+        if self._token_cache_backend == 'memcache':
+            memcache_client = cache_from_env(environ, True)
+            if memcache_client is not None:
+                memcache_client.delete(key)
+        else:
+            local_cache.pop(key)
+
+    def _unexpired(self, validation):
+        """
+        Returns the cached validation, or None if its token has expired.
+        """
+        if validation and validation.get('expires', 0) > time.time():
+            return validation
+        return None
+
+    def _secret_cache_key(self, access):
+        if isinstance(access, six.text_type):
+            access = access.encode('utf-8')
+        return 's3secret/%s' % sha256(access).hexdigest()
+
+    def _get_service_token(self):
+        if self._service_token is None:
+            body = {'auth': {'identity': {
+                'methods': ['password'],
+                'password': self._service_credentials,
+            }, 'scope': self._service_scope}}
+            response = self._session.post(
+                '%s/v3/auth/tokens' % self._service_auth_url,
+                headers={'Content-Type': 'application/json'},
+                data=json.dumps(body), verify=self._verify,
+                timeout=self._timeout)
+            response.raise_for_status()
+            self._service_token = response.headers['X-Subject-Token']
+        return self._service_token
+
+    def _fetch_secret(self, user_id, access):
+        """
+        Looks up the secret of an EC2 credential in Keystone.
+
+        Returns None when the secret can't be fetched; the request was
+        already validated by Keystone, so that only means the next requests
+        with this access key will be validated remotely too.  Keystone isn't
+        asked again for that key for secret_failure_cache_duration seconds,
+        nor while the circuit breaker is open.
+        """
+        failure_key = self._secret_cache_key(access)
+        if failure_key in self._secret_failures or \
+                not self._breaker.allow():
+            return None
+        url = '%s/v3/users/%s/credentials/OS-EC2/%s' % (
+            self._service_auth_url, urllib.parse.quote(user_id),
+            urllib.parse.quote(access))
+        try:
+            for attempt in range(2):
+                response = self._session.get(
+                    url, headers={'X-Auth-Token': self._get_service_token()},
+                    verify=self._verify, timeout=self._timeout)
+                if response.status_code != 401:
+                    break
+                # our token has expired (or been revoked); get a new one
+                self._service_token = None
+            response.raise_for_status()
+            secret = response.json()['credential']['secret']
+        except (requests.exceptions.RequestException, PoolError,
+                ValueError, KeyError, TypeError) as e:
+            self._logger.info('Unable to fetch the EC2 secret: %s', e)
+            # only connection errors and 5xx replies count against Keystone
+            response = getattr(e, 'response', None)
+            if isinstance(e, PoolError) or (
+                    isinstance(e, requests.exceptions.RequestException) and
+                    (response is None or response.status_code >= 500)):
+                self._breaker.failure()
+            else:
+                self._breaker.success()
+            self._secret_failures.set(failure_key, True)
+            return None
+        self._breaker.success()
+        if isinstance(secret, six.text_type):
+            secret = secret.encode('utf-8')
+        return secret
+
+    def pool_stats(self):
+        """
+        Returns the statistics of the connection pool used to reach Keystone.
+        """
+        return self._adapter.pool_stats()
+
+    def auth_failure_stats(self):
+        """
+        Returns the number of requests rejected by the authentication
+        failure backoff per reason, and the number of tracked keys.
+        """
+        return {'rejected_access_key': self._auth_rejections['access_key'],
+                'rejected_source': self._auth_rejections['source'],
+                'access_keys': len(self._key_failures),
+                'sources': len(self._source_failures)}
+
+    def _check_auth_backoff(self, access, source):
+        # the access key is only blocked for the client which keeps
+        # failing, so that nobody can lock the owner of a key out
+        for reason, failures, key in (
+                ('access_key', self._key_failures, (access, source)),
+                ('source', self._source_failures, source)):
+            if key and failures.blocked(key):
+                self._auth_rejections[reason] += 1
+                self._logger.info('Too many failed authentications for %s '
+                                  '%s, rejecting request', reason,
+                                  key if reason == 'source' else access)
+                raise self._deny_request('AccessDenied')
+
+    def _record_auth_failure(self, access, source):
+        self._key_failures.failure((access, source))
+        if source:
+            self._source_failures.failure(source)
+
+    def breaker_stats(self):
+        """
+        Returns the state of the Keystone circuit breaker, the number of its
+        transitions per new state, and how the requests which arrived while
+        it was open were handled.
+        """
+        stats = {'state': self._breaker.state,
+                 'fallback': self._breaker_rejections['fallback'],
+                 'fail_fast': self._breaker_rejections['fail_fast']}
+        stats.update(('to_%s' % state, count) for state, count
+                     in self._breaker.transitions.items())
+        return stats
+
+    def _breaker_changed(self, old_state, new_state):
+        log = self._logger.warning \
+            if new_state == CircuitBreaker.OPEN else self._logger.info
+        log('Keystone circuit breaker changed from %s to %s',
+            old_state, new_state)
+
+    def _stale_credentials(self, access, check_signature):
+        """
+        Returns the last known good validation of the access key, if the
+        request signature matches its secret.  Raises ServiceUnavailable
+        otherwise, as Keystone is not asked while the breaker is open.
+        """
+        cached = self._unexpired(
+            self._stale_secrets.get(self._secret_cache_key(access)))
+        if cached and check_signature:
+            secret = cached['secret']
+            if isinstance(secret, six.text_type):
+                secret = secret.encode('utf-8')
+            if check_signature(secret):
+                self._breaker_rejections['fallback'] += 1
+                self._logger.debug('Keystone circuit breaker is open, '
+                                   'verified S3 signature with a stale '
+                                   'secret')
+                return cached
+        self._breaker_rejections['fail_fast'] += 1
+        self._logger.debug('Keystone circuit breaker is open, rejecting '
+                           'request')
+        raise self._deny_request('ServiceUnavailable')
+
+    def _reject(self, e_resp, environ, start_response):
+        if self._delay_auth_decision:
+            msg = 'Received error, deferring rejection based on error: %s'
+            self._logger.debug(msg, e_resp.status)
+            return self._app(environ, start_response)
+        else:
+            msg = 'Received error, rejecting request with error: %s'
+            self._logger.debug(msg, e_resp.status)
+            # NB: swob.Response, not requests.Response
+            return e_resp(environ, start_response)
+
     def _deny_request(self, code):
         error_cls, message = {
             'AccessDenied': (HTTPUnauthorized, 'Access denied'),
             'InvalidURI': (HTTPBadRequest,
                            'Could not parse the specified URI'),
+            'ServiceUnavailable': (HTTPServiceUnavailable,
+                                   'The authentication service is '
+                                   'unavailable. Please try again later.'),
         }[code]
         resp = error_cls(content_type='text/xml')
         error_msg = ('<?xml version="1.0" encoding="UTF-8"?>\r\n'
@@ -183,19 +616,28 @@ class S3Token(object):
     def _json_request(self, creds_json):
         headers = {'Content-Type': 'application/json'}
         try:
-            response = requests.post('%s/v2.0/s3tokens' % self._request_uri,
-                                     headers=headers, data=creds_json,
-                                     verify=self._verify,
-                                     timeout=self._timeout)
-        except requests.exceptions.RequestException as e:
+            response = self._session.post(
+                '%s/v2.0/s3tokens' % self._request_uri,
+                headers=headers, data=creds_json, verify=self._verify,
+                timeout=self._timeout)
+        except (requests.exceptions.RequestException, PoolError) as e:
             self._logger.info('HTTP connection exception: %s', e)
-            raise self._deny_request('InvalidURI')
-
-        if response.status_code < 200 or response.status_code >= 300:
-            self._logger.debug('Keystone reply error: status=%s reason=%s',
-                               response.status_code, response.reason)
-            raise self._deny_request('AccessDenied')
-
+            self._breaker.failure()
+            raise KeystoneUnavailable(e)
+        finally:
+            if self._logger.isEnabledFor(logging.DEBUG):
+                self._logger.debug('Keystone connection pool: %s',
+                                   self.pool_stats())
+
+        if response.status_code >= 500:
+            self._logger.info('Keystone reply error: status=%s reason=%s',
+                              response.status_code, response.reason)
+            self._breaker.failure()
+            raise KeystoneUnavailable(response.status_code)
+        self._breaker.success()
+
+        # NB: rejected credentials are returned, so that the caller can
+        # tell them from the other client errors
         return response
 
     def __call__(self, environ, start_response):
@@ -265,52 +707,126 @@ class S3Token(object):
         #              change token_auth to detect if we already
         #              identified and not doing a second query and just
         #              pass it through to swiftauth in this case.
-        try:
-            # NB: requests.Response, not swob.Response
-            resp = self._json_request(creds_json)
-        except HTTPException as e_resp:
-            if self._delay_auth_decision:
-                msg = 'Received error, deferring rejection based on error: %s'
-                self._logger.debug(msg, e_resp.status)
-                return self._app(environ, start_response)
-            else:
-                msg = 'Received error, rejecting request with error: %s'
-                self._logger.debug(msg, e_resp.status)
-                # NB: swob.Response, not requests.Response
-                return e_resp(environ, start_response)
-
-        self._logger.debug('Keystone Reply: Status: %d, Output: %s',
-                           resp.status_code, resp.content)
-
-        try:
-            token = resp.json()
-            if 'access' in token:
-                headers, token_id, tenant = parse_v2_response(token)
-            elif 'token' in token:
-                headers, token_id, tenant = parse_v3_response(token)
-            else:
-                raise ValueError
-
-            # Populate the environment similar to auth_token,
-            # so we don't have to contact Keystone again.
-            #
-            # Note that although the strings are unicode following json
-            # deserialization, Swift's HeaderEnvironProxy handles ensuring
-            # they're stored as native strings
-            req.headers.update(headers)
-            req.environ['keystone.token_info'] = token
-        except (ValueError, KeyError, TypeError):
-            if self._delay_auth_decision:
-                error = ('Error on keystone reply: %d %s - '
-                         'deferring rejection downstream')
-                self._logger.debug(error, resp.status_code, resp.content)
-                return self._app(environ, start_response)
-            else:
-                error = ('Error on keystone reply: %d %s - '
-                         'rejecting request')
-                self._logger.debug(error, resp.status_code, resp.content)
-                return self._deny_request('InvalidURI')(
-                    environ, start_response)
+        cache_key = None
+        cached = None
+        secret_key = None
+        check_signature = s3_auth_details.get('check_signature')
+        if self._secret_cache_duration > 0 and check_signature:
+            secret_key = self._secret_cache_key(access)
+            cached = self._unexpired(self._secret_cache.get(secret_key))
+            if cached:
+                secret = cached['secret']
+                if isinstance(secret, six.text_type):
+                    secret = secret.encode('utf-8')
+                if check_signature(secret):
+                    self._logger.debug('Verified S3 signature locally')
+                    self._stale_secrets.set(secret_key, cached)
+                    secret_key = None
+                else:
+                    # the secret may have been rotated, or the signature may
+                    # simply be wrong: ask Keystone, and keep the cached
+                    # secret unless Keystone accepts the signature, so that
+                    # anyone knowing the access key can't evict it
+                    cached = None
+
+        if not cached and self._token_cache_time > 0:
+            cache_key = self._token_cache_key(creds['credentials'],
+                                              force_tenant)
+            cached = self._unexpired(
+                self._cache_get(environ, self._token_cache, cache_key))
+
+        source = environ.get('REMOTE_ADDR')
+        if not cached:
+            try:
+                self._check_auth_backoff(access, source)
+                if not self._breaker.allow():
+                    cached = self._stale_credentials(access, check_signature)
+                    secret_key = None
+            except HTTPException as e_resp:
+                return self._reject(e_resp, environ, start_response)
+
+        if cached:
+            self._logger.debug('Using cached S3 token validation')
+            headers = cached['headers']
+            token_id = cached['token_id']
+            tenant = cached['tenant']
+            token = cached['token']
+        else:
+            try:
+                # NB: requests.Response, not swob.Response
+                if cache_key:
+                    resp = self._coalescer.run(
+                        cache_key, self._json_request, creds_json)
+                else:
+                    resp = self._json_request(creds_json)
+            except KeystoneUnavailable:
+                # each request gets its own response, even when it shared
+                # the failed call of another one
+                return self._reject(self._deny_request('ServiceUnavailable'),
+                                    environ, start_response)
+            except HTTPException as e_resp:
+                return self._reject(e_resp, environ, start_response)
+
+            if resp.status_code < 200 or resp.status_code >= 300:
+                self._logger.debug('Keystone reply error: status=%s '
+                                   'reason=%s', resp.status_code, resp.reason)
+                if resp.status_code == HTTP_UNAUTHORIZED:
+                    self._record_auth_failure(access, source)
+                return self._reject(self._deny_request('AccessDenied'),
+                                    environ, start_response)
+            self._key_failures.success((access, source))
+
+            self._logger.debug('Keystone Reply: Status: %d, Output: %s',
+                               resp.status_code, resp.content)
+
+            try:
+                token = resp.json()
+                if 'access' in token:
+                    headers, token_id, tenant = parse_v2_response(token)
+                elif 'token' in token:
+                    headers, token_id, tenant = parse_v3_response(token)
+                else:
+                    raise ValueError
+            except (ValueError, KeyError, TypeError):
+                if self._delay_auth_decision:
+                    error = ('Error on keystone reply: %d %s - '
+                             'deferring rejection downstream')
+                    self._logger.debug(error, resp.status_code, resp.content)
+                    return self._app(environ, start_response)
+                else:
+                    error = ('Error on keystone reply: %d %s - '
+                             'rejecting request')
+                    self._logger.debug(error, resp.status_code, resp.content)
+                    return self._deny_request('InvalidURI')(
+                        environ, start_response)
+
+            # the validation carries the token, so it is never kept past
+            # the expiry of the token, nor at all if that is unknown
+            expires = token_expiry(token)
+            ttl = 0 if expires is None else int(expires - time.time())
+            if cache_key and ttl > 0:
+                self._cache_set(environ, self._token_cache, cache_key, {
+                    'headers': headers, 'token_id': token_id,
+                    'tenant': tenant, 'token': token, 'expires': expires},
+                    min(self._token_cache_time, ttl))
+            if secret_key and ttl > 0:
+                secret = self._fetch_secret(headers['X-User-Id'], access)
+                if secret is not None:
+                    validation = {
+                        'headers': headers, 'token_id': token_id,
+                        'tenant': tenant, 'token': token, 'secret': secret,
+                        'expires': expires}
+                    self._secret_cache.set(secret_key, validation)
+                    self._stale_secrets.set(secret_key, validation)
+
+        # Populate the environment similar to auth_token,
+        # so we don't have to contact Keystone again.
+        #
+        # Note that although the strings are unicode following json
+        # deserialization, Swift's HeaderEnvironProxy handles ensuring
+        # they're stored as native strings
+        req.headers.update(headers)
+        req.environ['keystone.token_info'] = token
 
         req.headers['X-Auth-Token'] = token_id
         tenant_to_connect = force_tenant or tenant['id']
@@ -0,0 +1,100 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark of the serialization of bucket listings.
+
+Run it with::
+
+    python -m swift3.test.benchmark.bench_listing [keys] [iterations]
+
+It prints the time to serialize a ListBucketResult of the given number of
+keys as BucketController.GET does now, streaming the rows with
+tostring_iter(), and as it used to, building the whole tree for tostring()
+(the "legacy" column), with and without encoding-type=url.
+"""
+
+import sys
+import timeit
+
+from swift3.controllers.bucket import BucketController
+from swift3.etree import Element, SubElement, tostring, tostring_iter
+
+
+class FakeRequest(object):
+    user_id = 'test:tester'
+
+
+def listing(keys):
+    return [{'name': u'photos/2017/IMG_%05d.jpg' % i,
+             'last_modified': '2017-01-05T02:19:14.275290',
+             'hash': 'd41d8cd98f00b204e9800998ecf8427e',
+             'bytes': 1024 * i} for i in range(keys)]
+
+
+def header():
+    elem = Element('ListBucketResult')
+    SubElement(elem, 'Name').text = 'bucket'
+    SubElement(elem, 'Prefix').text = 'photos/'
+    SubElement(elem, 'Marker').text = None
+    SubElement(elem, 'MaxKeys').text = '1000'
+    SubElement(elem, 'IsTruncated').text = 'false'
+    return elem
+
+
+def current(objects, encoding_type):
+    elem = header()
+    controller = BucketController(None)
+    return ''.join(tostring_iter(
+        elem, elem,
+        controller._iter_listing(FakeRequest(), objects, encoding_type),
+        encoding_type=encoding_type))
+
+
+def legacy(objects, encoding_type):
+    elem = header()
+    for o in objects:
+        contents = SubElement(elem, 'Contents')
+        SubElement(contents, 'Key').text = o['name']
+        SubElement(contents, 'LastModified').text = \
+            o['last_modified'][:-3] + 'Z'
+        SubElement(contents, 'ETag').text = '"%s"' % o['hash']
+        SubElement(contents, 'Size').text = str(o['bytes'])
+        owner = SubElement(contents, 'Owner')
+        SubElement(owner, 'ID').text = FakeRequest.user_id
+        SubElement(owner, 'DisplayName').text = FakeRequest.user_id
+        SubElement(contents, 'StorageClass').text = 'STANDARD'
+    return tostring(elem, encoding_type=encoding_type)
+
+
+def bench(func, iterations):
+    timer = timeit.Timer(func)
+    return min(timer.repeat(3, iterations)) / iterations * 1e3
+
+
+def main(keys=1000, iterations=20):
+    objects = listing(keys)
+    print('%-14s %12s %12s' % ('', 'current', 'legacy'))
+    for encoding_type in (None, 'url'):
+        assert current(objects, encoding_type) == \
+            legacy(objects, encoding_type)
+        print('%-14s %10.2fms %10.2fms' % (
+            'encoding=%s' % encoding_type,
+            bench(lambda: current(objects, encoding_type), iterations),
+            bench(lambda: legacy(objects, encoding_type), iterations)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
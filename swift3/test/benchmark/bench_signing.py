@@ -0,0 +1,180 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark of the string-to-sign computation.
+
+Run it with::
+
+    python -m swift3.test.benchmark.bench_signing [iterations]
+
+For each kind of signed request it prints the cost per request of the
+current canonicalization, and of the one which lowercased and stripped every
+request header and quoted every query parameter (the "legacy" column).
+"""
+
+from datetime import datetime
+import re
+import sys
+import timeit
+from urllib import quote
+
+import six
+
+from swift.common import swob
+from swift.common.swob import Request
+
+from swift3.request import Request as S3Request, SigV4Request, \
+    SignatureDoesNotMatch, _header_strip, ALLOWED_SUB_RESOURCES
+
+
+# the usual headers of an SDK request, most of which are not signed
+COMMON_HEADERS = {
+    'Accept': '*/*',
+    'Accept-Encoding': 'identity',
+    'Connection': 'keep-alive',
+    'Content-Type': 'application/octet-stream',
+    'Content-MD5': '1B2M2Y8AsgTpgAmY7PhCfg==',
+    'User-Agent': 'aws-cli/1.11.13 Python/2.7.12 botocore/1.4.70',
+    'X-Forwarded-For': '192.0.2.1',
+    'X-Amz-Meta-Color': 'blue',
+    'X-Amz-Meta-Shape': '  a   rather  long  shape  ',
+    'X-Amz-Storage-Class': 'STANDARD',
+}
+COMMON_HEADERS.update(
+    ('X-Amz-Meta-Key-%d' % i, 'value %d' % i) for i in range(20))
+
+QUERY = '&'.join(['uploadId=abc', 'partNumber=3', 'foo=a%20b/c'] +
+                 ['param%d=value%d' % (i, i) for i in range(10)])
+
+
+class LegacySigV4Request(SigV4Request):
+    def _canonical_query_string(self):
+        return '&'.join(
+            '%s=%s' % (quote(key, safe='-_.~'),
+                       quote(value, safe='-_.~'))
+            for key, value in sorted(self.params.items())
+            if key not in ('Signature', 'X-Amz-Signature'))
+
+    def _headers_to_sign(self):
+        headers_lower_dict = dict(
+            (k.lower().strip(), ' '.join(_header_strip(v or '').split()))
+            for (k, v) in six.iteritems(self.headers))
+
+        if 'host' in headers_lower_dict and re.match(
+                'Boto/2.[0-9].[0-2]',
+                headers_lower_dict.get('user-agent', '')):
+            headers_lower_dict['host'] = \
+                headers_lower_dict['host'].split(':')[0]
+
+        headers_to_sign = [
+            (key, value) for key, value in headers_lower_dict.items()
+            if key in self._signed_headers]
+
+        if len(headers_to_sign) != len(self._signed_headers):
+            raise SignatureDoesNotMatch()
+
+        return dict(headers_to_sign)
+
+
+class LegacyRequest(S3Request):
+    def _string_to_sign(self):
+        amz_headers = {}
+
+        buf = [self.method,
+               _header_strip(self.headers.get('Content-MD5')) or '',
+               _header_strip(self.headers.get('Content-Type')) or '']
+
+        for amz_header in sorted((key.lower() for key in self.headers
+                                  if key.lower().startswith('x-amz-'))):
+            amz_headers[amz_header] = self.headers[amz_header]
+
+        if 'x-amz-date' in amz_headers:
+            buf.append('')
+        elif 'Date' in self.headers:
+            buf.append(self.headers['Date'])
+
+        for k in sorted(key.lower() for key in amz_headers):
+            buf.append("%s:%s" % (k, amz_headers[k]))
+
+        path = self._canonical_uri()
+        if self.query_string:
+            path += '?' + self.query_string
+        params = []
+        if '?' in path:
+            path, args = path.split('?', 1)
+            for key, value in sorted(self.params.items()):
+                if key in ALLOWED_SUB_RESOURCES:
+                    params.append('%s=%s' % (key, value) if value else key)
+        if params:
+            buf.append('%s?%s' % (path, '&'.join(params)))
+        else:
+            buf.append(path)
+        return '\n'.join(buf)
+
+
+def v2_environ():
+    headers = dict(COMMON_HEADERS)
+    headers['Authorization'] = 'AWS test:tester:hmac'
+    headers['Date'] = datetime.utcnow().strftime(
+        '%a, %d %b %Y %H:%M:%S GMT')
+    return Request.blank('/bucket/object?' + QUERY,
+                         environ={'REQUEST_METHOD': 'PUT'},
+                         headers=headers).environ
+
+
+def v4_environ():
+    now = datetime.utcnow()
+    headers = dict(COMMON_HEADERS)
+    headers['Authorization'] = (
+        'AWS4-HMAC-SHA256 '
+        'Credential=test:tester/%s/US/s3/aws4_request, '
+        'SignedHeaders=content-md5;content-type;host;x-amz-content-sha256;'
+        'x-amz-date;x-amz-meta-shape,'
+        'Signature=X' % now.strftime('%Y%m%d'))
+    headers['X-Amz-Date'] = now.strftime('%Y%m%dT%H%M%SZ')
+    headers['X-Amz-Content-SHA256'] = 'UNSIGNED-PAYLOAD'
+    return Request.blank('/bucket/object?' + QUERY,
+                         environ={'REQUEST_METHOD': 'PUT'},
+                         headers=headers).environ
+
+
+def signing_request(request_class, environ):
+    # sign the request as it was received, like Request.__init__
+    req = request_class(dict(environ))
+    swob.Request.__init__(req, dict(environ))
+    req._params_cache = None
+    return req
+
+
+def bench(req, iterations):
+    timer = timeit.Timer(req._string_to_sign)
+    return min(timer.repeat(3, iterations)) / iterations * 1e6
+
+
+def main(iterations=10000):
+    print('%-10s %12s %12s' % ('request', 'current', 'legacy'))
+    for name, current, legacy, environ in (
+            ('v2', S3Request, LegacyRequest, v2_environ()),
+            ('v4', SigV4Request, LegacySigV4Request, v4_environ())):
+        current = signing_request(current, environ)
+        legacy = signing_request(legacy, environ)
+        assert current._string_to_sign() == legacy._string_to_sign()
+        print('%-10s %10.1fus %10.1fus' % (
+            name, bench(current, iterations), bench(legacy, iterations)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,170 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark of the construction of Swift subrequests.
+
+Run it with::
+
+    python -m swift3.test.benchmark.bench_subrequest [iterations]
+
+It prints the cost of Request.to_swift_req() and of looking up the expected
+Swift status codes per subrequest, as done now and as done by the
+implementation which scanned the environ for metadata and went through
+swob.Request.blank() on every subrequest (the "legacy" column).
+"""
+
+from datetime import datetime
+from email.header import Header
+import string
+import sys
+import timeit
+from urllib import quote
+
+from swift.common import swob
+from swift.common.http import HTTP_NOT_FOUND
+
+from swift3.cfg import CONF
+from swift3.request import Request as S3Request, NoSuchKey
+
+
+HEADERS = {
+    'Accept': '*/*',
+    'Accept-Encoding': 'identity',
+    'Connection': 'keep-alive',
+    'Content-Type': 'application/octet-stream',
+    'User-Agent': 'aws-cli/1.11.13 Python/2.7.12 botocore/1.4.70',
+    'X-Amz-Meta-Name': '\xe2\x98\x83',
+}
+HEADERS.update(
+    ('X-Amz-Meta-Key-%d' % i, 'value %d' % i) for i in range(10))
+
+
+class LegacyRequest(S3Request):
+    def to_swift_req(self, method, container, obj, query=None,
+                     body=None, headers=None):
+        env = self.environ.copy()
+
+        for key in self.environ:
+            if key.startswith('HTTP_X_AMZ_META_'):
+                if not(set(env[key]).issubset(string.printable)):
+                    env[key] = Header(env[key], 'UTF-8').encode()
+                    if env[key].startswith('=?utf-8?q?'):
+                        env[key] = '=?UTF-8?Q?' + env[key][10:]
+                    elif env[key].startswith('=?utf-8?b?'):
+                        env[key] = '=?UTF-8?B?' + env[key][10:]
+                env['HTTP_X_OBJECT_META_' + key[16:]] = env[key]
+                del env[key]
+
+        if 'HTTP_X_AMZ_COPY_SOURCE' in env:
+            env['HTTP_X_COPY_FROM'] = env['HTTP_X_AMZ_COPY_SOURCE']
+            del env['HTTP_X_AMZ_COPY_SOURCE']
+            env['CONTENT_LENGTH'] = '0'
+
+        if CONF.force_swift_request_proxy_log:
+            env['swift.proxy_access_log_made'] = False
+        env['swift.source'] = 'S3'
+        if method is not None:
+            env['REQUEST_METHOD'] = method
+
+        env['HTTP_X_AUTH_TOKEN'] = self.token
+
+        if obj:
+            path = '/v1/%s/%s/%s' % (self.access_key, container, obj)
+        elif container:
+            path = '/v1/%s/%s' % (self.access_key, container)
+        else:
+            path = '/v1/%s' % (self.access_key)
+        env['PATH_INFO'] = path
+
+        query_string = ''
+        if query is not None:
+            params = []
+            for key, value in sorted(query.items()):
+                if value is not None:
+                    params.append('%s=%s' % (key, quote(str(value))))
+                else:
+                    params.append(key)
+            query_string = '&'.join(params)
+        env['QUERY_STRING'] = query_string
+
+        return swob.Request.blank(quote(path), environ=env, body=body,
+                                  headers=headers)
+
+    def _swift_success_codes(self, method, container, obj):
+        code_map = {
+            'HEAD': [200, 206, 304],
+            'GET': [200, 206, 304],
+            'PUT': [201],
+            'POST': [202],
+            'DELETE': [200, 204],
+        }
+        return code_map[method]
+
+    def _swift_error_codes(self, method, container, obj):
+        code_map = {
+            'HEAD': {HTTP_NOT_FOUND: (NoSuchKey, obj)},
+            'GET': {HTTP_NOT_FOUND: (NoSuchKey, obj)},
+            'PUT': {HTTP_NOT_FOUND: (NoSuchKey, obj)},
+            'POST': {HTTP_NOT_FOUND: (NoSuchKey, obj)},
+            'DELETE': {HTTP_NOT_FOUND: (NoSuchKey, obj)},
+        }
+        return code_map[method]
+
+
+def s3_request(request_class):
+    headers = dict(HEADERS)
+    headers['Authorization'] = 'AWS test:tester:hmac'
+    headers['Date'] = datetime.utcnow().strftime(
+        '%a, %d %b %Y %H:%M:%S GMT')
+    return request_class(swob.Request.blank(
+        '/bucket/object', environ={'REQUEST_METHOD': 'PUT'},
+        headers=headers).environ)
+
+
+def bench(func, iterations):
+    timer = timeit.Timer(func)
+    return min(timer.repeat(3, iterations)) / iterations * 1e6
+
+
+def main(iterations=10000):
+    current = s3_request(S3Request)
+    legacy = s3_request(LegacyRequest)
+
+    def subrequest(req):
+        return lambda: req.to_swift_req('DELETE', 'bucket', 'object',
+                                        query={'multipart-manifest': 'delete'})
+
+    def status_codes(req):
+        def lookup():
+            # what _get_response does for a successful subrequest
+            return 204 in req._swift_success_codes('DELETE', 'bucket', 'o')
+
+        def legacy_lookup():
+            # the error codes used to be looked up before checking success
+            req._swift_error_codes('DELETE', 'bucket', 'o')
+            return lookup()
+        return legacy_lookup if isinstance(req, LegacyRequest) else lookup
+
+    print('%-14s %12s %12s' % ('', 'current', 'legacy'))
+    for name, func in (('to_swift_req', subrequest),
+                       ('status codes', status_codes)):
+        print('%-14s %10.1fus %10.1fus' % (
+            name, bench(func(current), iterations),
+            bench(func(legacy), iterations)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,131 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark of the serialization of XML responses.
+
+Run it with::
+
+    python -m swift3.test.benchmark.bench_xml [entries] [iterations]
+
+It prints the time to serialize some response documents of the given number
+of entries with etree.tostring(), as it is now and as it used to be when it
+deep-copied the tree into a new root for the S3 namespace, and once more for
+encoding-type=url (the "legacy" column).  The "copies" column is the number
+of elements the legacy implementation allocated for those copies; the
+current one allocates none.
+"""
+
+from copy import deepcopy
+import sys
+import timeit
+
+import lxml.etree
+
+from swift3.etree import Element, SubElement, XMLNS_S3, tostring, \
+    _url_encode
+from swift3.subresource import ACL, Grant, Owner, User
+
+
+def legacy_tostring(tree, encoding_type=None, use_s3ns=True):
+    if use_s3ns:
+        nsmap = tree.nsmap.copy()
+        nsmap[None] = XMLNS_S3
+
+        root = Element(tree.tag, attrib=tree.attrib, nsmap=nsmap)
+        root.text = tree.text
+        root.extend(deepcopy(tree.getchildren()))
+        tree = root
+
+    if encoding_type == 'url':
+        tree = deepcopy(tree)
+        _url_encode(tree)
+
+    return lxml.etree.tostring(tree, xml_declaration=True, encoding='UTF-8')
+
+
+def list_bucket_result(entries):
+    elem = Element('ListBucketResult')
+    SubElement(elem, 'Name').text = 'bucket'
+    SubElement(elem, 'IsTruncated').text = 'false'
+    for i in range(entries):
+        contents = SubElement(elem, 'Contents')
+        SubElement(contents, 'Key').text = 'photos/IMG_%05d.jpg' % i
+        SubElement(contents, 'LastModified').text = \
+            '2017-01-05T02:19:14.275Z'
+        SubElement(contents, 'ETag').text = \
+            '"d41d8cd98f00b204e9800998ecf8427e"'
+        SubElement(contents, 'Size').text = str(1024 * i)
+        owner = SubElement(contents, 'Owner')
+        SubElement(owner, 'ID').text = 'test:tester'
+        SubElement(owner, 'DisplayName').text = 'test:tester'
+        SubElement(contents, 'StorageClass').text = 'STANDARD'
+    return elem
+
+
+def list_parts_result(entries):
+    elem = Element('ListPartsResult')
+    SubElement(elem, 'Bucket').text = 'bucket'
+    SubElement(elem, 'Key').text = 'object'
+    SubElement(elem, 'UploadId').text = 'X'
+    for i in range(entries):
+        part = SubElement(elem, 'Part')
+        SubElement(part, 'PartNumber').text = str(i + 1)
+        SubElement(part, 'LastModified').text = '2017-01-05T02:19:14.275Z'
+        SubElement(part, 'ETag').text = '"d41d8cd98f00b204e9800998ecf8427e"'
+        SubElement(part, 'Size').text = '5242880'
+    return elem
+
+
+def delete_result(entries):
+    elem = Element('DeleteResult')
+    for i in range(entries):
+        deleted = SubElement(elem, 'Deleted')
+        SubElement(deleted, 'Key').text = 'photos/IMG_%05d.jpg' % i
+    return elem
+
+
+def access_control_policy(entries):
+    grants = [Grant(User('test:user%d' % i), 'READ')
+              for i in range(entries)]
+    return ACL(Owner('test:tester', 'test:tester'), grants).elem()
+
+
+def bench(func, iterations):
+    timer = timeit.Timer(func)
+    return min(timer.repeat(3, iterations)) / iterations * 1e3
+
+
+def main(entries=1000, iterations=20):
+    print('%-32s %10s %10s %8s' % ('', 'current', 'legacy', 'copies'))
+    for make_tree in (list_bucket_result, list_parts_result, delete_result,
+                      access_control_policy):
+        tree = make_tree(entries)
+        for encoding_type in (None, 'url'):
+            assert tostring(tree, encoding_type) == \
+                legacy_tostring(tree, encoding_type)
+            copies = sum(1 for _ in tree.iter()) - 1
+            if encoding_type:
+                copies = copies * 2 + 1
+            print('%-32s %8.2fms %8.2fms %8d' % (
+                '%s encoding=%s' % (tree.tag, encoding_type),
+                bench(lambda: tostring(tree, encoding_type), iterations),
+                bench(lambda: legacy_tostring(tree, encoding_type),
+                      iterations),
+                copies))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
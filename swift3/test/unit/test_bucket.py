@@ -13,18 +13,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from base64 import b64encode
 import unittest
 import cgi
+from mock import patch
 
 from swift.common import swob
 from swift.common.swob import Request
 from swift.common.utils import json
+from swift.proxy.controllers.base import headers_to_container_info
 
+from swift3.cfg import CONF
+from swift3.bucket_cache import LISTING_CACHE, LISTING_VERSIONS, \
+    forget_listings
+from swift3.controllers.bucket import LISTING_PREFETCH_CACHE, \
+    LISTING_PREFETCH_POOL
 from swift3.test.unit import Swift3TestCase
 from swift3.etree import Element, SubElement, fromstring, tostring
-from swift3.test.unit.test_s3_acl import s3acl
-from swift3.subresource import Owner, encode_acl, ACLPublicRead
-from swift3.request import MAX_32BIT_INT
+from swift3.test.unit.test_s3_acl import s3acl, generate_s3acl_environ
+from swift3.test.unit.test_s3_token_middleware import FakeMemcache
+from swift3.subresource import ACL, Owner, encode_acl, ACLPublicRead
+from swift3.request import MAX_32BIT_INT, CONTAINER_INFO_CACHE
 
 
 class TestSwift3Bucket(Swift3TestCase):
@@ -128,6 +137,7 @@ class TestSwift3Bucket(Swift3TestCase):
                                      'Date': self.get_date_header()})
         status, headers, body = self.call_swift3(req)
         self.assertEqual(status.split()[0], '200')
+        self.assertEqual(str(len(body)), headers['Content-Length'])
 
         elem = fromstring(body, 'ListBucketResult')
         name = elem.find('./Name').text
@@ -146,6 +156,21 @@ class TestSwift3Bucket(Swift3TestCase):
         for i in self.objects:
             self.assertTrue(i[0] in names)
 
+    def test_bucket_GET_invalid_xml_key(self):
+        self.swift.register('GET', '/v1/AUTH_test/junk', swob.HTTPOk, {},
+                            json.dumps([{
+                                'name': 'bad\x01key',
+                                'last_modified': '2011-01-05T02:19:14.275290',
+                                'hash': '0', 'bytes': 0}]))
+        req = Request.blank('/junk',
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        # the page is serialized before responding
+        status, headers, body = self.call_swift3(req)
+        self.assertEqual(status.split()[0], '500')
+        self.assertEqual(self._get_error_code(body), 'InternalError')
+
     def test_bucket_GET_subdir(self):
         bucket_name = 'junk-subdir'
         req = Request.blank('/%s' % bucket_name,
@@ -305,6 +330,416 @@ class TestSwift3Bucket(Swift3TestCase):
         self.assertEqual(elem.find('./MaxKeys').text, '1')
         self.assertEqual(elem.find('./IsTruncated').text, 'true')
 
+    def test_bucket_GET_v2(self):
+        bucket_name = 'junk'
+        req = Request.blank('/%s?list-type=2' % bucket_name,
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        self.assertEqual(status.split()[0], '200')
+        elem = fromstring(body, 'ListBucketResult')
+        self.assertEqual(elem.find('./Name').text, bucket_name)
+        self.assertEqual(elem.find('./KeyCount').text, str(len(self.objects)))
+        self.assertEqual(elem.find('./IsTruncated').text, 'false')
+        self.assertIsNone(elem.find('./Marker'))
+        self.assertIsNone(elem.find('./NextContinuationToken'))
+        contents = elem.findall('./Contents')
+        self.assertEqual(len(contents), len(self.objects))
+        for o in contents:
+            self.assertIsNone(o.find('./Owner'))
+
+        req = Request.blank('/%s?list-type=2&fetch-owner=true' % bucket_name,
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        elem = fromstring(body, 'ListBucketResult')
+        for o in elem.findall('./Contents'):
+            self.assertEqual(o.find('./Owner/ID').text, 'test:tester')
+
+    def test_bucket_GET_v2_continuation_token(self):
+        bucket_name = 'junk'
+        req = Request.blank('/%s?list-type=2&max-keys=2' % bucket_name,
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        elem = fromstring(body, 'ListBucketResult')
+        self.assertEqual(elem.find('./KeyCount').text, '2')
+        self.assertEqual(elem.find('./IsTruncated').text, 'true')
+        token = elem.find('./NextContinuationToken').text
+        self.assertEqual(token, b64encode(self.objects[1][0]))
+
+        # the token maps to the Swift marker of the next page
+        req = Request.blank(
+            '/%s?list-type=2&max-keys=2&continuation-token=%s&start-after=a'
+            % (bucket_name, token),
+            environ={'REQUEST_METHOD': 'GET'},
+            headers={'Authorization': 'AWS test:tester:hmac',
+                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        elem = fromstring(body, 'ListBucketResult')
+        self.assertEqual(elem.find('./ContinuationToken').text, token)
+        self.assertEqual(elem.find('./StartAfter').text, 'a')
+        _, path = self.swift.calls[-1]
+        _, query_string = path.split('?')
+        args = dict(cgi.parse_qsl(query_string))
+        self.assertEqual(args['marker'], self.objects[1][0])
+
+    def test_bucket_GET_v2_start_after(self):
+        bucket_name = 'junk'
+        req = Request.blank('/%s?list-type=2&start-after=b&marker=c'
+                            % bucket_name,
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        elem = fromstring(body, 'ListBucketResult')
+        self.assertEqual(elem.find('./StartAfter').text, 'b')
+        self.assertIsNone(elem.find('./ContinuationToken'))
+        _, path = self.swift.calls[-1]
+        _, query_string = path.split('?')
+        args = dict(cgi.parse_qsl(query_string))
+        self.assertEqual(args['marker'], 'b')
+
+    def test_bucket_GET_v2_subdir_continuation_token(self):
+        bucket_name = 'junk-subdir'
+        req = Request.blank('/%s?list-type=2&delimiter=a&max-keys=1'
+                            % bucket_name,
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        elem = fromstring(body, 'ListBucketResult')
+        self.assertEqual(elem.find('./NextContinuationToken').text,
+                         b64encode('rose'))
+        self.assertEqual(elem.find('./KeyCount').text, '1')
+
+    def test_bucket_GET_v2_invalid_arguments(self):
+        for query in ('list-type=3', 'list-type=2&continuation-token=abc'):
+            req = Request.blank(
+                '/junk?' + query, environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(self._get_error_code(body), 'InvalidArgument')
+
+    @s3acl(s3acl_only=True)
+    def test_bucket_GET_prefetch(self):
+        def request(query):
+            req = Request.blank(
+                '/bucket?' + query, environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+            elem = fromstring(body, 'ListBucketResult')
+            return [o.find('./Key').text
+                    for o in elem.iterchildren('Contents')]
+
+        def listing_calls(marker):
+            return [path for method, path in self.swift.calls
+                    if method == 'GET' and 'marker=%s' % marker in path]
+
+        objects = [{'name': name, 'last_modified': last_modified,
+                    'hash': str(etag), 'bytes': str(size)}
+                   for name, last_modified, etag, size in self.objects]
+        self.swift.register('GET', '/v1/AUTH_test/bucket', swob.HTTPOk, {},
+                            json.dumps(objects))
+        self.swift.register('GET', '/v1/AUTH_test/bucket?format=json&limit=3'
+                            '&marker=viola', swob.HTTPOk, {},
+                            json.dumps(objects[2:]))
+        self.swift.register('GET', '/v1/AUTH_test/bucket?format=json&limit=3'
+                            '&marker=with%20space', swob.HTTPOk, {},
+                            json.dumps([]))
+
+        LISTING_PREFETCH_CACHE.clear()
+        with patch.object(CONF, 'listing_prefetch_time', 60), \
+                patch.object(LISTING_PREFETCH_CACHE, 'maxtime', 60):
+            keys = request('max-keys=2')
+            self.assertEqual(1, len(LISTING_PREFETCH_CACHE))
+            heads = self.swift.calls.count(('HEAD', '/v1/AUTH_test/bucket'))
+            with patch('swift3.request.get_container_info',
+                       self._bucket_info('test:tester')):
+                next_keys = request('max-keys=2&marker=%s' % keys[-1])
+            # the next page was only fetched by the prefetch, and the
+            # request was authorized with the cached ACL of the bucket
+            self.assertEqual(1, len(listing_calls(keys[-1])))
+            self.assertEqual(heads, self.swift.calls.count(
+                ('HEAD', '/v1/AUTH_test/bucket')))
+            self.assertEqual([o[0] for o in self.objects[2:4]], next_keys)
+
+            # a continuation token is the same marker
+            hits = LISTING_PREFETCH_CACHE.hits
+            with patch('swift3.request.get_container_info',
+                       self._bucket_info('test:tester')):
+                request('list-type=2&max-keys=2&continuation-token=%s'
+                        % b64encode(next_keys[-1]))
+            self.assertEqual(hits + 1, LISTING_PREFETCH_CACHE.hits)
+        LISTING_PREFETCH_CACHE.clear()
+
+    @s3acl(s3acl_only=True)
+    def test_bucket_GET_prefetch_forgotten(self):
+        objects = [{'name': name, 'last_modified': last_modified,
+                    'hash': str(etag), 'bytes': str(size)}
+                   for name, last_modified, etag, size in self.objects]
+        self.swift.register('GET', '/v1/AUTH_test/bucket', swob.HTTPOk, {},
+                            json.dumps(objects))
+        LISTING_PREFETCH_CACHE.clear()
+        LISTING_VERSIONS.clear()
+        with patch.object(CONF, 'listing_prefetch_time', 60), \
+                patch.object(LISTING_PREFETCH_CACHE, 'maxtime', 60), \
+                patch('swift3.request.get_container_info',
+                      self._bucket_info('test:tester')):
+            req = Request.blank(
+                '/bucket?max-keys=2', environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+            self.assertEqual(1, len(LISTING_PREFETCH_CACHE))
+
+            # the bucket changed after the next page was prefetched
+            forget_listings({}, 'AUTH_test', 'bucket')
+            req = Request.blank(
+                '/bucket?max-keys=2&marker=viola',
+                environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            hits = LISTING_PREFETCH_CACHE.hits
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+            self.assertEqual(hits, LISTING_PREFETCH_CACHE.hits)
+            self.assertIn(('GET', '/v1/AUTH_test/bucket?format=json&limit=3'
+                           '&marker=viola'), self.swift.calls[-1:])
+        LISTING_PREFETCH_CACHE.clear()
+        LISTING_VERSIONS.clear()
+
+    @s3acl(s3acl_only=True)
+    def test_bucket_GET_prefetch_unauthorized(self):
+        objects = [{'name': name, 'last_modified': last_modified,
+                    'hash': str(etag), 'bytes': str(size)}
+                   for name, last_modified, etag, size in self.objects]
+        self.swift.register('GET', '/v1/AUTH_test/bucket', swob.HTTPOk, {},
+                            json.dumps(objects))
+        LISTING_PREFETCH_CACHE.clear()
+        with patch.object(CONF, 'listing_prefetch_time', 60), \
+                patch.object(LISTING_PREFETCH_CACHE, 'maxtime', 60):
+            req = Request.blank(
+                '/bucket?max-keys=2', environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+            self.assertEqual(1, len(LISTING_PREFETCH_CACHE))
+
+            # the bucket ACL changed meanwhile
+            req = Request.blank(
+                '/bucket?max-keys=2&marker=viola',
+                environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            with patch('swift3.request.get_container_info',
+                       self._bucket_info('test:other')):
+                status, headers, body = self.call_swift3(req)
+            self.assertEqual(self._get_error_code(body), 'AccessDenied')
+        LISTING_PREFETCH_CACHE.clear()
+
+    def test_bucket_GET_no_prefetch(self):
+        objects = [{'name': name, 'last_modified': last_modified,
+                    'hash': str(etag), 'bytes': str(size)}
+                   for name, last_modified, etag, size in self.objects]
+        self.swift.register('GET', '/v1/AUTH_test/bucket', swob.HTTPOk, {},
+                            json.dumps(objects))
+        LISTING_PREFETCH_CACHE.clear()
+        with patch.object(CONF, 'listing_prefetch_time', 60), \
+                patch.object(LISTING_PREFETCH_CACHE, 'maxtime', 60):
+            # the subrequests need the auth pipeline without s3_acl
+            req = Request.blank(
+                '/bucket?max-keys=2', environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+            self.assertEqual(0, len(LISTING_PREFETCH_CACHE))
+
+            # nor looked up
+            req = Request.blank(
+                '/bucket?max-keys=2&marker=viola',
+                environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            misses = LISTING_PREFETCH_CACHE.misses
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+            self.assertEqual(misses, LISTING_PREFETCH_CACHE.misses)
+
+            # nor while the prefetch pool is busy
+            with patch.object(CONF, 's3_acl', True), \
+                    patch.object(LISTING_PREFETCH_POOL, 'free',
+                                 return_value=0):
+                generate_s3acl_environ('test', self.swift,
+                                       Owner('test:tester', 'test:tester'))
+                self.swift.register('GET', '/v1/AUTH_test/bucket',
+                                    swob.HTTPOk, {}, json.dumps(objects))
+                req = Request.blank(
+                    '/bucket?max-keys=2', environ={'REQUEST_METHOD': 'GET'},
+                    headers={'Authorization': 'AWS test:tester:hmac',
+                             'Date': self.get_date_header()})
+                status, headers, body = self.call_swift3(req)
+                self.assertEqual(status.split()[0], '200')
+            self.assertEqual(0, len(LISTING_PREFETCH_CACHE))
+        LISTING_PREFETCH_CACHE.clear()
+
+    def _bucket_info(self, owner):
+        """
+        Returns a get_container_info returning a bucket with the owner.
+        """
+        info = headers_to_container_info(
+            encode_acl('container', ACL(Owner(owner, owner), [])), 204)
+        return lambda env, app: info
+
+    def _test_bucket_GET_listing_cache(self, environ=None):
+        def request(path, method='GET'):
+            env = dict(environ or {}, REQUEST_METHOD=method)
+            req = Request.blank(
+                path, environ=env,
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+            return body
+
+        def listing_count():
+            return len([path for method, path in self.swift.calls
+                        if method == 'GET' and
+                        path.startswith('/v1/AUTH_test/bucket?')])
+
+        self.swift.register('GET', '/v1/AUTH_test/bucket', swob.HTTPOk, {},
+                            json.dumps([]))
+        LISTING_CACHE.clear()
+        LISTING_VERSIONS.clear()
+        with patch.object(CONF, 'listing_cache_time', 60), \
+                patch.object(LISTING_CACHE, 'maxtime', 60):
+            body = request('/bucket?prefix=a')
+            self.assertEqual(body, request('/bucket?prefix=a'))
+            self.assertEqual(1, listing_count())
+            # each request was authorized with a HEAD of the bucket, or with
+            # its cached ACL with s3_acl, where only the GET of the miss
+            # checks the ACL again with a HEAD
+            self.assertEqual(1 if CONF.s3_acl else 2, self.swift.calls.count(
+                ('HEAD', '/v1/AUTH_test/bucket')))
+
+            # another query is another listing
+            request('/bucket?prefix=b')
+            self.assertEqual(2, listing_count())
+
+            # changing an object of the bucket drops its listings
+            request('/bucket/object', 'PUT')
+            request('/bucket?prefix=a')
+            self.assertEqual(3, listing_count())
+            request('/bucket?prefix=a')
+            self.assertEqual(3, listing_count())
+        LISTING_CACHE.clear()
+        LISTING_VERSIONS.clear()
+
+    @s3acl
+    def test_bucket_GET_listing_cache(self):
+        with patch('swift3.request.get_container_info',
+                   self._bucket_info('test:tester')):
+            self._test_bucket_GET_listing_cache()
+
+    @s3acl(s3acl_only=True)
+    def test_bucket_GET_listing_cache_unauthorized(self):
+        LISTING_CACHE.clear()
+        with patch.object(CONF, 'listing_cache_time', 60), \
+                patch.object(LISTING_CACHE, 'maxtime', 60), \
+                patch('swift3.request.get_container_info',
+                      self._bucket_info('test:other')):
+            req = Request.blank(
+                '/bucket', environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(self._get_error_code(body), 'AccessDenied')
+        self.assertEqual(0, len(LISTING_CACHE))
+
+    @s3acl(s3acl_only=True)
+    def test_bucket_GET_listing_cache_stale_container_info(self):
+        # the ACL this worker cached before it was changed elsewhere
+        CONTAINER_INFO_CACHE.clear()
+        CONTAINER_INFO_CACHE.set(('AUTH_test', 'bucket'),
+                                 self._bucket_info('test:tester')(None, None))
+        LISTING_CACHE.clear()
+        with patch.object(CONF, 'listing_cache_time', 60), \
+                patch.object(CONF, 'container_info_cache_time', 60), \
+                patch.object(LISTING_CACHE, 'maxtime', 60), \
+                patch.object(CONTAINER_INFO_CACHE, 'maxtime', 60), \
+                patch('swift3.request.get_container_info',
+                      self._bucket_info('test:other')):
+            req = Request.blank(
+                '/bucket', environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(self._get_error_code(body), 'AccessDenied')
+        CONTAINER_INFO_CACHE.clear()
+
+    def test_bucket_GET_listing_cache_memcache(self):
+        memcache = FakeMemcache()
+        with patch.object(CONF, 'listing_cache_backend', 'memcache'):
+            self._test_bucket_GET_listing_cache({'swift.cache': memcache})
+        self.assertEqual(0, len(LISTING_CACHE))
+        self.assertTrue(memcache.store)
+
+    def test_bucket_GET_same_xml_as_tree(self):
+        objects = [
+            {'name': name, 'last_modified': '2011-01-05T02:19:14.275290',
+             'hash': 'abc', 'bytes': 12}
+            for name in (u'a&b<c>', u'\xe9t\xe9/\U0001f600', u'a\rb',
+                         u'with space', u'with%20space')]
+        objects.append({'subdir': u'sub & dir/'})
+        self.swift.register('GET', '/v1/AUTH_test/odd', swob.HTTPOk, {},
+                            json.dumps(objects))
+
+        for query, encoding_type in (('', None),
+                                     ('?encoding-type=url', 'url'),
+                                     ('?delimiter=/&prefix=a%26', None)):
+            req = Request.blank(
+                '/odd' + query, environ={'REQUEST_METHOD': 'GET'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header()})
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+
+            # the listing as a tree, like it used to be built
+            elem = Element('ListBucketResult')
+            SubElement(elem, 'Name').text = 'odd'
+            SubElement(elem, 'Prefix').text = req.params.get('prefix')
+            SubElement(elem, 'Marker').text = None
+            SubElement(elem, 'MaxKeys').text = '1000'
+            if 'delimiter' in req.params:
+                SubElement(elem, 'Delimiter').text = '/'
+            if encoding_type:
+                SubElement(elem, 'EncodingType').text = encoding_type
+            SubElement(elem, 'IsTruncated').text = 'false'
+            for o in objects[:-1]:
+                contents = SubElement(elem, 'Contents')
+                SubElement(contents, 'Key').text = o['name']
+                SubElement(contents, 'LastModified').text = \
+                    '2011-01-05T02:19:14.275Z'
+                SubElement(contents, 'ETag').text = '"abc"'
+                SubElement(contents, 'Size').text = '12'
+                owner = SubElement(contents, 'Owner')
+                SubElement(owner, 'ID').text = 'test:tester'
+                SubElement(owner, 'DisplayName').text = 'test:tester'
+                SubElement(contents, 'StorageClass').text = 'STANDARD'
+            common_prefixes = SubElement(elem, 'CommonPrefixes')
+            SubElement(common_prefixes, 'Prefix').text = objects[-1]['subdir']
+
+            self.assertEqual(tostring(elem, encoding_type), body)
+
     @s3acl
     def test_bucket_PUT_error(self):
         code = self._test_method_error('PUT', '/bucket', swob.HTTPCreated,
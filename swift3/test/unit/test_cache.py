@@ -0,0 +1,237 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import eventlet
+import mock
+
+from swift3.cache import CircuitBreaker, FailureBackoff, LRUCache, \
+    RequestCoalescer
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LRUCache(maxsize=10)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        self.assertEqual(cache.set('a', 1), 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats(), {'size': 1, 'hits': 1,
+                                         'misses': 2, 'evictions': 0})
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # touch 'a' so that 'b' is the least recently used
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expiration(self):
+        cache = LRUCache(maxsize=10, maxtime=60)
+        with mock.patch('swift3.cache.time.time', return_value=1000.0):
+            cache.set('a', 1)
+        with mock.patch('swift3.cache.time.time', return_value=1060.0):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('swift3.cache.time.time', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = LRUCache(maxsize=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_pop_and_clear(self):
+        cache = LRUCache(maxsize=10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestRequestCoalescer(unittest.TestCase):
+    def test_concurrent_calls_are_coalesced(self):
+        coalescer = RequestCoalescer()
+        calls = []
+
+        def func(value):
+            calls.append(value)
+            eventlet.sleep(0.01)
+            return value * 2
+
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(
+            lambda v: coalescer.run('key', func, v), [1, 2, 3]))
+        self.assertEqual([2, 2, 2], results)
+        self.assertEqual([1], calls)
+        self.assertEqual(2, coalescer.coalesced)
+
+        # the key is released once the call is done
+        self.assertEqual(8, coalescer.run('key', func, 4))
+        self.assertEqual([1, 4], calls)
+
+    def test_different_keys_are_not_coalesced(self):
+        coalescer = RequestCoalescer()
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(
+            lambda v: coalescer.run(v, lambda: v), ['a', 'b']))
+        self.assertEqual(['a', 'b'], results)
+        self.assertEqual(0, coalescer.coalesced)
+
+    def test_failure_is_not_shared(self):
+        coalescer = RequestCoalescer()
+        calls = []
+
+        def func(value):
+            calls.append(value)
+            eventlet.sleep(0.01)
+            if len(calls) == 1:
+                raise ValueError(value)
+            return value
+
+        def run(value):
+            try:
+                return coalescer.run('key', func, value)
+            except ValueError:
+                return 'error'
+
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(run, [1, 2]))
+        self.assertEqual(['error', 2], results)
+        self.assertEqual([1, 2], calls)
+        self.assertEqual(0, coalescer.coalesced)
+
+    def test_failure_is_shared(self):
+        coalescer = RequestCoalescer(share_failures=True)
+        calls = []
+
+        def func(value):
+            calls.append(value)
+            eventlet.sleep(0.01)
+            raise ValueError(value)
+
+        def run(value):
+            try:
+                return coalescer.run('key', func, value)
+            except ValueError as e:
+                return e.args[0]
+
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(run, [1, 2]))
+        self.assertEqual([1, 1], results)
+        self.assertEqual([1], calls)
+        self.assertEqual(1, coalescer.coalesced)
+
+
+class TestFailureBackoff(unittest.TestCase):
+    @mock.patch('swift3.cache.time.time', return_value=1000.0)
+    def test_backoff(self, mock_time):
+        backoff = FailureBackoff(threshold=3, backoff=1, max_backoff=4)
+        backoff.failure('a')
+        backoff.failure('a')
+        self.assertEqual(0, backoff.blocked('a'))
+        backoff.failure('a')
+        self.assertEqual(1, backoff.blocked('a'))
+        backoff.failure('a')
+        self.assertEqual(2, backoff.blocked('a'))
+        backoff.failure('a')
+        backoff.failure('a')
+        self.assertEqual(4, backoff.blocked('a'))
+        self.assertEqual(0, backoff.blocked('b'))
+
+        mock_time.return_value = 1003.0
+        self.assertEqual(1, backoff.blocked('a'))
+        backoff.success('a')
+        self.assertEqual(0, backoff.blocked('a'))
+        self.assertEqual(0, len(backoff))
+
+    def test_forgotten(self):
+        backoff = FailureBackoff(threshold=2, backoff=1, max_backoff=10)
+        with mock.patch('swift3.cache.time.time', return_value=1000.0):
+            backoff.failure('a')
+        with mock.patch('swift3.cache.time.time', return_value=1011.0):
+            backoff.failure('a')
+            self.assertEqual(0, backoff.blocked('a'))
+
+    def test_disabled(self):
+        backoff = FailureBackoff(threshold=0)
+        for _ in range(10):
+            backoff.failure('a')
+        self.assertEqual(0, backoff.blocked('a'))
+        self.assertEqual(0, len(backoff))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    @mock.patch('swift3.cache.time.time', return_value=1000.0)
+    def test_transitions(self, mock_time):
+        changes = []
+        breaker = CircuitBreaker(threshold=2, reset_timeout=10,
+                                 on_change=lambda *a: changes.append(a))
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual('open', breaker.state)
+        self.assertFalse(breaker.allow())
+
+        # a single trial call per reset_timeout
+        mock_time.return_value = 1010.0
+        self.assertTrue(breaker.allow())
+        self.assertEqual('half_open', breaker.state)
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual('open', breaker.state)
+
+        mock_time.return_value = 1020.0
+        self.assertTrue(breaker.allow())
+        # the trial call never reported back
+        self.assertFalse(breaker.allow())
+        mock_time.return_value = 1030.0
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual('closed', breaker.state)
+        self.assertTrue(breaker.allow())
+
+        self.assertEqual([('closed', 'open'), ('open', 'half_open'),
+                          ('half_open', 'open'), ('open', 'half_open'),
+                          ('half_open', 'closed')], changes)
+        self.assertEqual({'open': 2, 'half_open': 2, 'closed': 1},
+                         breaker.transitions)
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(threshold=0)
+        for _ in range(10):
+            breaker.failure()
+        self.assertEqual('closed', breaker.state)
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
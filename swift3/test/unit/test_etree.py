@@ -13,8 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from copy import deepcopy
 import unittest
 
+import lxml.etree
+from mock import patch
+
 from swift3 import etree
 
 
@@ -68,6 +72,132 @@ class TestSwift3Etree(unittest.TestCase):
         self.assertEqual(text, '\xef\xbc\xa1')
         self.assertTrue(isinstance(text, str))
 
+    def test_tostring_iter(self):
+        def make_tree():
+            elem = etree.Element('Test')
+            etree.SubElement(elem, 'Owner').text = 'a&b'
+            container = etree.SubElement(elem, 'Items')
+            etree.SubElement(elem, 'Tail').text = 'z'
+            return elem, container
+
+        def make_item(name):
+            item = etree.Element('Item')
+            etree.SubElement(item, 'Key').text = name
+            return item
+
+        names = ['a b', '\xef\xbc\xa1', '<c>'] * 10
+        for encoding_type in ('url', None):
+            elem, container = make_tree()
+            for name in names:
+                container.append(make_item(name))
+            expected = etree.tostring(elem, encoding_type)
+
+            elem, container = make_tree()
+            chunks = list(etree.tostring_iter(
+                elem, container, (make_item(name) for name in names),
+                encoding_type))
+            self.assertEqual(expected, ''.join(chunks))
+            self.assertEqual(1, len(chunks))
+
+        # the children are yielded in chunks
+        elem, container = make_tree()
+        with patch.object(etree, 'XML_CHUNK_SIZE', 100):
+            chunks = list(etree.tostring_iter(
+                elem, container, (make_item(name) for name in names)))
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(expected, ''.join(chunks))
+
+        # no children
+        elem, container = make_tree()
+        self.assertEqual([etree.tostring(elem)],
+                         list(etree.tostring_iter(elem, container, [])))
+
+    def test_text_element(self):
+        for text in ('plain', 'a&b<c>d', 'a\rb\tc\nd', '"\'', '',
+                     u'\xe9t\xe9 \U0001f600', '\xc3\xa9t\xc3\xa9', None):
+            for encoding_type in (None, 'url'):
+                for tag in ('Key', 'LastModified'):
+                    elem = etree.Element('Test')
+                    etree.SubElement(elem, tag).text = text
+                    doc = etree.tostring(elem, encoding_type)
+                    self.assertIn(
+                        etree.text_element(tag, text, encoding_type), doc)
+
+        for text in ('\x00', u'\x0b', '\x1f', u'\ud800', u'\uffff'):
+            with self.assertRaises(ValueError):
+                etree.SubElement(etree.Element('Test'), 'Key').text = text
+            with self.assertRaises(ValueError):
+                etree.text_element('Key', text)
+
+    def test_tostring_iter_after_last_child(self):
+        elem = etree.Element('Test')
+        etree.SubElement(elem, 'Name').text = 'name'
+        expected_elem = etree.Element('Test')
+        etree.SubElement(expected_elem, 'Name').text = 'name'
+        children = []
+        for key in ('a', 'b<'):
+            child = etree.SubElement(expected_elem, 'Contents')
+            etree.SubElement(child, 'Key').text = key
+            children.append('<Contents>%s</Contents>' %
+                            etree.text_element('Key', key))
+
+        self.assertEqual(etree.tostring(expected_elem),
+                         ''.join(etree.tostring_iter(elem, elem, children)))
+        # the tree is left unchanged
+        self.assertIsNone(elem[-1].tail)
+
+    def test_tostring_without_copies(self):
+        def legacy_tostring(tree, encoding_type=None, use_s3ns=True):
+            if use_s3ns:
+                nsmap = tree.nsmap.copy()
+                nsmap[None] = etree.XMLNS_S3
+                root = etree.Element(tree.tag, attrib=tree.attrib,
+                                     nsmap=nsmap)
+                root.text = tree.text
+                root.extend(deepcopy(tree.getchildren()))
+                tree = root
+            if encoding_type == 'url':
+                tree = deepcopy(tree)
+                etree._url_encode(tree)
+            return lxml.etree.tostring(tree, xml_declaration=True,
+                                       encoding='UTF-8')
+
+        def make_trees():
+            elem = etree.Element('Empty')
+            yield elem
+
+            elem = etree.Element('AccessControlPolicy', attrib={'a': 'b'})
+            elem.text = 'a b'
+            owner = etree.SubElement(elem, 'Owner')
+            etree.SubElement(owner, 'ID').text = 'test:tester'
+            grant = etree.SubElement(elem, 'Grant')
+            grantee = etree.SubElement(grant, 'Grantee',
+                                       nsmap={'xsi': etree.XMLNS_XSI})
+            grantee.set('{%s}type' % etree.XMLNS_XSI, 'CanonicalUser')
+            etree.SubElement(grantee, 'ID').text = 'a&b'
+            etree.SubElement(grant, 'Key').text = '\xef\xbc\xa1 <>'
+            owner.tail = 'tail'
+            yield elem
+
+            # a tree declaring namespaces itself
+            yield etree.fromstring(
+                '<A xmlns="http://example.com/" xmlns:x="urn:x">'
+                '<B>c d</B><x:C/></A>')
+
+        for encoding_type in (None, 'url'):
+            for use_s3ns in (True, False):
+                for elem in make_trees():
+                    before = lxml.etree.tostring(elem)
+                    self.assertEqual(
+                        legacy_tostring(elem, encoding_type, use_s3ns),
+                        etree.tostring(elem, encoding_type, use_s3ns))
+                    # the tree is left unchanged
+                    self.assertEqual(before, lxml.etree.tostring(elem))
+
+        with patch('swift3.etree.deepcopy') as mock_deepcopy:
+            etree.tostring(list(make_trees())[1], 'url')
+        self.assertFalse(mock_deepcopy.called)
+
 
 if __name__ == '__main__':
     unittest.main()
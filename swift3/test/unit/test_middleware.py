@@ -39,6 +39,8 @@ from swift3.test.unit.test_s3_token_middleware import \
 from swift3.request import SigV4Request, Request as S3Request
 from swift3.etree import fromstring
 from swift3.middleware import filter_factory, Swift3Middleware
+from swift3.profiler import Profiler
+from swift3 import tracing
 from swift3.s3_token_middleware import S3Token
 from swift3.cfg import CONF
 
@@ -54,6 +56,279 @@ class TestSwift3Middleware(Swift3TestCase):
         status, headers, body = self.call_swift3(req)
         self.assertEqual(body, 'FAKE APP')
 
+    def test_non_s3_request_passthrough_skips_parsing(self):
+        self.swift.register('GET', '/v1/AUTH_test/c', swob.HTTPOk, {},
+                            'FAKE APP')
+        req = Request.blank('/v1/AUTH_test/c?prefix=%2Fa&Expires=1',
+                            headers={'X-Auth-Token': 'token'})
+        with patch.object(S3Request, '__init__',
+                          side_effect=AssertionError('parsed')), \
+                patch.object(SigV4Request, '__init__',
+                             side_effect=AssertionError('parsed')):
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual(body, 'FAKE APP')
+
+    def test_subrequest_accounting(self):
+        self.swift.register('HEAD', '/v1/AUTH_test/bucket', swob.HTTPNoContent,
+                            {}, None)
+        self.swift.register('PUT', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPCreated, {}, None)
+        req = Request.blank('/bucket/object',
+                            environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()},
+                            body='body')
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual('200', status.split()[0])
+
+        put_calls = [c for c in self.swift.calls if c[0] == 'PUT']
+        stats = dict(c[0] for c in mock_logger.update_stats.call_args_list)
+        self.assertEqual(len(self.swift.calls),
+                         stats['PUT.Object.subrequests'])
+        self.assertEqual(len(put_calls),
+                         stats['PUT.Object.subrequest.PUT.201'])
+        timing = mock_logger.timing.call_args[0]
+        self.assertEqual('PUT.Object.subrequest_time', timing[0])
+        log_info = req.environ['swift.log_info']
+        self.assertEqual(1, len(log_info))
+        self.assertTrue(log_info[0].startswith(
+            'swift3.PUT.Object:subrequests=%d:time=' % len(self.swift.calls)))
+        self.assertIn('PUT.201*%d' % len(put_calls), log_info[0])
+
+    def test_subrequest_accounting_on_error(self):
+        self.swift.register('GET', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPNotFound, {}, None)
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual('404', status.split()[0])
+        mock_logger.update_stats.assert_any_call(
+            'GET.Object.subrequest.GET.404', 1)
+        self.assertIn('GET.404*1', req.environ['swift.log_info'][0])
+
+    @patch('swift.common.constraints.ACCOUNT_LISTING_LIMIT', 1)
+    def test_subrequest_accounting_while_streaming(self):
+        for marker, name in ((None, 'apple'), ('apple', 'pear'),
+                             ('pear', None)):
+            path = '/v1/AUTH_test?format=json&limit=1'
+            if marker:
+                path += '&marker=' + marker
+            listing = [{'name': name, 'count': 0, 'bytes': 0}] \
+                if name else []
+            self.swift.register('GET', path, swob.HTTPOk, {},
+                                json.dumps(listing))
+        req = Request.blank('/',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            app_iter = self.swift3(req.environ, lambda *args: None)
+            # the next pages of the listing are fetched while the body is
+            # sent, so the subrequests are only reported after that
+            self.assertEqual(1, len(self.swift.calls))
+            self.assertNotIn('swift.log_info', req.environ)
+            ''.join(app_iter)
+        self.assertEqual(3, len(self.swift.calls))
+        mock_logger.update_stats.assert_any_call(
+            'GET.Service.subrequest.GET.200', 3)
+        self.assertIn('GET.200*3', req.environ['swift.log_info'][0])
+
+    def test_operation_metrics(self):
+        self.swift.register('GET', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPOk, {'Content-Length': '8'}, 'contents')
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual('contents', body)
+        self.assertEqual(
+            ['GET.Object.200.first-byte.timing', 'GET.Object.200.timing'],
+            [c[0][0] for c in mock_logger.timing_since.call_args_list])
+        mock_logger.increment.assert_called_once_with('GET.Object.2xx')
+        mock_logger.update_stats.assert_any_call('GET.Object.bytes_out', 8)
+
+    def test_operation_metrics_until_closed(self):
+        self.swift.register('GET', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPOk, {'Content-Length': '8'}, 'contents')
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            app_iter = self.swift3(req.environ, lambda *args: None)
+            # the client went away before the first byte was sent
+            app_iter.close()
+        self.assertEqual(
+            ['GET.Object.200.timing'],
+            [c[0][0] for c in mock_logger.timing_since.call_args_list])
+        mock_logger.increment.assert_called_once_with('GET.Object.2xx')
+
+    def test_operation_metrics_upload(self):
+        self.swift.register('PUT', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPCreated, {}, None)
+        req = Request.blank('/bucket/object',
+                            environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()},
+                            body='contents')
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            self.call_swift3(req)
+        self.assertEqual(
+            ['PUT.Object.200.timing'],
+            [c[0][0] for c in mock_logger.timing_since.call_args_list])
+        mock_logger.update_stats.assert_any_call('PUT.Object.bytes_in', 8)
+
+    def test_operation_metrics_errors(self):
+        self.swift.register('GET', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPNotFound, {}, None)
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual('404', status.split()[0])
+        self.assertEqual(
+            [mock.call('GET.Object.4xx'),
+             mock.call('GET.Object.errors.NoSuchKey')],
+            mock_logger.increment.call_args_list)
+
+        # the request is rejected before its operation is known
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac'})
+        with patch('swift3.middleware.LOGGER') as mock_logger:
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual('403', status.split()[0])
+        mock_logger.increment.assert_any_call(
+            'GET.Unknown.errors.AccessDenied')
+
+    def test_operation_metrics_names(self):
+        for path, method, operation in (
+                ('/', 'GET', 'GET.Service'),
+                ('/bucket', 'GET', 'GET.Bucket'),
+                ('/bucket?delete', 'POST', 'POST.MultiObjectDelete'),
+                ('/bucket/object?uploadId=x', 'POST', 'POST.Upload'),
+                ('/bucket/object?uploadId=x&partNumber=1', 'PUT',
+                 'PUT.Part'),
+                ('/bucket/object?acl', 'GET', 'GET.Acl')):
+            req = Request.blank(path, environ={'REQUEST_METHOD': method},
+                                headers={
+                                    'Authorization': 'AWS test:tester:hmac',
+                                    'Date': self.get_date_header()})
+            self.assertEqual(operation,
+                             S3Request(dict(req.environ)).operation_name)
+            with patch('swift3.request.S3AclRequest.authenticate'):
+                s3_req = swift3.request.S3AclRequest(req.environ, None)
+            self.assertEqual(operation, s3_req.operation_name)
+
+    def test_profiler(self):
+        self.swift.register('GET', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPOk, {}, 'contents')
+        self.swift3.profiler = Profiler({'profile_access_keys': 'test:tester'})
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        self.assertEqual('200', status.split()[0])
+        self.assertEqual(['GET.Object'], self.swift3.profiler._stats.keys())
+        self.assertFalse(self.swift3.profiler._busy)
+
+    def test_profiler_until_closed(self):
+        self.swift.register('GET', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPOk, {}, 'contents')
+        self.swift3.profiler = Profiler({'profile_access_keys': 'test:tester'})
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        app_iter = self.swift3(req.environ, lambda *args: None)
+        self.assertTrue(self.swift3.profiler._busy)
+        # the client went away before the body was sent
+        app_iter.close()
+        self.assertFalse(self.swift3.profiler._busy)
+        self.assertEqual(['GET.Object'], self.swift3.profiler._stats.keys())
+
+    def test_concurrency(self):
+        for name in ('check_bucket_owner_concurrency',
+                     'listing_prefetch_concurrency'):
+            for concurrency in (0, -1):
+                with patch.object(CONF, name, concurrency):
+                    with self.assertRaises(ValueError):
+                        Swift3Middleware(self.swift, CONF)
+
+    def test_listing_cache_backend(self):
+        with patch.object(CONF, 'listing_cache_backend', 'memcache'):
+            Swift3Middleware(self.swift, CONF)
+        with patch.object(CONF, 'listing_cache_backend', 'redis'):
+            with self.assertRaises(ValueError):
+                Swift3Middleware(self.swift, CONF)
+
+    def test_tracing(self):
+        self.swift.register('GET', '/v1/AUTH_test/bucket/object',
+                            swob.HTTPOk, {}, 'contents')
+        self.swift3.tracer = tracing.Tracer({'trace_sample_rate': '1'})
+        exporter = self.swift3.tracer.exporter = MagicMock()
+        req = Request.blank('/bucket/object',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        self.assertEqual('200', status.split()[0])
+
+        spans = exporter.export.call_args[0][0]
+        self.assertEqual(['parse', 'backend', 'controller', 'request'],
+                         [s.name for s in spans])
+        self.assertEqual({'operation': 'GET.Object', 'status': 200},
+                         spans[-1].attributes)
+        _, _, sw_headers = self.swift.calls_with_headers[-1]
+        self.assertEqual(spans[1].traceparent, sw_headers['Traceparent'])
+
+    @patch('swift.common.constraints.ACCOUNT_LISTING_LIMIT', 1)
+    def test_tracing_lazy_body(self):
+        self.swift.register('GET', '/v1/AUTH_test?format=json&limit=1',
+                            swob.HTTPOk, {}, json.dumps(
+                                [{'name': 'apple', 'count': 0, 'bytes': 0}]))
+        self.swift.register('GET', '/v1/AUTH_test?format=json&limit=1'
+                            '&marker=apple', swob.HTTPOk, {}, json.dumps([]))
+        self.swift3.tracer = tracing.Tracer({'trace_sample_rate': '1'})
+        exporter = self.swift3.tracer.exporter = MagicMock()
+        req = Request.blank('/',
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        app_iter = self.swift3(req.environ, lambda *args: None)
+        self.assertFalse(exporter.export.called)
+
+        # the next pages are fetched while the body is sent
+        ''.join(app_iter)
+        spans = exporter.export.call_args[0][0]
+        self.assertEqual('backend', spans[-2].name)
+        self.assertEqual(spans[-1].span_id, spans[-2].parent_id)
+        self.assertEqual('request', spans[-1].name)
+        self.assertEqual({'operation': 'GET.Service', 'status': 200},
+                         spans[-1].attributes)
+
+    def test_get_request_class(self):
+        def check(expected, path, headers=None):
+            env = Request.blank(path, headers=headers).environ
+            self.assertIs(expected, swift3.request.get_request_class(env))
+
+        check(None, '/bucket')
+        check(None, '/bucket?prefix=AWSAccessKeyId&Signature=x')
+        check(None, '/bucket', {'X-Auth-Token': 'token'})
+        check(S3Request, '/bucket', {'Authorization': 'AWS a:b'})
+        check(S3Request, '/bucket', {'Authorization': 'hoge'})
+        check(S3Request, '/bucket', {'Authorization': ''})
+        check(S3Request, '/bucket?AWSAccessKeyId=a&Signature=b')
+        check(S3Request, '/bucket?AWS%41ccessKeyId=a&Signature=b')
+        check(SigV4Request, '/bucket', {'Authorization': 'AWS4-HMAC-SHA256 x'})
+        check(SigV4Request, '/bucket?X-Amz-Credential=a')
+        check(SigV4Request, '/bucket?X-Amz-Credential=a',
+              {'Authorization': 'AWS a:b'})
+        with patch.object(CONF, 's3_acl', True):
+            check(swift3.request.S3AclRequest, '/bucket',
+                  {'Authorization': 'AWS a:b'})
+            check(swift3.request.SigV4S3AclRequest, '/bucket',
+                  {'Authorization': 'AWS4-HMAC-SHA256 x'})
+
     def test_bad_format_authorization(self):
         req = Request.blank('/something',
                             headers={'Authorization': 'hoge',
@@ -17,11 +17,14 @@ import unittest
 from datetime import datetime
 from hashlib import md5
 
+from mock import patch
 from six.moves import urllib
 from swift.common import swob
 from swift.common.swob import Request
 
+from swift3.bucket_cache import _listing_version_key
 from swift3.test.unit import Swift3TestCase
+from swift3.test.unit.test_s3_token_middleware import FakeMemcache
 from swift3.etree import fromstring, tostring, Element, SubElement
 from swift3.cfg import CONF
 from swift3.test.unit.test_s3_acl import s3acl
@@ -93,6 +96,36 @@ class TestSwift3MultiDelete(Swift3TestCase):
         query = dict(urllib.parse.parse_qsl(query_string))
         self.assertEqual(query['multipart-manifest'], 'delete')
 
+    def test_object_multi_DELETE_forgets_listings_once(self):
+        for key in ('Key1', 'Key2'):
+            self.swift.register('DELETE', '/v1/AUTH_test/bucket/%s' % key,
+                                swob.HTTPNoContent, {}, None)
+
+        elem = Element('Delete')
+        for key in ['Key1', 'Key2']:
+            obj = SubElement(elem, 'Object')
+            SubElement(obj, 'Key').text = key
+        body = tostring(elem, use_s3ns=False)
+        content_md5 = md5(body).digest().encode('base64').strip()
+
+        memcache = FakeMemcache()
+        req = Request.blank('/bucket?delete',
+                            environ={'REQUEST_METHOD': 'POST',
+                                     'swift.cache': memcache},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header(),
+                                     'Content-MD5': content_md5},
+                            body=body)
+        with patch.object(CONF, 'listing_cache_time', 60), \
+                patch.object(CONF, 'listing_cache_backend', 'memcache'), \
+                patch.object(memcache, 'delete') as mock_delete:
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual(status.split()[0], '200')
+        self.assertEqual(2, len(fromstring(body).findall('Deleted')))
+        # the listings of the bucket are dropped once for the operation
+        mock_delete.assert_called_once_with(
+            _listing_version_key('AUTH_test', 'bucket'))
+
     @s3acl
     def test_object_multi_DELETE_quiet(self):
         self.swift.register('DELETE', '/v1/AUTH_test/bucket/Key1',
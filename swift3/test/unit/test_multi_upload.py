@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from hashlib import sha256
 import os
 import time
 import unittest
@@ -30,7 +31,7 @@ from swift3.subresource import Owner, Grant, User, ACL, encode_acl, \
 from swift3.test.unit.test_s3_acl import s3acl
 from swift3.cfg import CONF
 from swift3.utils import sysmeta_header, mktime, S3Timestamp
-from swift3.request import MAX_32BIT_INT
+from swift3.request import MAX_32BIT_INT, CONTAINER_INFO_CACHE
 
 xml = '<CompleteMultipartUpload>' \
     '<Part>' \
@@ -972,6 +973,55 @@ class TestSwift3MultiUpload(Swift3TestCase):
         status, headers, body = self.call_swift3(req)
         self.assertEqual(status.split()[0], '200')
 
+    @patch.object(CONF, 'container_info_cache_time', 60)
+    def test_object_upload_part_container_info_cache(self):
+        def request(path, **kwargs):
+            req = Request.blank(
+                path, headers={'Authorization': 'AWS test:tester:hmac',
+                               'Date': self.get_date_header()},
+                **kwargs)
+            status, headers, body = self.call_swift3(req)
+            self.assertEqual(status.split()[0], '200')
+
+        def head_count():
+            return self.swift.calls.count(('HEAD', '/v1/AUTH_test/bucket'))
+
+        CONTAINER_INFO_CACHE.clear()
+        with patch.object(CONTAINER_INFO_CACHE, 'maxtime', 60):
+            for _ in range(2):
+                request('/bucket/object?partNumber=1&uploadId=X',
+                        environ={'REQUEST_METHOD': 'PUT'}, body='part object')
+            self.assertEqual(1, head_count())
+            self.assertIn(('test:tester', 'bucket'), CONTAINER_INFO_CACHE)
+            self.assertIn(('AUTH_test', 'bucket'), CONTAINER_INFO_CACHE)
+
+            # creating the bucket again drops the cached info
+            request('/bucket', environ={'REQUEST_METHOD': 'PUT'})
+            self.assertEqual(0, len(CONTAINER_INFO_CACHE))
+            request('/bucket/object?partNumber=1&uploadId=X',
+                    environ={'REQUEST_METHOD': 'PUT'}, body='part object')
+            self.assertEqual(2, head_count())
+        CONTAINER_INFO_CACHE.clear()
+
+    def test_object_upload_part_content_sha256(self):
+        def do_upload(content_sha256):
+            req = Request.blank(
+                '/bucket/object?partNumber=1&uploadId=X',
+                environ={'REQUEST_METHOD': 'PUT'},
+                headers={'Authorization': 'AWS test:tester:hmac',
+                         'Date': self.get_date_header(),
+                         'X-Amz-Content-SHA256': content_sha256},
+                body='part object')
+            return self.call_swift3(req)
+
+        status, headers, body = do_upload(sha256('part object').hexdigest())
+        self.assertEqual(status.split()[0], '200')
+
+        status, headers, body = do_upload(sha256('').hexdigest())
+        self.assertEqual(status.split()[0], '400')
+        self.assertEqual(self._get_error_code(body),
+                         'XAmzContentSHA256Mismatch')
+
     @s3acl
     def test_object_list_parts_error(self):
         req = Request.blank('/bucket/object?uploadId=invalid',
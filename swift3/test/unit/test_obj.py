@@ -451,6 +451,78 @@ class TestSwift3Obj(Swift3TestCase):
         # Check that swift3 converts a Content-MD5 header into an etag.
         self.assertEqual(headers['etag'], etag)
 
+    def test_object_PUT_aws_chunked(self):
+        body = ''.join([
+            '%x;chunk-signature=%s\r\n%s\r\n' % (len(chunk), 'x' * 64, chunk)
+            for chunk in (self.object_body[:5], self.object_body[5:], '')])
+        req = Request.blank(
+            '/bucket/object',
+            environ={'REQUEST_METHOD': 'PUT'},
+            headers={
+                'Authorization':
+                    'AWS4-HMAC-SHA256 '
+                    'Credential=test:tester/%s/US/s3/aws4_request, '
+                    'SignedHeaders=host;x-amz-date, '
+                    'Signature=hmac' % self.get_v4_amz_date_header()[:8],
+                'X-Amz-Date': self.get_v4_amz_date_header(),
+                'X-Amz-Content-SHA256': 'STREAMING-AWS4-HMAC-SHA256-PAYLOAD',
+                'X-Amz-Decoded-Content-Length': str(len(self.object_body)),
+                'Content-Encoding': 'aws-chunked, gzip'},
+            body=body)
+        req.content_type = 'text/plain'
+        with patch('swift3.request.LOGGER') as m_logger:
+            status, headers, body = self.call_swift3(req)
+        self.assertEqual(status.split()[0], '200', body)
+        # tempauth doesn't give the secret, so the chunks are not verified
+        m_logger.increment.assert_called_once_with(
+            'chunk_signatures.unverified')
+
+        _, _, headers = self.swift.calls_with_headers[-1]
+        self.assertEqual(headers['Content-Length'],
+                         str(len(self.object_body)))
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(self.swift.uploaded['/v1/AUTH_test/bucket/object'][1],
+                         self.object_body)
+
+    def _test_object_PUT_content_sha256(self, content_sha256):
+        req = Request.blank(
+            '/bucket/object',
+            environ={'REQUEST_METHOD': 'PUT'},
+            headers={
+                'Authorization':
+                    'AWS4-HMAC-SHA256 '
+                    'Credential=test:tester/%s/US/s3/aws4_request, '
+                    'SignedHeaders=host;x-amz-date, '
+                    'Signature=hmac' % self.get_v4_amz_date_header()[:8],
+                'X-Amz-Date': self.get_v4_amz_date_header(),
+                'X-Amz-Content-SHA256': content_sha256},
+            body=self.object_body)
+        req.content_type = 'text/plain'
+        return self.call_swift3(req)
+
+    def test_object_PUT_content_sha256(self):
+        status, headers, body = self._test_object_PUT_content_sha256(
+            hashlib.sha256(self.object_body).hexdigest())
+        self.assertEqual(status.split()[0], '200', body)
+        self.assertIn('/v1/AUTH_test/bucket/object', self.swift.uploaded)
+
+        status, headers, body = self._test_object_PUT_content_sha256(
+            hashlib.sha256(self.object_body).hexdigest().upper())
+        self.assertEqual(status.split()[0], '200', body)
+
+    def test_object_PUT_content_sha256_mismatch(self):
+        status, headers, body = self._test_object_PUT_content_sha256(
+            hashlib.sha256('').hexdigest())
+        self.assertEqual(status.split()[0], '400', body)
+        self.assertEqual(self._get_error_code(body),
+                         'XAmzContentSHA256Mismatch')
+        elem = fromstring(body, 'Error')
+        self.assertEqual(elem.find('ClientComputedContentSHA256').text,
+                         hashlib.sha256('').hexdigest())
+        self.assertEqual(elem.find('S3ComputedContentSHA256').text,
+                         hashlib.sha256(self.object_body).hexdigest())
+        self.assertNotIn('/v1/AUTH_test/bucket/object', self.swift.uploaded)
+
     def test_object_PUT_headers(self):
         content_md5 = self.etag.decode('hex').encode('base64').strip()
 
@@ -0,0 +1,125 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from swift3.profiler import Profiler, _access_key
+
+
+def work():
+    return sorted(range(100))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def test_access_key(self):
+        for env, expected in (
+                ({'HTTP_AUTHORIZATION': 'AWS test:tester:hmac'},
+                 'test:tester'),
+                ({'HTTP_AUTHORIZATION':
+                  'AWS4-HMAC-SHA256 Credential=test/20130524/US/s3/'
+                  'aws4_request, SignedHeaders=host, Signature=X'}, 'test'),
+                ({'QUERY_STRING': 'AWSAccessKeyId=test%3Atester&Expires=1'},
+                 'test:tester'),
+                ({'QUERY_STRING': 'X-Amz-Credential=test%2F20130524%2FUS'},
+                 'test'),
+                ({}, None)):
+            self.assertEqual(expected, _access_key(env))
+
+    def test_bad_config(self):
+        with self.assertRaises(ValueError):
+            Profiler({'profile_sample_rate': '2'})
+
+    def test_wants(self):
+        profiler = Profiler({})
+        self.assertFalse(profiler.enabled)
+
+        profiler = Profiler({'profile_access_keys': 'foo, test:tester'})
+        self.assertTrue(profiler.enabled)
+        self.assertTrue(profiler.wants(
+            {'HTTP_AUTHORIZATION': 'AWS test:tester:hmac'}))
+        self.assertFalse(profiler.wants(
+            {'HTTP_AUTHORIZATION': 'AWS other:hmac'}))
+
+        profiler = Profiler({'profile_sample_rate': '0.5'})
+        with mock.patch('swift3.profiler.random.random', return_value=0.4):
+            self.assertTrue(profiler.wants({}))
+            # one request at a time
+            profile = profiler.start()
+            self.assertFalse(profiler.wants({}))
+            profiler.stop(profile, 'GET.Object')
+            self.assertTrue(profiler.wants({}))
+        with mock.patch('swift3.profiler.random.random', return_value=0.5):
+            self.assertFalse(profiler.wants({}))
+
+    def test_dump(self):
+        profiler = Profiler({'profile_sample_rate': '1',
+                             'profile_dir': self.profile_dir,
+                             'profile_dump_interval': '1000',
+                             'profile_dump_count': '2'})
+        for now in (1000.0, 1400.0, 1800.0, 2200.0):
+            with mock.patch('swift3.profiler.time.time', return_value=now):
+                for operation in ('GET.Object', 'GET.Object', 'PUT.Part'):
+                    profile = profiler.start()
+                    work()
+                    profiler.stop(profile, operation)
+                profiler.dump()
+
+        self.assertEqual(['GET.Object-1800.prof', 'GET.Object-2200.prof',
+                          'PUT.Part-1800.prof', 'PUT.Part-2200.prof'],
+                         sorted(os.listdir(self.profile_dir)))
+        stats = pstats.Stats(
+            os.path.join(self.profile_dir, 'GET.Object-2200.prof'))
+        calls = [count for (_, _, name), (count, _, _, _, _)
+                 in stats.stats.items() if name == 'work']
+        self.assertEqual([2], calls)
+
+    def test_dump_on_schedule(self):
+        profiler = Profiler({'profile_sample_rate': '1',
+                             'profile_dir': self.profile_dir,
+                             'profile_dump_interval': '300'})
+        profiler._next_dump = 1300.0
+        with mock.patch('swift3.profiler.time.time', return_value=1299.0):
+            profiler.stop(profiler.start(), 'GET.Object')
+        self.assertEqual([], os.listdir(self.profile_dir))
+        with mock.patch('swift3.profiler.time.time', return_value=1300.0):
+            profiler.stop(profiler.start(), 'GET.Object')
+        self.assertEqual(['GET.Object-1300.prof'],
+                         os.listdir(self.profile_dir))
+
+    def test_dump_error(self):
+        profiler = Profiler({'profile_sample_rate': '1',
+                             'profile_dir': os.path.join(self.profile_dir,
+                                                         'file')})
+        open(profiler.profile_dir, 'w').close()
+        profiler.stop(profiler.start(), 'GET.Object')
+        with mock.patch('swift3.profiler.LOGGER') as mock_logger:
+            profiler.dump()
+        self.assertTrue(mock_logger.warning.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,9 +20,11 @@ import time
 import unittest
 import uuid
 
+import eventlet
 import fixtures
 import mock
 import requests
+from requests.packages.urllib3.exceptions import PoolError
 from requests_mock.contrib import fixture as rm_fixture
 from six.moves import urllib
 
@@ -42,6 +44,7 @@ GOOD_RESPONSE_V2 = {'access': {
     },
     'token': {
         'id': 'TOKEN_ID',
+        'expires': '2099-01-01T00:00:00Z',
         'tenant': {
             'id': 'TENANT_ID',
             'name': 'TENANT_NAME'
@@ -69,6 +72,7 @@ GOOD_RESPONSE_V3 = {'token': {
         {'name': 'swift-user'},
         {'name': '_member_'},
     ],
+    'expires_at': '2099-01-01T00:00:00.000000Z',
 }}
 
 
@@ -306,7 +310,7 @@ class S3TokenMiddlewareTestGood(S3TokenMiddlewareTestBase):
         req.get_response(self.middleware)
         self._assert_authorized(req, account_path='/v1/AUTH_FORCED_TENANT_ID/')
 
-    @mock.patch.object(requests, 'post')
+    @mock.patch.object(requests.Session, 'post')
     def test_insecure(self, MOCK_REQUEST):
         self.middleware = s3_token.filter_factory(
             {'insecure': 'True', 'auth_uri': 'http://example.com'})(self.app)
@@ -377,7 +381,7 @@ class S3TokenMiddlewareTestGood(S3TokenMiddlewareTestBase):
         self.assertEqual('Either auth_uri or auth_host required',
                          cm.exception.message)
 
-    @mock.patch.object(requests, 'post')
+    @mock.patch.object(requests.Session, 'post')
     def test_http_timeout(self, MOCK_REQUEST):
         self.middleware = s3_token.filter_factory({
             'http_timeout': '2',
@@ -427,6 +431,89 @@ class S3TokenMiddlewareTestGood(S3TokenMiddlewareTestBase):
             'auth_uri': 'http://example.com'})(FakeApp())
         self.assertEqual(10, middleware._timeout)
 
+    def test_http_pool_options(self):
+        middleware = s3_token.filter_factory({
+            'auth_uri': 'http://example.com'})(FakeApp())
+        self.assertEqual(10, middleware._adapter._pool_maxsize)
+        self.assertFalse(middleware._adapter._pool_block)
+        self.assertEqual(10, middleware._adapter.pool_timeout)
+
+        middleware = s3_token.filter_factory({
+            'auth_uri': 'http://example.com', 'http_timeout': '2',
+            'http_pool_size': '3', 'http_pool_block': 'true'})(FakeApp())
+        self.assertEqual(3, middleware._adapter._pool_maxsize)
+        self.assertTrue(middleware._adapter._pool_block)
+        self.assertEqual(2, middleware._adapter.pool_timeout)
+
+        for val in ('0', '-1', 'foo'):
+            with self.assertRaises(ValueError):
+                s3_token.filter_factory({
+                    'auth_uri': 'http://example.com',
+                    'http_pool_size': val})(FakeApp())
+
+    def test_session_is_reused(self):
+        req = Request.blank('/v1/AUTH_cfa/c/o')
+        req.environ['swift3.auth_details'] = {
+            'access_key': u'access',
+            'signature': u'signature',
+            'string_to_sign': u'token',
+        }
+        with mock.patch.object(requests, 'post') as mock_post:
+            req.get_response(self.middleware)
+            req.get_response(self.middleware)
+        self.assertFalse(mock_post.called)
+        self.assertEqual(2, self.requests_mock.call_count)
+        self.assertEqual(2, self.middleware._app.calls)
+
+    def test_pool_stats(self):
+        middleware = s3_token.filter_factory({
+            'auth_uri': 'https://example.com', 'http_timeout': '0.01',
+            'http_pool_size': '2', 'http_pool_block': 'true'})(FakeApp())
+        self.assertEqual({'in_use': 0, 'idle': 0, 'created': 0,
+                          'wait_time': 0.0}, middleware.pool_stats())
+
+        pool = middleware._adapter.poolmanager.connection_from_url(
+            'https://example.com')
+        conns = [pool._get_conn(), pool._get_conn()]
+        stats = middleware.pool_stats()
+        self.assertEqual(2, stats['in_use'])
+        self.assertEqual(0, stats['idle'])
+        self.assertEqual(2, stats['created'])
+
+        # the pool is exhausted, so the next caller times out
+        with mock.patch('swift3.s3_token_middleware.time.time',
+                        side_effect=[1234, 1234.01]):
+            with self.assertRaises(PoolError):
+                pool._get_conn()
+        self.assertAlmostEqual(0.01, middleware.pool_stats()['wait_time'])
+
+        for conn in conns:
+            pool._put_conn(conn)
+        stats = middleware.pool_stats()
+        self.assertEqual(0, stats['in_use'])
+        self.assertEqual(2, stats['idle'])
+        self.assertEqual(2, stats['created'])
+
+        # idle connections are reused
+        pool._put_conn(pool._get_conn())
+        self.assertEqual(2, middleware.pool_stats()['created'])
+
+    def test_pool_exhausted(self):
+        with mock.patch.object(requests.Session, 'post',
+                               side_effect=PoolError(None, 'exhausted')):
+            req = Request.blank('/v1/AUTH_cfa/c/o')
+            req.environ['swift3.auth_details'] = {
+                'access_key': u'access',
+                'signature': u'signature',
+                'string_to_sign': u'token',
+            }
+            resp = req.get_response(self.middleware)
+        s3_unavailable_resp = self.middleware._deny_request(
+            'ServiceUnavailable')
+        self.assertEqual(resp.body, s3_unavailable_resp.body)
+        self.assertEqual(resp.status_int, s3_unavailable_resp.status_int)
+        self.assertEqual(0, self.middleware._app.calls)
+
     def test_unicode_path(self):
         url = u'/v1/AUTH_cfa/c/euro\u20ac'.encode('utf8')
         req = Request.blank(urllib.parse.quote(url))
@@ -624,6 +711,714 @@ class S3TokenMiddlewareTestDeferredAuth(S3TokenMiddlewareTestBase):
         self.assertEqual(1, self.middleware._app.calls)
 
 
+class FakeMemcache(object):
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, serialize=True, time=0):
+        if serialize:
+            value = json.loads(json.dumps(value))
+        self.store[key] = value
+        return True
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+
+class S3TokenMiddlewareTestTokenCache(S3TokenMiddlewareTestBase):
+    def setUp(self):
+        super(S3TokenMiddlewareTestTokenCache, self).setUp()
+        self.conf['token_cache_time'] = '60'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.requests_mock.post(self.TEST_URL,
+                                status_code=201,
+                                json=GOOD_RESPONSE_V2)
+
+    def _make_request(self, signature=u'signature', environ=None):
+        req = Request.blank('/v1/AUTH_cfa/c/o', environ=environ)
+        req.environ['swift3.auth_details'] = {
+            'access_key': u'access',
+            'signature': signature,
+            'string_to_sign': u'token',
+        }
+        req.get_response(self.middleware)
+        return req
+
+    def _assert_authorized(self, req):
+        self.assertTrue(req.path.startswith('/v1/AUTH_TENANT_ID/'))
+        self.assertEqual('TOKEN_ID', req.headers['X-Auth-Token'])
+        self.assertEqual('USER_ID', req.headers['X-User-Id'])
+        self.assertEqual('swift-user,_member_', req.headers['X-Roles'])
+        self.assertIsInstance(req.headers['X-Roles'], str)
+        self.assertEqual(GOOD_RESPONSE_V2,
+                         req.environ['keystone.token_info'])
+
+    def test_bad_config(self):
+        for conf in ({'token_cache_time': '-1'},
+                     {'token_cache_backend': 'disk'}):
+            conf['auth_uri'] = self.TEST_AUTH_URI
+            with self.assertRaises(ValueError):
+                s3_token.S3Token(FakeApp(), conf)
+
+    def test_cache_disabled_by_default(self):
+        del self.conf['token_cache_time']
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self._make_request()
+        self._make_request()
+        self.assertEqual(2, self.requests_mock.call_count)
+
+    def test_local_cache(self):
+        self._assert_authorized(self._make_request())
+        self._assert_authorized(self._make_request())
+        self.assertEqual(1, self.requests_mock.call_count)
+        self.assertEqual(2, self.middleware._app.calls)
+        self.assertEqual(1, self.middleware._token_cache.hits)
+
+        # a different signature is never served from the cache
+        self._assert_authorized(self._make_request(signature=u'other'))
+        self.assertEqual(2, self.requests_mock.call_count)
+
+    def test_local_cache_expires(self):
+        self._make_request()
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 61):
+            self._make_request()
+        self.assertEqual(2, self.requests_mock.call_count)
+
+    def _respond_with_expiry(self, expires):
+        response = copy.deepcopy(GOOD_RESPONSE_V2)
+        if expires is None:
+            del response['access']['token']['expires']
+        else:
+            response['access']['token']['expires'] = expires
+        self.requests_mock.post(self.TEST_URL, status_code=201,
+                                json=response)
+
+    def test_cache_capped_at_token_expiry(self):
+        # the token expires in 30 seconds, before token_cache_time
+        self._respond_with_expiry(time.strftime(
+            '%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 30)))
+        memcache = FakeMemcache()
+        with mock.patch.object(memcache, 'set',
+                               wraps=memcache.set) as mock_set:
+            self.conf['token_cache_backend'] = 'memcache'
+            self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+            self._make_request(environ={'swift.cache': memcache})
+        self.assertTrue(0 < mock_set.call_args[1]['time'] <= 30)
+
+        self.conf['token_cache_backend'] = 'local'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self._make_request()
+        self._make_request()
+        self.assertEqual(2, self.requests_mock.call_count)
+        # the token has expired by then
+        now = time.time() + 31
+        with mock.patch('swift3.s3_token_middleware.time.time',
+                        return_value=now):
+            self._make_request()
+        self.assertEqual(3, self.requests_mock.call_count)
+
+    def test_no_cache_without_token_expiry(self):
+        for expires in (None, 'tomorrow', '1970-01-01T00:00:00Z'):
+            self._respond_with_expiry(expires)
+            self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+            req = self._make_request()
+            self.assertEqual('TOKEN_ID', req.headers['X-Auth-Token'])
+            self.assertEqual(0, len(self.middleware._token_cache))
+
+    def test_token_expiry(self):
+        for expires, expected in (
+                ('2017-04-20T12:00:00Z', 1492689600),
+                ('2017-04-20T12:00:00.123456Z', 1492689600),
+                ('2017-04-20T14:00:00+02:00', 1492689600),
+                ('2017-04-20T07:00:00-0500', 1492689600),
+                ('2017-04-20', None),
+                (None, None)):
+            self.assertEqual(expected, s3_token.token_expiry(
+                {'token': {'expires_at': expires}}))
+        self.assertEqual(1492689600, s3_token.token_expiry(
+            {'access': {'token': {'expires': '2017-04-20T12:00:00Z'}}}))
+        self.assertIsNone(s3_token.token_expiry({'token': {}}))
+
+    def test_failure_is_not_cached(self):
+        self.requests_mock.post(self.TEST_URL, status_code=403)
+        self._make_request()
+        self._make_request()
+        self.assertEqual(2, self.requests_mock.call_count)
+        self.assertEqual(0, self.middleware._app.calls)
+        self.assertEqual(0, len(self.middleware._token_cache))
+
+    def test_memcache_cache(self):
+        self.conf['token_cache_backend'] = 'memcache'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        memcache = FakeMemcache()
+
+        self._assert_authorized(
+            self._make_request(environ={'swift.cache': memcache}))
+        self.assertEqual(1, len(memcache.store))
+        # another worker shares the result through memcache
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self._assert_authorized(
+            self._make_request(environ={'swift.cache': memcache}))
+        self.assertEqual(1, self.requests_mock.call_count)
+        self.assertEqual(0, len(self.middleware._token_cache))
+
+        # without memcache in the pipeline every request goes to Keystone
+        self._assert_authorized(self._make_request())
+        self.assertEqual(2, self.requests_mock.call_count)
+
+    def test_concurrent_requests_share_keystone_call(self):
+        calls = []
+        real_json_request = self.middleware._json_request
+
+        def slow_json_request(creds_json):
+            calls.append(creds_json)
+            eventlet.sleep(0.01)
+            return real_json_request(creds_json)
+
+        with mock.patch.object(self.middleware, '_json_request',
+                               slow_json_request):
+            pool = eventlet.GreenPool()
+            reqs = list(pool.imap(lambda _: self._make_request(), range(3)))
+        for req in reqs:
+            self._assert_authorized(req)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(2, self.middleware._coalescer.coalesced)
+
+    def test_concurrent_requests_share_keystone_failure(self):
+        self.requests_mock.post(self.TEST_URL, status_code=503)
+        real_json_request = self.middleware._json_request
+
+        def slow_json_request(creds_json):
+            eventlet.sleep(0.01)
+            return real_json_request(creds_json)
+
+        def request(_):
+            req = Request.blank('/v1/AUTH_cfa/c/o')
+            req.environ['swift3.auth_details'] = {
+                'access_key': u'access',
+                'signature': u'signature',
+                'string_to_sign': u'token',
+            }
+            return req.get_response(self.middleware)
+
+        with mock.patch.object(self.middleware, '_json_request',
+                               slow_json_request):
+            pool = eventlet.GreenPool()
+            resps = list(pool.imap(request, range(3)))
+        self.assertEqual([503] * 3, [resp.status_int for resp in resps])
+        for resp in resps:
+            self.assertIn('The authentication service is unavailable',
+                          resp.body)
+        # the waiting requests didn't call Keystone in turn
+        self.assertEqual(1, self.requests_mock.call_count)
+        self.assertEqual(1, self.middleware._breaker.failures)
+
+
+class S3TokenMiddlewareTestSecretCache(S3TokenMiddlewareTestBase):
+    def setUp(self):
+        super(S3TokenMiddlewareTestSecretCache, self).setUp()
+        self.conf.update({
+            'secret_cache_duration': '60',
+            'username': 'swift',
+            'password': 'password',
+            'project_name': 'service',
+        })
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.requests_mock.post(self.TEST_URL,
+                                status_code=201,
+                                json=GOOD_RESPONSE_V2)
+        self.token_mock = self.requests_mock.post(
+            '%s/v3/auth/tokens' % self.TEST_AUTH_URI,
+            status_code=201, headers={'X-Subject-Token': 'SERVICE_TOKEN'},
+            json={'token': {}})
+        self.secret_url = ('%s/v3/users/USER_ID/credentials/OS-EC2/access' %
+                           self.TEST_AUTH_URI)
+        self.secret_mock = self.requests_mock.get(
+            self.secret_url, json={'credential': {
+                'access': 'access', 'user_id': 'USER_ID',
+                'secret': 'secret'}})
+        self.check_signature = mock.MagicMock(
+            side_effect=lambda secret: secret == 'secret')
+
+    def _make_request(self, environ=None):
+        req = Request.blank('/v1/AUTH_cfa/c/o', environ=environ)
+        req.environ['swift3.auth_details'] = {
+            'access_key': u'access',
+            'signature': u'signature',
+            'string_to_sign': u'token',
+            'check_signature': self.check_signature,
+        }
+        resp = req.get_response(self.middleware)
+        return req, resp
+
+    def _keystone_calls(self, path):
+        return [r for r in self.requests_mock.request_history
+                if r.path.endswith(path)]
+
+    def _assert_authorized(self, req):
+        self.assertTrue(req.path.startswith('/v1/AUTH_TENANT_ID/'))
+        self.assertEqual('TOKEN_ID', req.headers['X-Auth-Token'])
+        self.assertEqual('USER_ID', req.headers['X-User-Id'])
+        self.assertEqual(GOOD_RESPONSE_V2,
+                         req.environ['keystone.token_info'])
+
+    def test_bad_config(self):
+        conf = {'auth_uri': self.TEST_AUTH_URI,
+                'secret_cache_duration': '60'}
+        with self.assertRaises(ConfigFileError):
+            s3_token.S3Token(FakeApp(), conf)
+        conf = {'auth_uri': self.TEST_AUTH_URI,
+                'secret_cache_duration': '-1'}
+        with self.assertRaises(ValueError):
+            s3_token.S3Token(FakeApp(), conf)
+        conf = dict(self.conf, secret_failure_cache_duration='-1')
+        with self.assertRaises(ValueError):
+            s3_token.S3Token(FakeApp(), conf)
+
+    def test_verified_locally(self):
+        req, resp = self._make_request()
+        self._assert_authorized(req)
+        self.assertFalse(self.check_signature.called)
+        self.assertEqual(1, len(self._keystone_calls('/s3tokens')))
+        self.assertEqual('SERVICE_TOKEN',
+                         self.secret_mock.last_request.headers['X-Auth-Token'])
+        token_request = self.token_mock.last_request.json()
+        self.assertEqual(['password'],
+                         token_request['auth']['identity']['methods'])
+        self.assertEqual('service',
+                         token_request['auth']['scope']['project']['name'])
+
+        for _ in range(2):
+            req, resp = self._make_request()
+            self._assert_authorized(req)
+        self.assertEqual(1, len(self._keystone_calls('/s3tokens')))
+        self.assertEqual(1, self.token_mock.call_count)
+        self.assertEqual(1, self.secret_mock.call_count)
+        self.assertEqual([mock.call('secret')] * 2,
+                         self.check_signature.call_args_list)
+        self.assertEqual(3, self.middleware._app.calls)
+
+    def test_signature_mismatch(self):
+        self._make_request()
+        self.assertEqual(1, len(self.middleware._secret_cache))
+
+        # the signature is simply wrong, which doesn't evict the secret
+        self.requests_mock.post(self.TEST_URL, status_code=403)
+        self.check_signature.side_effect = lambda secret: False
+        req, resp = self._make_request()
+        self.assertEqual(401, resp.status_int)
+        self.assertEqual(2, len(self._keystone_calls('/s3tokens')))
+        self.assertEqual('secret', self.middleware._secret_cache.get(
+            self.middleware._secret_cache_key('access'))['secret'])
+        self.assertEqual(1, self.middleware._app.calls)
+
+        # the secret was rotated
+        self.requests_mock.post(self.TEST_URL, status_code=201,
+                                json=GOOD_RESPONSE_V2)
+        self.secret_mock = self.requests_mock.get(
+            self.secret_url, json={'credential': {'secret': 'new-secret'}})
+        self.check_signature.side_effect = \
+            lambda secret: secret == 'new-secret'
+        req, resp = self._make_request()
+        self._assert_authorized(req)
+        self.assertEqual(3, len(self._keystone_calls('/s3tokens')))
+        self.assertEqual('new-secret', self.middleware._secret_cache.get(
+            self.middleware._secret_cache_key('access'))['secret'])
+        self.assertEqual(2, self.middleware._app.calls)
+
+    def test_cache_expires(self):
+        self._make_request()
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 61):
+            self._make_request()
+        self.assertEqual(2, len(self._keystone_calls('/s3tokens')))
+        self.assertEqual(2, self.secret_mock.call_count)
+
+    def test_cache_capped_at_token_expiry(self):
+        response = copy.deepcopy(GOOD_RESPONSE_V2)
+        response['access']['token']['expires'] = '1970-01-01T00:21:04Z'
+        self.requests_mock.post(self.TEST_URL, status_code=201,
+                                json=response)
+        self._make_request()
+        self._make_request()
+        self.assertEqual(1, len(self._keystone_calls('/s3tokens')))
+        # the cached validation holds the token, which has expired by then
+        with mock.patch('swift3.s3_token_middleware.time.time',
+                        return_value=1234 + 31):
+            self._make_request()
+        self.assertEqual(2, len(self._keystone_calls('/s3tokens')))
+
+    def test_expired_service_token(self):
+        self._make_request()
+        self.middleware._secret_cache.clear()
+        self.requests_mock.get(self.secret_url, [
+            {'status_code': 401},
+            {'json': {'credential': {'secret': 'secret'}}}])
+        self._make_request()
+        self.assertEqual(2, self.token_mock.call_count)
+        self.assertEqual(1, len(self.middleware._secret_cache))
+
+    def test_secret_unavailable(self):
+        self.secret_mock = self.requests_mock.get(self.secret_url,
+                                                  status_code=403)
+        for _ in range(2):
+            req, resp = self._make_request()
+            self._assert_authorized(req)
+        self.assertEqual(2, len(self._keystone_calls('/s3tokens')))
+        self.assertEqual(0, len(self.middleware._secret_cache))
+        # the failure is remembered for a while
+        self.assertEqual(1, self.secret_mock.call_count)
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 11):
+            self._make_request()
+        self.assertEqual(2, self.secret_mock.call_count)
+        # Keystone answered, so its breaker doesn't count that
+        self.assertEqual(0, self.middleware._breaker.failures)
+
+    def test_secret_fetch_uses_breaker(self):
+        self.conf['breaker_threshold'] = '1'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.secret_mock = self.requests_mock.get(self.secret_url,
+                                                  status_code=503)
+        req, resp = self._make_request()
+        self._assert_authorized(req)
+        self.assertEqual(1, self.secret_mock.call_count)
+        self.assertEqual('open', self.middleware.breaker_stats()['state'])
+
+        # Keystone isn't asked while the breaker is open
+        self.middleware._secret_failures.clear()
+        self.assertIsNone(self.middleware._fetch_secret('USER_ID', 'access'))
+        self.assertEqual(1, self.secret_mock.call_count)
+
+    def test_no_check_signature(self):
+        for _ in range(2):
+            req = Request.blank('/v1/AUTH_cfa/c/o')
+            req.environ['swift3.auth_details'] = {
+                'access_key': u'access',
+                'signature': u'signature',
+                'string_to_sign': u'token',
+            }
+            req.get_response(self.middleware)
+            self._assert_authorized(req)
+        self.assertEqual(2, len(self._keystone_calls('/s3tokens')))
+        self.assertFalse(self.secret_mock.called)
+
+    def test_not_in_memcache(self):
+        self.conf['token_cache_backend'] = 'memcache'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        memcache = FakeMemcache()
+        self._make_request(environ={'swift.cache': memcache})
+        self.assertEqual(0, len(memcache.store))
+        self.assertEqual(1, len(self.middleware._secret_cache))
+
+        req, resp = self._make_request(environ={'swift.cache': memcache})
+        self._assert_authorized(req)
+        self.assertEqual(1, len(self._keystone_calls('/s3tokens')))
+
+
+class S3TokenMiddlewareTestAuthFailureBackoff(S3TokenMiddlewareTestBase):
+    def setUp(self):
+        super(S3TokenMiddlewareTestAuthFailureBackoff, self).setUp()
+        self.conf.update({
+            'auth_failure_threshold': '2',
+            'auth_failure_backoff': '10',
+            'auth_failure_max_backoff': '30',
+        })
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.requests_mock.post(self.TEST_URL, status_code=401)
+
+    def _make_request(self, access=u'access', remote_addr='192.0.2.1'):
+        req = Request.blank('/v1/AUTH_cfa/c/o',
+                            environ={'REMOTE_ADDR': remote_addr})
+        req.environ['swift3.auth_details'] = {
+            'access_key': access,
+            'signature': u'signature',
+            'string_to_sign': u'token',
+        }
+        return req.get_response(self.middleware)
+
+    def test_bad_config(self):
+        for conf in ({'auth_failure_backoff': '0'},
+                     {'auth_failure_backoff': '10',
+                      'auth_failure_max_backoff': '5'}):
+            conf['auth_uri'] = self.TEST_AUTH_URI
+            with self.assertRaises(ValueError):
+                s3_token.S3Token(FakeApp(), conf)
+
+    def test_disabled_by_default(self):
+        for key in ('auth_failure_threshold', 'auth_failure_backoff',
+                    'auth_failure_max_backoff'):
+            del self.conf[key]
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        for _ in range(5):
+            self.assertEqual(401, self._make_request().status_int)
+        self.assertEqual(5, self.requests_mock.call_count)
+        self.assertEqual(0, len(self.middleware._key_failures))
+
+    def test_access_key_backoff(self):
+        for _ in range(4):
+            self.assertEqual(401, self._make_request().status_int)
+        # the third and fourth requests never reach Keystone
+        self.assertEqual(2, self.requests_mock.call_count)
+        self.assertEqual({'rejected_access_key': 2, 'rejected_source': 0,
+                          'access_keys': 1, 'sources': 0},
+                         self.middleware.auth_failure_stats())
+
+        # other access keys are not affected
+        self._make_request(access=u'other')
+        self.assertEqual(3, self.requests_mock.call_count)
+        # nor are the other clients of the access key
+        self._make_request(remote_addr='192.0.2.2')
+        self.assertEqual(4, self.requests_mock.call_count)
+        self.requests_mock.post(self.TEST_URL, status_code=401)
+
+        # the key is let through once the backoff is over, and then backed
+        # off for twice as long
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 11):
+            self._make_request()
+            self.assertEqual(5, self.requests_mock.call_count)
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 21):
+            self._make_request()
+            self.assertEqual(5, self.requests_mock.call_count)
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 32):
+            self._make_request()
+            self.assertEqual(6, self.requests_mock.call_count)
+
+    def test_success_resets_access_key(self):
+        self._make_request()
+        self.requests_mock.post(self.TEST_URL, status_code=201,
+                                json=GOOD_RESPONSE_V2)
+        self.assertEqual(200, self._make_request().status_int)
+        self.assertEqual(0, len(self.middleware._key_failures))
+
+        self.requests_mock.post(self.TEST_URL, status_code=401)
+        self._make_request()
+        self._make_request()
+        self.assertEqual(4, self.requests_mock.call_count)
+
+    def test_keystone_errors_are_not_failures(self):
+        self.requests_mock.post(self.TEST_URL,
+                                exc=requests.exceptions.ConnectTimeout)
+        for _ in range(3):
+            self.assertEqual(503, self._make_request().status_int)
+        self.assertEqual(3, self.requests_mock.call_count)
+        self.assertEqual(0, len(self.middleware._key_failures))
+
+        self.requests_mock.post(self.TEST_URL, status_code=500)
+        for _ in range(3):
+            resp = self._make_request()
+            self.assertEqual(503, resp.status_int)
+            self.assertIn('<Code>ServiceUnavailable</Code>', resp.body)
+        self.assertEqual(6, self.requests_mock.call_count)
+        self.assertEqual(0, len(self.middleware._key_failures))
+
+    def test_other_client_errors_are_not_failures(self):
+        self.requests_mock.post(self.TEST_URL, status_code=403)
+        for _ in range(3):
+            self.assertEqual(401, self._make_request().status_int)
+        self.assertEqual(3, self.requests_mock.call_count)
+        self.assertEqual(0, len(self.middleware._key_failures))
+
+    def test_source_backoff(self):
+        self.conf['auth_failure_threshold'] = '0'
+        self.conf['auth_failure_source_threshold'] = '2'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        for i in range(3):
+            self._make_request(access=u'access%d' % i)
+        self.assertEqual(2, self.requests_mock.call_count)
+        self._make_request(remote_addr='192.0.2.2')
+        self.assertEqual(3, self.requests_mock.call_count)
+        self.assertEqual(1, self.middleware.auth_failure_stats()[
+            'rejected_source'])
+
+    def test_deferred_rejection(self):
+        self.conf['delay_auth_decision'] = 'true'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        for _ in range(3):
+            self.assertEqual(200, self._make_request().status_int)
+        self.assertEqual(2, self.requests_mock.call_count)
+        self.assertEqual(3, self.middleware._app.calls)
+
+    def test_cached_secret_is_not_blocked(self):
+        self.conf.update({
+            'secret_cache_duration': '60',
+            'username': 'swift',
+            'password': 'password',
+            'project_name': 'service',
+        })
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.middleware._secret_cache.set(
+            self.middleware._secret_cache_key('access'), {
+                'headers': {'X-User-Id': 'USER_ID'},
+                'token_id': 'TOKEN_ID', 'tenant': {'id': 'TENANT_ID'},
+                'token': {}, 'secret': 'secret',
+                'expires': time.time() + 3600})
+        self.middleware._key_failures.failure((u'access', '192.0.2.1'))
+        self.middleware._key_failures.failure((u'access', '192.0.2.1'))
+
+        req = Request.blank('/v1/AUTH_cfa/c/o',
+                            environ={'REMOTE_ADDR': '192.0.2.1'})
+        req.environ['swift3.auth_details'] = {
+            'access_key': u'access',
+            'signature': u'signature',
+            'string_to_sign': u'token',
+            'check_signature': lambda secret: secret == 'secret',
+        }
+        self.assertEqual(200, req.get_response(self.middleware).status_int)
+        self.assertEqual(0, self.requests_mock.call_count)
+
+
+class S3TokenMiddlewareTestCircuitBreaker(S3TokenMiddlewareTestBase):
+    def setUp(self):
+        super(S3TokenMiddlewareTestCircuitBreaker, self).setUp()
+        self.conf.update({
+            'breaker_threshold': '2',
+            'breaker_reset_timeout': '10',
+        })
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.requests_mock.post(self.TEST_URL,
+                                exc=requests.exceptions.ConnectTimeout)
+
+    def _make_request(self, check_signature=None):
+        req = Request.blank('/v1/AUTH_cfa/c/o')
+        req.environ['swift3.auth_details'] = {
+            'access_key': u'access',
+            'signature': u'signature',
+            'string_to_sign': u'token',
+        }
+        if check_signature:
+            req.environ['swift3.auth_details']['check_signature'] = \
+                check_signature
+        return req, req.get_response(self.middleware)
+
+    def _s3token_calls(self):
+        return len([r for r in self.requests_mock.request_history
+                    if r.path.endswith('/s3tokens')])
+
+    def test_bad_config(self):
+        conf = {'auth_uri': self.TEST_AUTH_URI,
+                'stale_secret_duration': '-1'}
+        with self.assertRaises(ValueError):
+            s3_token.S3Token(FakeApp(), conf)
+
+    def test_disabled_by_default(self):
+        del self.conf['breaker_threshold']
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        for _ in range(5):
+            self.assertEqual(503, self._make_request()[1].status_int)
+        self.assertEqual(5, self._s3token_calls())
+        self.assertEqual('closed', self.middleware.breaker_stats()['state'])
+
+    def test_fail_fast_while_open(self):
+        for _ in range(2):
+            self.assertEqual(503, self._make_request()[1].status_int)
+        self.assertEqual('open', self.middleware.breaker_stats()['state'])
+
+        req, resp = self._make_request()
+        self.assertEqual(503, resp.status_int)
+        self.assertIn('<Code>ServiceUnavailable</Code>', resp.body)
+        self.assertEqual(2, self._s3token_calls())
+        self.assertEqual(0, self.middleware._app.calls)
+        self.assertEqual({'state': 'open', 'fallback': 0, 'fail_fast': 1,
+                          'to_open': 1, 'to_half_open': 0, 'to_closed': 0},
+                         self.middleware.breaker_stats())
+
+    def test_keystone_errors_open_the_breaker(self):
+        self.requests_mock.post(self.TEST_URL, status_code=503)
+        self._make_request()
+        self._make_request()
+        self.assertEqual(503, self._make_request()[1].status_int)
+        self.assertEqual(2, self._s3token_calls())
+
+        # but rejected credentials do not
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.requests_mock.post(self.TEST_URL, status_code=401)
+        for _ in range(3):
+            self.assertEqual(401, self._make_request()[1].status_int)
+        self.assertEqual(5, self._s3token_calls())
+
+    def test_half_open(self):
+        self._make_request()
+        self._make_request()
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 10):
+            # a failing trial call opens the breaker again
+            self.assertEqual(503, self._make_request()[1].status_int)
+            self.assertEqual(3, self._s3token_calls())
+            self.assertEqual(503, self._make_request()[1].status_int)
+            self.assertEqual(3, self._s3token_calls())
+
+        self.requests_mock.post(self.TEST_URL, status_code=201,
+                                json=GOOD_RESPONSE_V2)
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 20):
+            self.assertEqual(200, self._make_request()[1].status_int)
+            self.assertEqual(200, self._make_request()[1].status_int)
+        self.assertEqual(5, self._s3token_calls())
+        stats = self.middleware.breaker_stats()
+        self.assertEqual('closed', stats['state'])
+        self.assertEqual((2, 2, 1), (stats['to_open'], stats['to_half_open'],
+                                     stats['to_closed']))
+
+    def test_deferred_rejection(self):
+        self.conf['delay_auth_decision'] = 'true'
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        for _ in range(3):
+            self.assertEqual(200, self._make_request()[1].status_int)
+        self.assertEqual(2, self._s3token_calls())
+        self.assertEqual(3, self.middleware._app.calls)
+
+    def test_stale_secret_fallback(self):
+        self.conf.update({
+            'secret_cache_duration': '60',
+            'stale_secret_duration': '65',
+            'username': 'swift',
+            'password': 'password',
+            'project_name': 'service',
+        })
+        self.middleware = s3_token.S3Token(FakeApp(), self.conf)
+        self.requests_mock.post(self.TEST_URL, status_code=201,
+                                json=GOOD_RESPONSE_V2)
+        self.requests_mock.post(
+            '%s/v3/auth/tokens' % self.TEST_AUTH_URI,
+            status_code=201, headers={'X-Subject-Token': 'SERVICE_TOKEN'},
+            json={'token': {}})
+        self.requests_mock.get(
+            '%s/v3/users/USER_ID/credentials/OS-EC2/access' %
+            self.TEST_AUTH_URI,
+            json={'credential': {'secret': 'secret'}})
+        check_signature = mock.MagicMock(
+            side_effect=lambda secret: secret == 'secret')
+        self._make_request(check_signature)
+        self.assertEqual(1, self._s3token_calls())
+
+        # Keystone goes down after the secret cache expired
+        self.requests_mock.post(self.TEST_URL,
+                                exc=requests.exceptions.ConnectTimeout)
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 61):
+            self._make_request(check_signature)
+            self._make_request(check_signature)
+            self.assertEqual(3, self._s3token_calls())
+
+            req, resp = self._make_request(check_signature)
+            self.assertEqual(200, resp.status_int)
+            self.assertTrue(req.path.startswith('/v1/AUTH_TENANT_ID/'))
+            self.assertEqual('TOKEN_ID', req.headers['X-Auth-Token'])
+
+            # a wrong signature is not checked by Keystone meanwhile
+            check_signature.side_effect = lambda secret: False
+            self.assertEqual(503, self._make_request(
+                check_signature)[1].status_int)
+        self.assertEqual(3, self._s3token_calls())
+        stats = self.middleware.breaker_stats()
+        self.assertEqual((1, 1), (stats['fallback'], stats['fail_fast']))
+
+        # stale secrets do not last forever
+        check_signature.side_effect = lambda secret: secret == 'secret'
+        with mock.patch('swift3.cache.time.time', return_value=1234 + 66):
+            self.assertEqual(503, self._make_request(
+                check_signature)[1].status_int)
+
+
 class S3TokenMiddlewareTestV3(S3TokenMiddlewareTestBase):
 
     def setUp(self):
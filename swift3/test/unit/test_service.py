@@ -22,8 +22,10 @@ from swift.common.utils import json
 
 from swift3.test.unit.test_s3_acl import s3acl
 from swift3.test.unit import Swift3TestCase
-from swift3.etree import fromstring
+from swift3.etree import fromstring, tostring
 from swift3.subresource import ACL, Owner, encode_acl
+from swift3.bucket_cache import BUCKET_OWNER_CACHE
+from swift3.response import InternalError
 
 
 def create_bucket_list_json(buckets):
@@ -66,6 +68,7 @@ class TestSwift3Service(Swift3TestCase):
                                      'Date': self.get_date_header()})
         status, headers, body = self.call_swift3(req)
         self.assertEqual(status.split()[0], '200')
+        self.assertEqual(str(len(body)), headers['Content-Length'])
 
         elem = fromstring(body, 'ListAllMyBucketsResult')
 
@@ -90,6 +93,7 @@ class TestSwift3Service(Swift3TestCase):
                                      'Date': self.get_date_header()})
         status, headers, body = self.call_swift3(req)
         self.assertEqual(status.split()[0], '200')
+        self.assertEqual(str(len(body)), headers['Content-Length'])
 
         elem = fromstring(body, 'ListAllMyBucketsResult')
 
@@ -136,6 +140,55 @@ class TestSwift3Service(Swift3TestCase):
         for i in expected:
             self.assertTrue(i[0] in names)
 
+    @patch('swift.common.constraints.ACCOUNT_LISTING_LIMIT', 2)
+    def test_service_GET_pages(self):
+        pages = ((('apple', 1, 200), ('orange', 3, 430)),
+                 (('192.168.0.1', 1, 200), ('pear', 1, 200)),
+                 (('zucchini', 1, 200),))
+        for marker, page in zip((None, 'orange', 'pear'), pages):
+            path = '/v1/AUTH_test?format=json&limit=2'
+            if marker:
+                path += '&marker=' + marker
+            self.swift.register('GET', path, swob.HTTPOk, {},
+                                create_bucket_list_json(page))
+
+        req = Request.blank('/',
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        status, headers, body = self.call_swift3(req)
+        self.assertEqual(status.split()[0], '200')
+        self.assertEqual(3, self.swift.call_count)
+
+        # the pages are streamed
+        self.assertNotIn('Content-Length', headers)
+
+        elem = fromstring(body, 'ListAllMyBucketsResult')
+        names = [b.find('./Name').text
+                 for b in elem.find('./Buckets').iterchildren('Bucket')]
+        self.assertEqual(['apple', 'orange', 'pear', 'zucchini'], names)
+
+        # the streamed document is the same as a serialized tree
+        self.assertEqual(tostring(elem), body)
+
+    @patch('swift.common.constraints.ACCOUNT_LISTING_LIMIT', 2)
+    def test_service_GET_pages_error(self):
+        self.swift.register('GET', '/v1/AUTH_test?format=json&limit=2',
+                            swob.HTTPOk, {}, create_bucket_list_json(
+                                (('apple', 1, 200), ('orange', 3, 430))))
+        self.swift.register('GET', '/v1/AUTH_test?format=json&limit=2'
+                            '&marker=orange', swob.HTTPServerError, {}, '')
+
+        req = Request.blank('/',
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers={'Authorization': 'AWS test:tester:hmac',
+                                     'Date': self.get_date_header()})
+        with patch('swift3.controllers.service.LOGGER') as mock_logger:
+            with self.assertRaises(InternalError):
+                self.call_swift3(req)
+        mock_logger.exception.assert_called_once_with(
+            'Aborting the bucket listing of %s', 'AUTH_test')
+
     @patch('swift3.cfg.CONF.check_bucket_owner', True)
     def _test_service_GET_for_check_bucket_owner(self, buckets):
 
@@ -190,6 +243,21 @@ class TestSwift3Service(Swift3TestCase):
         buckets = resp_buckets.iterchildren('Bucket')
         self.assertEqual(len(list(buckets)), 0)
 
+    @s3acl(s3acl_only=True)
+    def test_service_GET_bucket_owner_error(self):
+        bucket_list = []
+        for var in range(0, 3):
+            bucket = 'bucket%s' % var
+            self.swift.register('HEAD', '/v1/AUTH_test/%s' % bucket,
+                                swob.HTTPServerError, {}, None)
+            bucket_list.append((bucket, var, 300 + var))
+
+        # the owners of the first page are checked before the response
+        status, headers, body = \
+            self._test_service_GET_for_check_bucket_owner(bucket_list)
+        self.assertEqual(status.split()[0], '500')
+        self.assertEqual(self._get_error_code(body), 'InternalError')
+
     @s3acl(s3acl_only=True)
     def test_service_GET_bucekt_list(self):
         bucket_list = []
@@ -233,5 +301,40 @@ class TestSwift3Service(Swift3TestCase):
             self.assertTrue(i[0] in names)
         self.assertEqual(len(self.swift.calls_with_headers), 11)
 
+    @s3acl(s3acl_only=True)
+    @patch('swift3.cfg.CONF.bucket_owner_cache_time', 60)
+    @patch('swift3.cfg.CONF.check_bucket_owner_concurrency', 3)
+    def test_service_GET_bucket_list_owner_cache(self):
+        bucket_list = []
+        for var in range(0, 10):
+            user_id = 'test:tester' if var % 3 == 0 else 'test:other'
+            bucket = 'bucket%s' % var
+            owner = Owner(user_id, user_id)
+            headers = encode_acl('container', ACL(owner, []))
+            self.swift.register('HEAD', '/v1/AUTH_test/%s' % bucket,
+                                swob.HTTPNoContent, headers, None)
+            bucket_list.append((bucket, var, 300 + var))
+
+        def get_names():
+            status, headers, body = \
+                self._test_service_GET_for_check_bucket_owner(bucket_list)
+            self.assertEqual(status.split()[0], '200')
+            elem = fromstring(body, 'ListAllMyBucketsResult')
+            return [b.find('./Name').text
+                    for b in elem.find('./Buckets').iterchildren('Bucket')]
+
+        BUCKET_OWNER_CACHE.clear()
+        with patch.object(BUCKET_OWNER_CACHE, 'maxtime', 60):
+            expected = ['bucket0', 'bucket3', 'bucket6', 'bucket9']
+            self.assertEqual(expected, get_names())
+            self.assertEqual(11, self.swift.call_count)
+            self.assertEqual({'test:tester': False},
+                             BUCKET_OWNER_CACHE.get(('AUTH_test', 'bucket1')))
+
+            # the owner checks are cached
+            self.assertEqual(expected, get_names())
+            self.assertEqual(12, self.swift.call_count)
+        BUCKET_OWNER_CACHE.clear()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,127 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from swift3 import tracing
+
+
+class ListExporter(tracing.SpanExporter):
+    exported = []
+
+    def export(self, spans):
+        self.exported.append(spans)
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.trace_file = os.path.join(self.tmpdir, 'trace.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        tracing._current.trace = None
+
+    def test_bad_config(self):
+        with self.assertRaises(ValueError):
+            tracing.Tracer({'trace_sample_rate': '2'})
+        with self.assertRaises(ValueError):
+            tracing.Tracer({'trace_sample_rate': '1',
+                            'trace_exporter': 'swift3.tracing'})
+
+    def test_not_traced(self):
+        tracer = tracing.Tracer({})
+        self.assertFalse(tracer.enabled)
+        with tracing.span('parse') as span:
+            self.assertIsNone(span)
+
+        tracer = tracing.Tracer({'trace_sample_rate': '0.5'})
+        with mock.patch('random.random', return_value=0.6):
+            self.assertIsNone(tracer.start({}))
+            # an unsampled traceparent doesn't force the trace
+            self.assertIsNone(tracer.start({
+                'HTTP_TRACEPARENT':
+                '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00'}))
+        with tracing.span('parse') as span:
+            self.assertIsNone(span)
+
+    def test_spans(self):
+        tracer = tracing.Tracer({'trace_sample_rate': '1',
+                                 'trace_file': self.trace_file})
+        root = tracer.start({})
+        with tracing.span('controller', operation='GET.Bucket') as parent:
+            with tracing.span('backend', method='GET') as child:
+                pass
+            try:
+                with tracing.span('xml'):
+                    raise ValueError()
+            except ValueError:
+                pass
+        tracer.finish(root, status=200)
+
+        with tracing.span('parse') as span:
+            self.assertIsNone(span)
+
+        with open(self.trace_file) as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual(['backend', 'xml', 'controller', 'request'],
+                         [s['name'] for s in spans])
+        self.assertEqual(1, len(set(s['trace_id'] for s in spans)))
+        backend, xml, controller, request = spans
+        self.assertIsNone(request['parent_id'])
+        self.assertEqual({'status': 200}, request['attributes'])
+        self.assertEqual(request['span_id'], controller['parent_id'])
+        self.assertEqual(parent.span_id, controller['span_id'])
+        self.assertEqual(controller['span_id'], backend['parent_id'])
+        self.assertEqual(controller['span_id'], xml['parent_id'])
+        self.assertEqual({'method': 'GET'}, backend['attributes'])
+        self.assertEqual({'error': 'ValueError'}, xml['attributes'])
+        self.assertEqual('00-%s-%s-01' % (backend['trace_id'],
+                                          backend['span_id']),
+                         child.traceparent)
+
+    def test_traceparent(self):
+        tracer = tracing.Tracer({'trace_sample_rate': '0.01',
+                                 'trace_exporter':
+                                 'swift3.test.unit.test_tracing:'
+                                 'ListExporter'})
+        with mock.patch('random.random', return_value=0.5):
+            root = tracer.start({
+                'HTTP_TRACEPARENT':
+                '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'})
+        self.assertEqual('0af7651916cd43dd8448eb211c80319c',
+                         root.trace.trace_id)
+        self.assertEqual('b7ad6b7169203331', root.parent_id)
+        tracer.finish(root)
+        self.assertEqual([[root]], ListExporter.exported[-1:])
+
+    def test_export_error(self):
+        tracer = tracing.Tracer({
+            'trace_sample_rate': '1',
+            'trace_file': os.path.join(self.tmpdir, 'missing', 'trace.log')})
+        root = tracer.start({})
+        with mock.patch('swift3.tracing.LOGGER') as logger:
+            tracer.finish(root)
+        self.assertEqual(1, logger.warning.call_count)
+        self.assertIsNone(tracing._current.trace)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tracing of the phases of S3 requests.
+
+When ``trace_sample_rate`` is set, the middleware traces the sampled requests,
+and the requests coming with a sampled W3C ``traceparent`` header, which
+continue the trace of the caller.  A trace is made of timed spans, nested
+under the ``request`` span::
+
+    request
+      parse            the classification and parsing of the request
+        auth           the authentication, with s3_acl
+      controller       the dispatch to the controller
+        acl            an ACL check, with s3_acl
+        backend        a Swift subrequest
+        xml            the serialization of an XML document
+
+The Swift subrequests are sent with a ``traceparent`` header naming their
+``backend`` span, so that the spans of the proxy can be attached to the trace.
+The spans of a response body which is generated while it's sent, like the
+later pages of a listing, are children of the ``request`` span.  Once the
+body has been sent, the spans are handed to the exporter named by
+``trace_exporter``: either ``file``, which appends them as JSON lines to
+``trace_file`` from eventlet's thread pool, or the ``module:Class`` path of a
+:class:`SpanExporter` subclass, which is created with the middleware
+configuration.
+
+Code reports its spans with :func:`span`, which does nothing unless the
+current green thread is tracing a request.
+"""
+
+import json
+import random
+import re
+import time
+from uuid import uuid4
+
+from eventlet import tpool
+from eventlet.corolocal import local
+
+from swift3.utils import LOGGER
+
+_TRACEPARENT_RE = re.compile(
+    r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# the trace of the request handled by the current green thread, if any
+_current = local()
+
+
+class Span(object):
+    """
+    A timed phase of a request.  Entering a span makes it the parent of the
+    spans started until it is exited.
+    """
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = None
+        self.end = None
+
+    @property
+    def traceparent(self):
+        """
+        The traceparent header making a request a child of this span.
+        """
+        return '00-%s-%s-01' % (self.trace.trace_id, self.span_id)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.trace.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.end = time.time()
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.trace.stack.pop()
+        self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': self.end - self.start,
+            'attributes': self.attributes,
+        }
+
+
+class _NoSpan(object):
+    """
+    Stands for a span when the request is not traced.
+    """
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+
+class Trace(object):
+    """
+    The spans of a traced request.
+    """
+    def __init__(self, trace_id=None, parent_id=None):
+        self.trace_id = trace_id or uuid4().hex
+        self.parent_id = parent_id
+        # the spans entered and not exited yet, innermost last
+        self.stack = []
+        # the finished spans
+        self.spans = []
+
+    def span(self, name, **attributes):
+        parent_id = self.stack[-1].span_id if self.stack else self.parent_id
+        return Span(self, name, parent_id, attributes)
+
+
+def span(name, **attributes):
+    """
+    Returns a span of the request handled by the current green thread, to be
+    used as a context manager.  The context value is None if the request is
+    not traced.
+    """
+    trace = getattr(_current, 'trace', None)
+    if trace is None:
+        return _NO_SPAN
+    return trace.span(name, **attributes)
+
+
+class SpanExporter(object):
+    """
+    Base class of the destinations of the spans.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+
+    def export(self, spans):
+        """
+        Send the spans of a request.
+        """
+        raise NotImplementedError
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends the spans to trace_file, one JSON object per line.
+    """
+    def __init__(self, conf):
+        super(FileSpanExporter, self).__init__(conf)
+        self.path = conf.get('trace_file') or '/tmp/swift3-trace.log'
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(s.to_dict(), sort_keys=True) + '\n'
+                        for s in spans)
+        # don't block the other green threads on the disk
+        tpool.execute(self._write, lines)
+
+    def _write(self, lines):
+        with open(self.path, 'a') as f:
+            f.write(lines)
+
+
+def _load_exporter(conf):
+    name = conf.get('trace_exporter') or 'file'
+    if name == 'file':
+        return FileSpanExporter(conf)
+    module_name, _, class_name = name.partition(':')
+    if not class_name:
+        raise ValueError('trace_exporter must be file or module:Class, '
+                         'not %r' % name)
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)(conf)
+
+
+class Tracer(object):
+    """
+    Starts the traces of sampled requests, and exports them.
+    """
+    def __init__(self, conf):
+        self.sample_rate = float(conf.get('trace_sample_rate') or 0)
+        if not 0 <= self.sample_rate <= 1:
+            raise ValueError('trace_sample_rate must be between 0 and 1')
+        self.exporter = _load_exporter(conf) if self.sample_rate else None
+
+    @property
+    def enabled(self):
+        return bool(self.sample_rate)
+
+    def start(self, env):
+        """
+        Start tracing the request if it is sampled, and enter its root span.
+
+        :returns: the root span, or None if the request is not traced
+        """
+        trace = None
+        match = _TRACEPARENT_RE.match(env.get('HTTP_TRACEPARENT', ''))
+        if match and int(match.group(3), 16) & 1:
+            trace = Trace(match.group(1), match.group(2))
+        elif random.random() < self.sample_rate:
+            trace = Trace()
+        if trace is None:
+            return None
+
+        _current.trace = trace
+        return trace.span('request').__enter__()
+
+    def finish(self, root, **attributes):
+        """
+        Exit the root span, and export the spans of the request.
+        """
+        root.attributes.update(attributes)
+        root.__exit__(None, None, None)
+        _current.trace = None
+        try:
+            self.exporter.export(root.trace.spans)
+        except Exception as e:
+            LOGGER.warning('Failed to export trace %s: %s',
+                           root.trace.trace_id, e)
@@ -118,15 +118,23 @@ def is_valid_ipv6(ip):
     return True
 
 
+_IP_ADDRESS_RE = re.compile(
+    "^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.)"
+    "{3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$")
+_DNS_BUCKET_NAME_CHARS_RE = re.compile('^[-.a-z0-9]*$')
+_BUCKET_NAME_CHARS_RE = re.compile('^[-.a-z0-9A-Z_]*$')
+
+
 def validate_bucket_name(name):
         """
         Validates the name of the bucket against S3 criteria,
         http://docs.amazonwebservices.com/AmazonS3/latest/BucketRestrictions.html
         True is valid, False is invalid.
         """
-        valid_chars = '-.a-z0-9'
-        if not CONF.dns_compliant_bucket_names:
-            valid_chars += 'A-Z_'
+        if CONF.dns_compliant_bucket_names:
+            valid_chars = _DNS_BUCKET_NAME_CHARS_RE
+        else:
+            valid_chars = _BUCKET_NAME_CHARS_RE
         max_len = 63 if CONF.dns_compliant_bucket_names else 255
 
         if len(name) < 3 or len(name) > max_len or not name[0].isalnum():
@@ -143,12 +151,10 @@ def validate_bucket_name(name):
         elif name.endswith('.'):
             # Bucket names must not end with dot
             return False
-        elif re.match("^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.)"
-                      "{3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$",
-                      name):
+        elif _IP_ADDRESS_RE.match(name):
             # Bucket names cannot be formatted as an IP Address
             return False
-        elif not re.match("^[%s]*$" % valid_chars, name):
+        elif not valid_chars.match(name):
             # Bucket names can contain lowercase letters, numbers, and hyphens.
             return False
         else: